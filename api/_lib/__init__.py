@@ -0,0 +1,6 @@
+"""Shared helpers for the serverless functions under ``api/``.
+
+Vercel does not turn files that start with an underscore into functions,
+so everything in this package can be imported by the proxy and by the
+converter without becoming a route of its own.
+"""
@@ -0,0 +1,344 @@
+"""Disk-backed store of finished conversion outputs.
+
+Every artifact (an MPD plus its init and media segments) lives in its own
+directory under ``ARTIFACT_ROOT``.  ``index.json`` in the root records id,
+MPD name, creation time and size, and is rewritten atomically, so a
+restarted process (or the download function running in another process
+on the same disk) finds the artifacts already there.
+
+The converter writes into :func:`staging_dir` and publishes the result
+with :func:`register`; until then nothing can be downloaded.  A
+conversion whose output is pushed in file by file (see
+:mod:`api._lib.ingest`) instead calls :func:`reserve` first, so its
+segments can be downloaded while it runs, and :func:`register` at the end
+records the final size.  ``*.tmp`` files are writes still in progress and
+are never served.  A daemon
+sweeper deletes artifacts older than ``ARTIFACT_TTL`` and, oldest first,
+whatever exceeds ``ARTIFACT_MAX_BYTES``, plus staging directories left
+behind by crashed conversions.
+
+:func:`byte_range` and :func:`not_modified` implement the HTTP Range and
+conditional-request rules shared by the download endpoints.
+
+Tunables (environment):
+
+``ARTIFACT_ROOT``            store directory (default ``$TMPDIR/ds-artifacts``)
+``ARTIFACT_TTL``             seconds an artifact is kept (default 3600)
+``ARTIFACT_MAX_BYTES``       total size budget (default 5 GiB)
+``ARTIFACT_SWEEP_INTERVAL``  seconds between sweeps (default 60)
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+_STAGING_SUFFIX = '.partial'
+_PARTIAL_SUFFIX = '.tmp'
+_INDEX_NAME = 'index.json'
+
+# Content types for files produced by the DASH muxer
+CONTENT_TYPES = {
+    '.mpd': 'application/dash+xml',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+    '.m4a': 'audio/mp4',
+}
+
+
+def content_type(filename):
+    return CONTENT_TYPES.get(os.path.splitext(filename)[1], 'application/octet-stream')
+
+
+class Artifact:
+    __slots__ = ('id', 'directory', 'mpd_name', 'created', 'size')
+
+    def __init__(self, id, directory, mpd_name, created=None, size=0):
+        self.id = id
+        self.directory = directory
+        self.mpd_name = mpd_name
+        self.created = created if created is not None else time.time()
+        self.size = size
+
+    def path(self, filename):
+        """Absolute path of ``filename`` inside the artifact, or ``None``."""
+        candidate = os.path.normpath(os.path.join(self.directory, filename))
+        if os.path.dirname(candidate) != os.path.normpath(self.directory) or filename.endswith(_PARTIAL_SUFFIX):
+            return None
+        return candidate if os.path.isfile(candidate) else None
+
+    @property
+    def zip_name(self):
+        """Name under which the whole artifact downloads as one ZIP."""
+        return os.path.splitext(self.mpd_name)[0] + '.zip'
+
+    def files(self):
+        return sorted(name for name in os.listdir(self.directory)
+                      if not name.endswith(_PARTIAL_SUFFIX) and os.path.isfile(os.path.join(self.directory, name)))
+
+    def to_dict(self):
+        return {'mpd_name': self.mpd_name, 'created': self.created, 'size': self.size}
+
+
+def _directory_size(directory):
+    total = 0
+    for entry in os.scandir(directory):
+        if entry.is_file(follow_symlinks=False):
+            total += entry.stat().st_size
+    return total
+
+
+class ArtifactStore:
+    def __init__(self, root, ttl=3600.0, max_bytes=5 << 30, sweep_interval=60.0):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.swept = 0
+        self._lock = threading.Lock()
+        self._artifacts = {}
+        self._index_mtime = None
+        self._sweeper = None
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            root=os.environ.get('ARTIFACT_ROOT', os.path.join(tempfile.gettempdir(), 'ds-artifacts')),
+            ttl=float(os.environ.get('ARTIFACT_TTL', 3600)),
+            max_bytes=int(os.environ.get('ARTIFACT_MAX_BYTES', 5 << 30)),
+            sweep_interval=float(os.environ.get('ARTIFACT_SWEEP_INTERVAL', 60)),
+        )
+
+    # -- index -----------------------------------------------------------
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.root, _INDEX_NAME)
+
+    def _load_index(self):
+        """Re-read ``index.json`` if another process rewrote it."""
+        try:
+            mtime = os.stat(self._index_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._index_mtime:
+            return
+        try:
+            with open(self._index_path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._artifacts = {
+            artifact_id: Artifact(artifact_id, os.path.join(self.root, artifact_id),
+                                  entry['mpd_name'], entry['created'], entry.get('size', 0))
+            for artifact_id, entry in entries.items()
+        }
+        self._index_mtime = mtime
+
+    def _save_index(self):
+        fd, tmp = tempfile.mkstemp(prefix='.index-', dir=self.root)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({a.id: a.to_dict() for a in self._artifacts.values()}, f)
+        os.replace(tmp, self._index_path)
+        self._index_mtime = os.stat(self._index_path).st_mtime_ns
+
+    # -- lifecycle -------------------------------------------------------
+
+    def staging_dir(self, artifact_id):
+        """Empty directory the converter writes into before :meth:`register`."""
+        directory = os.path.join(self.root, artifact_id + _STAGING_SUFFIX)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        return directory
+
+    def reserve(self, artifact_id, mpd_name):
+        """Register ``artifact_id`` before its files exist; returns its directory.
+
+        Files that land in the directory are downloadable at once.
+        """
+        directory = os.path.join(self.root, artifact_id)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        with self._lock:
+            self._load_index()
+            self._artifacts[artifact_id] = Artifact(artifact_id, directory, mpd_name)
+            self._save_index()
+        return directory
+
+    def register(self, artifact_id, directory, mpd_name):
+        """Publish ``directory`` (moved into the store) as ``artifact_id``."""
+        final = os.path.join(self.root, artifact_id)
+        if os.path.normpath(directory) != final:
+            shutil.rmtree(final, ignore_errors=True)
+            shutil.move(directory, final)
+        artifact = Artifact(artifact_id, final, mpd_name, size=_directory_size(final))
+        with self._lock:
+            self._load_index()
+            self._artifacts[artifact_id] = artifact
+            self._save_index()
+        return artifact
+
+    def lookup(self, artifact_id):
+        """The live artifact, or ``None`` if unknown or past its TTL."""
+        with self._lock:
+            self._load_index()
+            artifact = self._artifacts.get(artifact_id)
+        if artifact is None or time.time() - artifact.created > self.ttl:
+            return None
+        return artifact
+
+    def remove(self, artifact_id):
+        """Forget ``artifact_id`` and delete its files."""
+        with self._lock:
+            self._load_index()
+            artifact = self._artifacts.pop(artifact_id, None)
+            if artifact is not None:
+                self._save_index()
+        if artifact is not None:
+            shutil.rmtree(artifact.directory, ignore_errors=True)
+        return artifact
+
+    # -- sweeping --------------------------------------------------------
+
+    def start_sweeper(self):
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_loop, name='artifact-sweeper', daemon=True)
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except OSError:
+                pass
+
+    def sweep(self, now=None):
+        """Delete expired and over-budget artifacts; return how many went."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._load_index()
+            by_age = sorted(self._artifacts.values(), key=lambda a: a.created)
+            total = sum(a.size for a in by_age)
+            doomed = []
+            for artifact in by_age:
+                if now - artifact.created > self.ttl or total > self.max_bytes:
+                    doomed.append(artifact)
+                    total -= artifact.size
+                    del self._artifacts[artifact.id]
+            if doomed:
+                self._save_index()
+            known = set(self._artifacts)
+        for artifact in doomed:
+            shutil.rmtree(artifact.directory, ignore_errors=True)
+
+        # Staging and unindexed directories: crashed or half-removed outputs
+        for entry in os.scandir(self.root):
+            name = entry.name
+            if not entry.is_dir(follow_symlinks=False) or name in known:
+                continue
+            if now - entry.stat().st_mtime > self.ttl:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        self.swept += len(doomed)
+        return len(doomed)
+
+    def stats(self):
+        with self._lock:
+            self._load_index()
+            return {
+                'artifacts': len(self._artifacts),
+                'bytes': sum(a.size for a in self._artifacts.values()),
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'swept': self.swept,
+            }
+
+
+# -- HTTP helpers ------------------------------------------------------------
+
+def file_validators(stat):
+    """``(etag, last_modified)`` for a file's ``os.stat`` result."""
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    return etag, formatdate(stat.st_mtime, usegmt=True)
+
+
+def not_modified(headers, etag, mtime):
+    """True when the request's validators match the current file."""
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def byte_range(headers, size, etag):
+    """``(start, end)`` inclusive for a satisfiable single Range, else ``None``.
+
+    Returns ``False`` when the range cannot be satisfied (416).  Multi-range
+    requests and ranges guarded by a stale ``If-Range`` get the whole file.
+    """
+    value = headers.get('Range')
+    if not value or not value.startswith('bytes=') or ',' in value:
+        return None
+    if_range = headers.get('If-Range')
+    if if_range and if_range.strip() != etag:
+        return None
+    first, _, last = value[len('bytes='):].strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        elif last:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        return False
+    return start, min(end, size - 1)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide artifact store, created on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ArtifactStore.from_env()
+                _store.start_sweeper()
+    return _store
+
+
+def staging_dir(artifact_id):
+    return get_store().staging_dir(artifact_id)
+
+
+def reserve(artifact_id, mpd_name):
+    return get_store().reserve(artifact_id, mpd_name)
+
+
+def register(artifact_id, directory, mpd_name):
+    return get_store().register(artifact_id, directory, mpd_name)
+
+
+def lookup(artifact_id):
+    return get_store().lookup(artifact_id)
+
+
+def remove(artifact_id):
+    return get_store().remove(artifact_id)
@@ -0,0 +1,558 @@
+"""Asyncio (ASGI) serving path for the proxy routes.
+
+The Flask app in ``api/index.py`` holds a worker thread for the whole
+life of every ``/channel/<id>`` stream.  This module serves the same
+routes from a single event loop, so one process can hold thousands of
+long-lived streams:
+
+    uvicorn api._lib.asgi:app --host 0.0.0.0 --port 8000
+
+Routes and payloads match the Flask app (``/playlist.m3u``,
+``/channel/<id>``, ``/channel/<id>/index.m3u8``,
+``/channel/<id>/segment/<name>``, ``/live/<id>/<name>``, ``/channels``,
+``/health``).  Live
+channels are fanned out by :class:`AsyncBroadcaster`, which shares one
+upstream stream per channel the same way the threaded broadcaster does,
+opened from the best-ranked mirror origin and reopened from the next one
+when it stalls (no data for ``ORIGIN_STALL_TIMEOUT``) or drops.
+Each viewer awaits the server's ``send()`` before taking the next chunk,
+so slow clients get backpressure without slowing anyone else; viewers
+that fall out of the ring are skipped forward or dropped.
+
+The Flask WSGI app stays the Vercel entry point; this module only adds a
+second way to serve it.
+"""
+import asyncio
+import json
+import os
+import time
+from urllib.parse import parse_qs
+
+import httpx
+
+from api import index
+from api._lib import metrics
+from api._lib.broadcast import ChunkRing
+from api._lib.hls import PLAYLIST_CONTENT_TYPE, UpstreamError, get_hls_hub
+from api._lib.live import MPD_NAME, LiveStartError, get_live_hub
+from api._lib.origins import get_origin_router
+
+
+def _client_from_env():
+    limits = httpx.Limits(
+        max_connections=int(os.environ.get('UPSTREAM_POOL_MAXSIZE', 64)) * 4,
+        max_keepalive_connections=int(os.environ.get('UPSTREAM_POOL_MAXSIZE', 64)),
+    )
+    timeout = httpx.Timeout(
+        connect=float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 3.05)),
+        read=float(os.environ.get('UPSTREAM_READ_TIMEOUT', 10)),
+        write=10.0,
+        pool=10.0,
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True)
+
+
+class AsyncBroadcaster:
+    """Asyncio counterpart of :class:`api._lib.broadcast.Broadcaster`."""
+
+    def __init__(self, key, client, urls, headers=None, buffer_bytes=8 << 20, chunk_size=64 << 10,
+                 grace_seconds=15.0, max_skips=3, max_failovers=3, on_close=None):
+        self.key = key
+        self.urls = urls
+        self.url = None
+        self.headers = headers
+        self.status_code = None
+        self.content_type = None
+        self.grace_seconds = grace_seconds
+        self.max_skips = max_skips
+        self.max_failovers = max_failovers
+        self.chunk_size = chunk_size
+
+        self._client = client
+        self._on_close = on_close
+        self._ring = ChunkRing(buffer_bytes)
+        self._cond = asyncio.Condition()
+        self._response = None
+        self._task = None
+        self._idle_handle = None
+        self._subscribers = 0
+        self._finished = False
+        self._closed = False
+
+        self.bytes_in = 0
+        self.failovers = 0
+        self.skips = 0
+        self.drops = 0
+
+    @property
+    def alive(self):
+        return not self._closed
+
+    async def _send(self, url):
+        # A read that waits longer than the stall timeout fails the origin over
+        router = get_origin_router()
+        timeout = httpx.Timeout(self._client.timeout.connect, read=router.stall_timeout)
+        request = self._client.build_request('GET', url, headers=self.headers, timeout=timeout)
+        return await self._client.send(request, stream=True)
+
+    async def _open(self):
+        self.url, response = await get_origin_router().open_stream_async(self.urls, self._send, httpx.HTTPError)
+        return response
+
+    async def start(self):
+        response = await self._open()
+        self.status_code = response.status_code
+        self.content_type = response.headers.get('Content-Type', 'video/mp2t')
+        if response.status_code != 200:
+            await response.aclose()
+            self._finished = self._closed = True
+            return self
+        self._response = response
+        self._task = asyncio.get_running_loop().create_task(self._read_loop())
+        self._schedule_idle_close()
+        return self
+
+    async def _pump(self):
+        """Relay the current upstream into the ring; True once it should stop."""
+        async for chunk in self._response.aiter_raw(self.chunk_size):
+            if not chunk:
+                continue
+            async with self._cond:
+                if self._closed:
+                    return True
+                self._ring.append(chunk)
+                self.bytes_in += len(chunk)
+                self._cond.notify_all()
+            metrics.RELAYED_BYTES.inc(len(chunk), direction='in', server='asgi')
+        return False
+
+    async def _fail_over(self, mark, empty):
+        """Reopen from the best origin while anyone watches; ``None`` to give up.
+
+        Returns the updated count of reopens in a row that delivered nothing.
+        """
+        empty = empty + 1 if self.bytes_in == mark else 0
+        if self._closed or self._subscribers == 0 or empty > self.max_failovers:
+            return None
+        try:
+            response = await self._open()
+        except httpx.HTTPError:
+            return None
+        if response.status_code != 200:
+            await response.aclose()
+            return None
+        self._response = response
+        self.failovers += 1
+        return empty
+
+    async def _read_loop(self):
+        mark, empty = None, 0
+        try:
+            while True:
+                try:
+                    if await self._pump():
+                        break
+                except httpx.HTTPError:
+                    pass
+                # The stream stalled, failed or ended: score the origin down
+                await self._response.aclose()
+                get_origin_router().record_stall(self.url)
+                empty = await self._fail_over(mark, empty)
+                if empty is None:
+                    break
+                mark = self.bytes_in
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await self._response.aclose()
+            async with self._cond:
+                self._finished = self._closed = True
+                self._cond.notify_all()
+            if self._on_close is not None:
+                self._on_close(self)
+
+    def _schedule_idle_close(self):
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+        self._idle_handle = asyncio.get_running_loop().call_later(self.grace_seconds, self._idle_close)
+
+    def _idle_close(self):
+        self._idle_handle = None
+        if self._subscribers == 0 and self._task is not None:
+            self._closed = True
+            self._task.cancel()
+
+    def touch(self):
+        if self._subscribers == 0 and not self._closed:
+            self._schedule_idle_close()
+
+    async def subscribe(self, wait_timeout=None):
+        """Async generator of chunks for one viewer."""
+        if self._closed:
+            return
+        if wait_timeout is None:
+            wait_timeout = self.grace_seconds
+        self._subscribers += 1
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        seq = max(self._ring.first_seq, self._ring.next_seq - 4)
+        skips = 0
+        try:
+            while True:
+                async with self._cond:
+                    while seq >= self._ring.next_seq and not self._finished:
+                        try:
+                            await asyncio.wait_for(self._cond.wait(), wait_timeout)
+                        except asyncio.TimeoutError:
+                            return
+                    if seq < self._ring.first_seq:
+                        skips += 1
+                        self.skips += 1
+                        if skips > self.max_skips:
+                            self.drops += 1
+                            return
+                        seq = max(self._ring.first_seq, self._ring.next_seq - 1)
+                    chunks = self._ring.read_from(seq)
+                    if not chunks and self._finished:
+                        return
+                seq += len(chunks)
+                metrics.RELAYED_BYTES.inc(sum(map(len, chunks)), direction='out', server='asgi')
+                for chunk in chunks:
+                    yield chunk
+        finally:
+            self._subscribers -= 1
+            if self._subscribers == 0 and not self._closed:
+                self._schedule_idle_close()
+
+    def stats(self):
+        return {
+            'subscribers': self._subscribers,
+            'buffered_bytes': self._ring.size,
+            'bytes_in': self.bytes_in,
+            'source': self.url,
+            'failovers': self.failovers,
+            'skips': self.skips,
+            'drops': self.drops,
+            'alive': not self._closed,
+        }
+
+
+class AsyncBroadcastHub:
+    def __init__(self, client):
+        self.client = client
+        self.buffer_bytes = int(os.environ.get('BROADCAST_BUFFER_BYTES', 8 << 20))
+        self.chunk_size = int(os.environ.get('BROADCAST_CHUNK_SIZE', 64 << 10))
+        self.grace_seconds = float(os.environ.get('BROADCAST_GRACE_SECONDS', 15))
+        self.max_skips = int(os.environ.get('BROADCAST_MAX_SKIPS', 3))
+        self._broadcasters = {}
+        self._starting = {}
+
+    async def acquire(self, key, urls, headers=None):
+        """A running broadcaster for ``key``, opened from the best of ``urls``."""
+        while True:
+            current = self._broadcasters.get(key)
+            if current is not None and current.alive:
+                current.touch()
+                return current
+            pending = self._starting.get(key)
+            if pending is not None:
+                await asyncio.shield(pending)
+                continue
+            pending = self._starting[key] = asyncio.get_running_loop().create_future()
+            try:
+                broadcaster = await AsyncBroadcaster(
+                    key, self.client, urls, headers=headers,
+                    buffer_bytes=self.buffer_bytes,
+                    chunk_size=self.chunk_size,
+                    grace_seconds=self.grace_seconds,
+                    max_skips=self.max_skips,
+                    on_close=self._forget,
+                ).start()
+                if broadcaster.alive:
+                    self._broadcasters[key] = broadcaster
+                return broadcaster
+            finally:
+                del self._starting[key]
+                pending.set_result(None)
+
+    def _forget(self, broadcaster):
+        if self._broadcasters.get(broadcaster.key) is broadcaster:
+            del self._broadcasters[broadcaster.key]
+
+    def stats(self):
+        return {key: b.stats() for key, b in self._broadcasters.items()}
+
+
+class ProxyApp:
+    """Minimal ASGI application serving the proxy routes."""
+
+    def __init__(self):
+        self.client = None
+        self.hub = None
+
+    def _ensure_started(self):
+        index.ensure_prober()
+        if self.client is None:
+            self.client = _client_from_env()
+            self.hub = AsyncBroadcastHub(self.client)
+            metrics.register_collector(self._collect)
+
+    def _collect(self):
+        yield ('stream_viewers', 'gauge', 'Viewers attached to a shared upstream stream.',
+               [({'channel': key, 'server': 'asgi'}, b['subscribers']) for key, b in self.hub.stats().items()])
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        self._ensure_started()
+
+        parts = [p for p in scope['path'].split('/') if p]
+        started = time.perf_counter()
+        status = [500]
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                metrics.REQUEST_DURATION.observe(time.perf_counter() - started, route=_route(parts),
+                                                 method=scope['method'], status=status[0])
+            await send(message)
+
+        await self._dispatch(scope, receive, timed_send, parts)
+
+    async def _dispatch(self, scope, receive, send, parts):
+        method = scope['method']
+        if method not in ('GET', 'HEAD'):
+            await _respond(send, 405, b'Method not allowed', 'text/plain', head=False)
+            return
+        head = method == 'HEAD'
+
+        if parts == ['metrics']:
+            await _respond(send, 200, metrics.render().encode('utf-8'), metrics.CONTENT_TYPE, head=head)
+        elif parts == ['playlist.m3u']:
+            await _respond_payload(send, index.playlist_payload(), scope, head)
+        elif parts == ['channels']:
+            try:
+                filters = index.channel_filters(_query(scope))
+            except ValueError as e:
+                await _respond_json(send, 400, {'error': str(e)}, head=head)
+                return
+            await _respond_payload(send, index.channels_payload(_host_url(scope), filters), scope, head)
+        elif parts == ['health']:
+            await self._health(send, head)
+        elif parts[:1] == ['channel'] and len(parts) == 2:
+            await self._channel(parts[1], receive, send, head)
+        elif parts[:1] == ['channel'] and len(parts) == 3 and parts[2] == 'status':
+            await self._channel_status(parts[1], send, head)
+        elif parts[:1] == ['channel'] and len(parts) == 3 and parts[2] == 'index.m3u8':
+            await self._hls(parts[1], None, send, head)
+        elif parts[:1] == ['channel'] and len(parts) == 4 and parts[2] == 'segment':
+            await self._hls(parts[1], parts[3], send, head)
+        elif parts[:1] == ['live'] and len(parts) == 3:
+            await self._live(parts[1], parts[2], send, head)
+        else:
+            await _respond(send, 404, b'Not found', 'text/plain', head=head)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._ensure_started()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.client is not None:
+                    await self.client.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _channel(self, channel_id, receive, send, head):
+        channel = index.CATALOG.get(channel_id)
+        if channel is None:
+            await _respond(send, 404, b'Channel not found', 'text/plain', head=head)
+            return
+        try:
+            broadcaster = await self.hub.acquire(channel_id, index.channel_sources(channel), channel.request_headers())
+        except httpx.HTTPError as e:
+            await _respond(send, 500, f'Error: {e}'.encode('utf-8'), 'text/plain', head=head)
+            return
+        if broadcaster.status_code != 200:
+            await _respond(send, broadcaster.status_code,
+                           f'Error: {broadcaster.status_code}'.encode('utf-8'), 'text/plain', head=head)
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': _headers(broadcaster.content_type, {
+                'Cache-Control': 'public, max-age=300',
+            }),
+        })
+        if head:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    disconnected.set()
+                    return
+
+        watcher = asyncio.get_running_loop().create_task(watch_disconnect())
+        chunks = broadcaster.subscribe()
+        try:
+            async for chunk in chunks:
+                if disconnected.is_set():
+                    break
+                # Awaiting send() is the backpressure point for this viewer.
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not disconnected.is_set():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            watcher.cancel()
+            await chunks.aclose()
+
+    async def _hls(self, channel_id, segment_name, send, head):
+        entry = index.CATALOG.get(channel_id)
+        if entry is None:
+            await _respond(send, 404, b'Channel not found', 'text/plain', head=head)
+            return
+        channel = get_hls_hub().channel(channel_id, index.hls_source(entry), entry.request_headers(),
+                                        fetch=index.channel_fetch(entry))
+        try:
+            # The HLS hub is shared with the WSGI app and does short blocking
+            # fetches; keep them off the event loop.
+            if segment_name is None:
+                body = await asyncio.to_thread(channel.playlist)
+                await _respond(send, 200, body, PLAYLIST_CONTENT_TYPE, head=head,
+                               headers={'Cache-Control': 'no-cache'})
+                return
+            segment = await asyncio.to_thread(channel.segment, segment_name)
+        except UpstreamError as e:
+            await _respond(send, e.status_code, f'Error: {e.status_code}'.encode('utf-8'), 'text/plain', head=head)
+            return
+        except Exception as e:
+            await _respond(send, 502, f'Error: {e}'.encode('utf-8'), 'text/plain', head=head)
+            return
+        if segment is None:
+            await _respond(send, 404, b'Segment not found', 'text/plain', head=head)
+            return
+        content_type, data = segment
+        # A master playlist's renditions are live playlists, not segments
+        cache_control = 'no-cache' if content_type == PLAYLIST_CONTENT_TYPE else 'public, max-age=60'
+        await _respond(send, 200, data, content_type, head=head, headers={'Cache-Control': cache_control})
+
+    async def _live(self, channel_id, name, send, head):
+        channel = index.CATALOG.get(channel_id)
+        if channel is None:
+            await _respond(send, 404, b'Channel not found', 'text/plain', head=head)
+            return
+        # The first MPD request waits for ffmpeg to start; keep it off the loop.
+        hub = get_live_hub()
+        try:
+            entry = await asyncio.to_thread(
+                hub.read, channel_id, get_origin_router().rank(index.channel_sources(channel, hls=True))[0],
+                name, channel.request_headers())
+        except LiveStartError as e:
+            await _respond(send, 502, f'Error: {e}'.encode(), 'text/plain', head=head,
+                           headers={'Retry-After': str(int(hub.start_cooldown))})
+            return
+        if entry is None:
+            if name == MPD_NAME:
+                await _respond(send, 503, b'Live stream is starting', 'text/plain', head=head,
+                               headers={'Retry-After': '2'})
+            else:
+                await _respond(send, 404, b'Segment not found', 'text/plain', head=head)
+            return
+        content_type, data = entry
+        await _respond(send, 200, data, content_type, head=head,
+                       headers={'Cache-Control': 'no-cache' if name == MPD_NAME else 'public, max-age=60'})
+
+    async def _health(self, send, head):
+        report, status = index.health_report()
+        report['async_broadcasts'] = self.hub.stats()
+        await _respond_json(send, status, report, head=head)
+
+    async def _channel_status(self, channel_id, send, head):
+        if channel_id not in index.CATALOG:
+            await _respond_json(send, 404, {'error': 'Channel not found'}, head=head)
+            return
+        status = index.PROBER.status(channel_id) or {'status': 'unknown'}
+        await _respond_json(send, 200, {'id': channel_id, **status}, head=head)
+
+
+def _route(parts):
+    """Route template for metrics labels, matching the Flask rule names."""
+    if len(parts) == 1 and parts[0] in ('metrics', 'playlist.m3u', 'channels', 'health'):
+        return '/' + parts[0]
+    if parts[:1] == ['channel']:
+        if len(parts) == 2:
+            return '/channel/<channel_id>'
+        if len(parts) == 3 and parts[2] in ('status', 'index.m3u8'):
+            return f'/channel/<channel_id>/{parts[2]}'
+        if len(parts) == 4 and parts[2] == 'segment':
+            return '/channel/<channel_id>/segment/<name>'
+    if parts[:1] == ['live'] and len(parts) == 3:
+        return '/live/<channel_id>/<name>'
+    return 'unmatched'
+
+
+def _host_url(scope):
+    headers = dict(scope.get('headers') or [])
+    host = headers.get(b'host', b'localhost').decode('latin-1')
+    return f"{scope.get('scheme', 'http')}://{host}/"
+
+
+def _query(scope):
+    return {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+
+
+def _request_headers(scope):
+    """Request headers keyed by canonical name (``Accept-Encoding``)."""
+    return {
+        '-'.join(part.capitalize() for part in key.decode('latin-1').split('-')): value.decode('latin-1')
+        for key, value in scope.get('headers') or []
+    }
+
+
+def _headers(content_type, extra=None, length=None):
+    headers = [
+        (b'content-type', content_type.encode('latin-1')),
+        (b'access-control-allow-origin', b'*'),
+    ]
+    if length is not None:
+        headers.append((b'content-length', str(length).encode('latin-1')))
+    for key, value in (extra or {}).items():
+        headers.append((key.lower().encode('latin-1'), str(value).encode('latin-1')))
+    return headers
+
+
+async def _respond(send, status, body, content_type, head=False, headers=None):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': _headers(content_type, headers, length=len(body)),
+    })
+    await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+
+async def _respond_payload(send, payload, scope, head):
+    status, headers, body = payload.respond(_request_headers(scope))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+
+async def _respond_json(send, status, payload, head=False):
+    await _respond(send, status, json.dumps(payload).encode('utf-8'), 'application/json', head=head)
+
+
+app = ProxyApp()
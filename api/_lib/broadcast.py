@@ -0,0 +1,432 @@
+"""One upstream stream per channel, fanned out to any number of viewers.
+
+A :class:`Broadcaster` owns a single upstream response and a reader
+thread that appends chunks to a bounded :class:`ChunkRing`.  Every viewer
+is a subscriber holding its own sequence number into the ring, so a slow
+viewer never holds back the reader or the other viewers: when the data it
+still needs has been evicted it is skipped forward to the live edge, and
+after too many skips it is dropped.
+
+When the last subscriber leaves, the upstream is kept open for a grace
+period so that channel zapping or a player reconnect does not pay for a
+new origin connection; after that the broadcaster shuts itself down.
+
+Tunables (environment):
+
+``BROADCAST_BUFFER_BYTES``   ring capacity per channel (default 8 MiB)
+``BROADCAST_CHUNK_SIZE``     largest chunk read from the upstream (default 1 MiB)
+``BROADCAST_FLUSH_MS``       stream time each chunk aims to hold (default 50)
+``BROADCAST_GRACE_SECONDS``  idle time before the upstream is closed (default 15)
+``BROADCAST_MAX_SKIPS``      skips tolerated before a viewer is dropped (default 3)
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from api._lib.metrics import RELAYED_BYTES
+from api._lib.relay import ChunkReader
+
+
+class ChunkRing:
+    """Bounded FIFO of byte chunks addressed by a monotonically rising sequence.
+
+    The ring does no locking of its own; callers hold the broadcaster's lock.
+    """
+
+    __slots__ = ('capacity', 'size', '_chunks', '_first_seq')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 0
+        self._chunks = deque()
+        self._first_seq = 0
+
+    @property
+    def first_seq(self):
+        """Sequence number of the oldest chunk still held."""
+        return self._first_seq
+
+    @property
+    def next_seq(self):
+        """Sequence number the next appended chunk will get."""
+        return self._first_seq + len(self._chunks)
+
+    def append(self, chunk):
+        self._chunks.append(chunk)
+        self.size += len(chunk)
+        # Always keep the newest chunk, even if it alone exceeds capacity.
+        while self.size > self.capacity and len(self._chunks) > 1:
+            self.size -= len(self._chunks.popleft())
+            self._first_seq += 1
+
+    def get(self, seq):
+        """Chunk ``seq``, or ``None`` if it was evicted or not written yet."""
+        index = seq - self._first_seq
+        if 0 <= index < len(self._chunks):
+            return self._chunks[index]
+        return None
+
+    def read_from(self, seq, max_chunks=16):
+        """Up to ``max_chunks`` consecutive chunks starting at ``seq``."""
+        start = seq - self._first_seq
+        if start < 0:
+            return []
+        end = min(len(self._chunks), start + max_chunks)
+        return [self._chunks[i] for i in range(start, end)]
+
+
+class SlowConsumer(Exception):
+    """Raised inside a subscriber that fell behind too many times."""
+
+
+class Broadcaster:
+    """Fan one upstream response out to many subscribers."""
+
+    def __init__(self, key, open_upstream, buffer_bytes=8 << 20, chunk_size=1 << 20,
+                 flush_interval=0.05, grace_seconds=15.0, max_skips=3, max_failovers=3,
+                 on_close=None):
+        self.key = key
+        self.content_type = None
+        self.status_code = None
+        self.buffer_bytes = buffer_bytes
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.grace_seconds = grace_seconds
+        self.max_skips = max_skips
+        self.max_failovers = max_failovers
+
+        self._open_upstream = open_upstream
+        self._on_close = on_close
+        self._ring = ChunkRing(buffer_bytes)
+        self._cond = threading.Condition()
+        self._subscribers = 0
+        self._idle_since = None
+        self._finished = False
+        self._closed = False
+        self._error = None
+        self._upstream = None
+        self._release = None
+        self._reader = None
+        self._failover_mark = None
+        self._empty_failovers = 0
+
+        self.bytes_in = 0
+        self.failovers = 0
+        self.skips = 0
+        self.drops = 0
+
+    # -- lifecycle -----------------------------------------------------
+
+    def start(self):
+        """Open the upstream synchronously and start the reader thread.
+
+        ``open_upstream`` returns ``(response, release)`` where ``release``
+        closes the response; after a mid-stream failure it is called with
+        the exception.  A non-200 answer is left for the caller to report;
+        the broadcaster is marked finished in that case.
+        """
+        response, release = self._open_upstream()
+        self.status_code = response.status_code
+        self.content_type = response.headers.get('Content-Type', 'video/mp2t')
+        if response.status_code != 200:
+            release()
+            self._finished = self._closed = True
+            return self
+        self._upstream = response
+        self._release = release
+        self._idle_since = time.monotonic()
+        threading.Thread(target=self._read_loop, name=f'broadcast-{self.key}', daemon=True).start()
+        return self
+
+    @property
+    def alive(self):
+        return not self._closed
+
+    def _chunks(self):
+        """Iterator of upstream chunks for the reader thread."""
+        self._reader = ChunkReader(self._upstream, max_chunk=self.chunk_size,
+                                   flush_interval=self.flush_interval)
+        return self._reader
+
+    def _read_loop(self):
+        try:
+            while True:
+                try:
+                    if self._pump():
+                        return
+                    error = EOFError('upstream ended')
+                except Exception as e:
+                    error = e
+                self._error = error
+                if not self._fail_over(error):
+                    return
+        finally:
+            self._shutdown()
+
+    def _pump(self):
+        """Relay the current upstream into the ring; True once the broadcaster should stop."""
+        for chunk in self._chunks():
+            if not chunk:
+                continue
+            with self._cond:
+                if self._closed:
+                    return True
+                self._ring.append(chunk)
+                self.bytes_in += len(chunk)
+                self._cond.notify_all()
+                expired = self._subscribers == 0 and self._idle_expired()
+            RELAYED_BYTES.inc(len(chunk), direction='in', server='wsgi')
+            if expired:
+                return True
+        return False
+
+    def _fail_over(self, error):
+        """Reopen the upstream after it stalled or dropped, while anyone watches.
+
+        ``release`` is told the error so the origin is scored down and
+        ``open_upstream`` can pick another one.  Gives up after
+        ``max_failovers`` reopens in a row that delivered nothing.
+        """
+        with self._cond:
+            if self._closed or self._subscribers == 0:
+                return False
+        if self.bytes_in == self._failover_mark:
+            self._empty_failovers += 1
+        else:
+            self._empty_failovers = 0
+        if self._empty_failovers > self.max_failovers:
+            return False
+        self._failover_mark = self.bytes_in
+
+        release, self._release = self._release, None
+        if release is not None:
+            release(error)
+        try:
+            response, release = self._open_upstream()
+        except Exception as e:
+            self._error = e
+            return False
+        if response.status_code != 200:
+            release()
+            return False
+        self._upstream, self._release = response, release
+        self.failovers += 1
+        return True
+
+    def _idle_expired(self):
+        return (self._idle_since is not None
+                and time.monotonic() - self._idle_since >= self.grace_seconds)
+
+    def _shutdown(self):
+        with self._cond:
+            if self._finished:
+                return
+            self._finished = self._closed = True
+            self._cond.notify_all()
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+        if self._on_close is not None:
+            self._on_close(self)
+
+    def close(self):
+        """Stop reading; subscribers drain what they have and then end."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def reap_if_idle(self):
+        """Close the upstream if nobody has watched for the grace period.
+
+        The reader thread checks this itself on every chunk; this hook is
+        for stalled upstreams that produce no chunks to trigger the check.
+        """
+        with self._cond:
+            expired = self._subscribers == 0 and self._idle_expired()
+        if expired:
+            self.close()
+        return expired
+
+    # -- subscribers ---------------------------------------------------
+
+    def _attach(self):
+        with self._cond:
+            if self._closed:
+                return None
+            self._subscribers += 1
+            self._idle_since = None
+            # Start a little behind the live edge so the player gets data
+            # immediately instead of waiting for the next upstream read.
+            return max(self._ring.first_seq, self._ring.next_seq - 4)
+
+    def touch(self):
+        """Restart the grace period for a viewer that is about to subscribe."""
+        with self._cond:
+            if self._subscribers == 0 and self._idle_since is not None:
+                self._idle_since = time.monotonic()
+
+    def _detach(self):
+        with self._cond:
+            self._subscribers -= 1
+            if self._subscribers == 0:
+                self._idle_since = time.monotonic()
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    def subscribe(self, wait_timeout=None):
+        """Generator of chunks for one viewer; closes cleanly on disconnect."""
+        seq = self._attach()
+        if seq is None:
+            return
+        if wait_timeout is None:
+            wait_timeout = self.grace_seconds
+        skips = 0
+        try:
+            while True:
+                with self._cond:
+                    while seq >= self._ring.next_seq and not self._finished:
+                        if not self._cond.wait(timeout=wait_timeout):
+                            return
+                    if seq < self._ring.first_seq:
+                        # Fell out of the ring: jump to the live edge.
+                        skips += 1
+                        self.skips += 1
+                        if skips > self.max_skips:
+                            self.drops += 1
+                            raise SlowConsumer(self.key)
+                        seq = max(self._ring.first_seq, self._ring.next_seq - 1)
+                    chunks = self._ring.read_from(seq)
+                    if not chunks and self._finished:
+                        return
+                seq += len(chunks)
+                RELAYED_BYTES.inc(sum(map(len, chunks)), direction='out', server='wsgi')
+                for chunk in chunks:
+                    yield chunk
+        except SlowConsumer:
+            return
+        finally:
+            self._detach()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'subscribers': self._subscribers,
+                'buffered_bytes': self._ring.size,
+                'bytes_in': self.bytes_in,
+                'chunk_bytes': self._reader.target if self._reader else None,
+                'direct_read': self._reader.direct if self._reader else None,
+                'skips': self.skips,
+                'drops': self.drops,
+                'failovers': self.failovers,
+                'alive': not self._closed,
+                'error': str(self._error) if self._error else None,
+            }
+
+
+class BroadcastHub:
+    """Registry of live broadcasters keyed by channel id."""
+
+    def __init__(self, buffer_bytes=8 << 20, chunk_size=1 << 20, flush_interval=0.05,
+                 grace_seconds=15.0, max_skips=3):
+        self.buffer_bytes = buffer_bytes
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.grace_seconds = grace_seconds
+        self.max_skips = max_skips
+        self._lock = threading.Lock()
+        self._starting = {}
+        self._broadcasters = {}
+        self._reaper = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            buffer_bytes=int(os.environ.get('BROADCAST_BUFFER_BYTES', 8 << 20)),
+            chunk_size=int(os.environ.get('BROADCAST_CHUNK_SIZE', 1 << 20)),
+            flush_interval=float(os.environ.get('BROADCAST_FLUSH_MS', 50)) / 1000,
+            grace_seconds=float(os.environ.get('BROADCAST_GRACE_SECONDS', 15)),
+            max_skips=int(os.environ.get('BROADCAST_MAX_SKIPS', 3)),
+        )
+
+    def acquire(self, key, open_upstream):
+        """Return a running broadcaster for ``key``, starting one if needed.
+
+        Concurrent first viewers wait for a single upstream open instead of
+        racing to open several.
+        """
+        while True:
+            with self._lock:
+                current = self._broadcasters.get(key)
+                if current is not None and current.alive:
+                    current.touch()
+                    return current
+                pending = self._starting.get(key)
+                if pending is None:
+                    pending = self._starting[key] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                pending.wait()
+                continue
+            try:
+                broadcaster = Broadcaster(
+                    key, open_upstream,
+                    buffer_bytes=self.buffer_bytes,
+                    chunk_size=self.chunk_size,
+                    flush_interval=self.flush_interval,
+                    grace_seconds=self.grace_seconds,
+                    max_skips=self.max_skips,
+                    on_close=self._forget,
+                ).start()
+                if broadcaster.alive:
+                    with self._lock:
+                        self._broadcasters[key] = broadcaster
+                    self._ensure_reaper()
+                return broadcaster
+            finally:
+                with self._lock:
+                    self._starting.pop(key, None)
+                pending.set()
+
+    def _forget(self, broadcaster):
+        with self._lock:
+            if self._broadcasters.get(broadcaster.key) is broadcaster:
+                del self._broadcasters[broadcaster.key]
+
+    def _ensure_reaper(self):
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name='broadcast-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(1.0, self.grace_seconds / 3))
+            with self._lock:
+                current = list(self._broadcasters.values())
+            for broadcaster in current:
+                broadcaster.reap_if_idle()
+
+    def stats(self):
+        with self._lock:
+            current = dict(self._broadcasters)
+        return {key: b.stats() for key, b in current.items()}
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    """Process-wide hub, created on first use."""
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = BroadcastHub.from_env()
+    return _hub
@@ -0,0 +1,305 @@
+"""Streaming M3U/EXTINF parser and an indexed, compact channel catalog.
+
+:func:`iter_m3u` reads a playlist line by line and yields one
+:class:`Channel` per URL line, so a 100k-entry playlist is never held in
+memory as text.  It understands the format in the repo's ``a.m3u``::
+
+    #EXTINF:-1 tvg-id="MBC2.ae" tvg-name="MBC 2 HD" tvg-logo="..." group-title="MBC",MBC 2 HD
+    #EXTVLCOPT:http-user-agent=Mozilla/5.0 ...
+    #EXTVLCOPT:http-referer=https://www.starzplay.com/
+    #KODIPROP:inputstream=inputstream.adaptive
+    https://.../MBC_2HD.mpd
+
+:class:`Catalog` stores channels as ``__slots__`` records in a list and
+keeps integer-posting indexes by id, tvg-id, group, normalized name and
+name token, which back filtering, search and pagination on ``/channels``.
+"""
+import hashlib
+import posixpath
+import re
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+_EXTINF_ATTR = re.compile(r'([A-Za-z0-9_-]+)="([^"]*)"')
+# Duration and attributes: everything up to the first comma outside quotes
+_EXTINF_HEAD = re.compile(r'(?:[^",]+|"[^"]*")*')
+_NON_WORD = re.compile(r'[^\w]+', re.UNICODE)
+
+# EXTINF attributes stored in dedicated slots; anything else goes to ``attrs``.
+_KNOWN_ATTRS = ('tvg-id', 'tvg-name', 'tvg-logo', 'group-title')
+
+
+def normalize_name(name):
+    """Case-, accent- and punctuation-insensitive form of a channel name."""
+    folded = name.casefold()
+    if not folded.isascii():
+        decomposed = unicodedata.normalize('NFKD', folded)
+        folded = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(_NON_WORD.sub(' ', folded).split())
+
+
+class Channel:
+    """One playlist entry."""
+
+    __slots__ = ('id', 'name', 'url', 'duration', 'tvg_id', 'tvg_name', 'tvg_logo',
+                 'group', 'attrs', 'options', 'props')
+
+    def __init__(self, id, name, url, duration='-1', tvg_id=None, tvg_name=None,
+                 tvg_logo=None, group=None, attrs=None, options=None, props=None):
+        self.id = id
+        self.name = name
+        self.url = url
+        self.duration = duration
+        self.tvg_id = tvg_id
+        self.tvg_name = tvg_name
+        self.tvg_logo = tvg_logo
+        self.group = group
+        self.attrs = attrs        # extra EXTINF attributes, or None
+        self.options = options    # EXTVLCOPT values ("key=value"), or None
+        self.props = props        # KODIPROP values ("key=value"), or None
+
+    def request_headers(self):
+        """Upstream HTTP headers requested by the entry's EXTVLCOPT lines."""
+        headers = {}
+        for option in self.options or ():
+            key, _, value = option.partition('=')
+            key = key.strip().lower()
+            if key == 'http-user-agent':
+                headers['User-Agent'] = value
+            elif key in ('http-referrer', 'http-referer'):
+                headers['Referer'] = value
+            elif key == 'http-origin':
+                headers['Origin'] = value
+        return headers
+
+    def extinf(self):
+        parts = [f'#EXTINF:{self.duration}']
+        for attr, value in (('tvg-id', self.tvg_id), ('tvg-name', self.tvg_name),
+                            ('tvg-logo', self.tvg_logo), ('group-title', self.group)):
+            if value is not None:
+                parts.append(f'{attr}="{value}"')
+        for attr, value in (self.attrs or {}).items():
+            parts.append(f'{attr}="{value}"')
+        return ' '.join(parts) + ',' + self.name
+
+    def m3u_lines(self, url=None):
+        """The entry as playlist lines, headers and properties preserved."""
+        lines = [self.extinf()]
+        lines.extend(f'#EXTVLCOPT:{option}' for option in self.options or ())
+        lines.extend(f'#KODIPROP:{prop}' for prop in self.props or ())
+        lines.append(url or self.url)
+        return lines
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'tvg_id': self.tvg_id,
+            'group': self.group,
+            'logo': self.tvg_logo,
+        }
+
+
+def _parse_extinf(line):
+    """``(duration, attrs, title)`` from an ``#EXTINF:`` line."""
+    body = line[len('#EXTINF:'):]
+    # The title follows the first comma that is not inside an attribute
+    # value; it may itself contain quotes and commas.
+    split_at = body.find(',', _EXTINF_HEAD.match(body).end())
+    head, title = (body, '') if split_at < 0 else (body[:split_at], body[split_at + 1:])
+    duration = head.split(None, 1)[0] if head.strip() else '-1'
+    return duration, dict(_EXTINF_ATTR.findall(head)), title.strip()
+
+
+def iter_m3u(lines):
+    """Yield :class:`Channel` records (without ids) from an iterable of lines.
+
+    ``lines`` may yield ``str`` or ``bytes``; nothing beyond the entry being
+    parsed is kept in memory.
+    """
+    pending = None
+    options = []
+    props = []
+    group_hint = None
+    for raw in lines:
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8', 'replace')
+        line = raw.strip()
+        if not line or line.startswith('#EXTM3U'):
+            continue
+        if line.startswith('#EXTINF:'):
+            pending = _parse_extinf(line)
+            options, props, group_hint = [], [], None
+        elif line.startswith('#EXTVLCOPT:'):
+            options.append(line[len('#EXTVLCOPT:'):])
+        elif line.startswith('#KODIPROP:'):
+            props.append(line[len('#KODIPROP:'):])
+        elif line.startswith('#EXTGRP:'):
+            group_hint = line[len('#EXTGRP:'):].strip()
+        elif line.startswith('#'):
+            continue
+        else:
+            duration, attrs, title = pending or ('-1', {}, '')
+            extra = {k: v for k, v in attrs.items() if k not in _KNOWN_ATTRS}
+            group = attrs.get('group-title', group_hint)
+            yield Channel(
+                id=None,
+                name=title or attrs.get('tvg-name') or line,
+                url=line,
+                duration=duration,
+                tvg_id=attrs.get('tvg-id'),
+                tvg_name=attrs.get('tvg-name'),
+                tvg_logo=attrs.get('tvg-logo'),
+                group=sys.intern(group) if group is not None else None,
+                attrs=extra or None,
+                options=options or None,
+                props=props or None,
+            )
+            pending, options, props, group_hint = None, [], [], None
+
+
+def derive_id(url):
+    """Xtream-style numeric stream id from the URL, else a short URL hash."""
+    path = url.split('?', 1)[0].split('#', 1)[0]
+    stem = posixpath.splitext(path.rsplit('/', 1)[-1])[0]
+    if stem.isdigit():
+        return stem
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:10]
+
+
+class Catalog:
+    """Channels in playlist order with posting-list indexes."""
+
+    def __init__(self):
+        self.channels = []
+        self.version = 0
+        self._by_id = {}
+        self._by_tvg_id = {}
+        self._by_group = {}
+        self._by_name = {}
+        self._by_token = {}
+        self._sorted_tokens = None
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __contains__(self, channel_id):
+        return channel_id in self._by_id
+
+    def __iter__(self):
+        return iter(self.channels)
+
+    def get(self, channel_id):
+        index = self._by_id.get(channel_id)
+        return None if index is None else self.channels[index]
+
+    @staticmethod
+    def _post(index_map, key, position):
+        postings = index_map.get(key)
+        if postings is None:
+            postings = index_map[key] = array('I')
+        postings.append(position)
+
+    def add(self, channel):
+        """Append a channel, assigning a unique id if it has none."""
+        channel_id = channel.id or derive_id(channel.url)
+        if channel_id in self._by_id:
+            base, n = channel_id, 2
+            while f'{base}-{n}' in self._by_id:
+                n += 1
+            channel_id = f'{base}-{n}'
+        channel.id = channel_id
+
+        position = len(self.channels)
+        self.channels.append(channel)
+        self._by_id[channel_id] = position
+        if channel.tvg_id:
+            self._post(self._by_tvg_id, channel.tvg_id.casefold(), position)
+        if channel.group is not None:
+            self._post(self._by_group, channel.group.casefold(), position)
+        normalized = normalize_name(channel.name)
+        self._post(self._by_name, normalized, position)
+        for token in set(normalized.split()):
+            self._post(self._by_token, sys.intern(token), position)
+        self._sorted_tokens = None
+        self.version += 1
+        return channel
+
+    def extend(self, channels):
+        for channel in channels:
+            self.add(channel)
+        return self
+
+    @classmethod
+    def from_m3u(cls, lines):
+        return cls().extend(iter_m3u(lines))
+
+    @classmethod
+    def from_mapping(cls, channels, base_source, group):
+        """Catalog for a ``{id: name}`` mapping served from ``base_source/<id>``."""
+        catalog = cls()
+        group = sys.intern(group)
+        for channel_id, name in channels.items():
+            catalog.add(Channel(
+                id=channel_id, name=name, url=f'{base_source}/{channel_id}',
+                tvg_id='', tvg_name=name, tvg_logo='', group=group,
+            ))
+        return catalog
+
+    def groups(self):
+        return sorted({self.channels[p[0]].group for p in self._by_group.values()})
+
+    def _token_postings(self, prefix):
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._by_token)
+        tokens = self._sorted_tokens
+        matched = set()
+        i = bisect_left(tokens, prefix)
+        while i < len(tokens) and tokens[i].startswith(prefix):
+            matched.update(self._by_token[tokens[i]])
+            i += 1
+        return matched
+
+    def search(self, query):
+        """Positions whose name contains every query word (as a word prefix)."""
+        words = normalize_name(query).split()
+        if not words:
+            return set()
+        result = None
+        for word in words:
+            postings = self._token_postings(word)
+            result = postings if result is None else result & postings
+            if not result:
+                break
+        return result or set()
+
+    def query(self, group=None, tvg_id=None, name=None, q=None, offset=0, limit=None):
+        """``(total, [Channel])`` matching all given filters, in playlist order.
+
+        ``group`` and ``tvg_id`` match case-insensitively, ``name`` matches
+        the normalized name exactly and ``q`` is a word-prefix search.
+        """
+        selected = None
+        if group is not None:
+            selected = set(self._by_group.get(group.casefold(), ()))
+        if name is not None:
+            postings = set(self._by_name.get(normalize_name(name), ()))
+            selected = postings if selected is None else selected & postings
+        if tvg_id is not None:
+            postings = set(self._by_tvg_id.get(tvg_id.casefold(), ()))
+            selected = postings if selected is None else selected & postings
+        if q:
+            postings = self.search(q)
+            selected = postings if selected is None else selected & postings
+
+        if selected is None:
+            total = len(self.channels)
+            end = total if limit is None else offset + limit
+            return total, self.channels[offset:end]
+
+        positions = sorted(selected)
+        total = len(positions)
+        end = total if limit is None else offset + limit
+        return total, [self.channels[p] for p in positions[offset:end]]
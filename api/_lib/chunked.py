@@ -0,0 +1,301 @@
+"""Chunked parallel transcoding of VOD HLS inputs.
+
+A single ffmpeg re-encode of a long film keeps one pipeline busy for
+most of its runtime.  For finite inputs (a media playlist with
+``EXT-X-ENDLIST``) whose playlist declares ``EXT-X-INDEPENDENT-SEGMENTS``
+the work can be split instead:
+
+1. The media playlist is cut at segment boundaries into ``N`` runs of
+   consecutive segments of about equal duration.  Each run is written out
+   as its own small VOD playlist with absolute URIs, so every chunk
+   starts on the source's own segment boundary and no seeking is
+   involved.  Only independent segments are guaranteed to start on a key
+   frame, hence the tag requirement.
+2. Each chunk's video is transcoded by its own single-threaded ffmpeg,
+   concurrently, into an intermediate MP4.  Key frames are forced on the
+   *global* output segment grid (the chunk's start offset is added to
+   ``t``), so DASH segments line up across chunk joins.
+3. The audio is encoded once, from the whole media playlist the chunks
+   come from, alongside them; per-chunk AAC would add encoder priming at every join.
+4. The concat demuxer joins the chunks, shifting each one's timestamps
+   by the duration of those before it, and the result is muxed into one
+   continuous DASH presentation with stream copy.
+
+Every ffmpeg reserves one core from the :class:`CoreScheduler`, so the
+chunks of one job share the host with other conversions instead of
+oversubscribing it.  If one chunk fails the others are stopped.
+
+Tunables (environment):
+
+``CONVERT_CHUNK_MIN_SECONDS``  shortest chunk worth its own process
+                               (default 30)
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+from api._lib.ffmpeg import FFmpegError, run_ffmpeg
+from api._lib.hls import best_variant, is_master_playlist, parse_attributes
+from api._lib.scheduler import TRANSCODE, limit_threads
+
+MIN_CHUNK_SECONDS = float(os.environ.get('CONVERT_CHUNK_MIN_SECONDS', 30))
+
+# Playlist tags that describe the whole presentation, not one segment
+_HEADER_TAGS = ('#EXTM3U', '#EXT-X-VERSION', '#EXT-X-TARGETDURATION', '#EXT-X-INDEPENDENT-SEGMENTS',
+                '#EXT-X-START')
+
+# Tags whose state carries over to every later segment
+_STATE_TAGS = ('#EXT-X-MAP:', '#EXT-X-KEY:')
+
+
+class NotChunkable(Exception):
+    """The input cannot be split; the caller runs a single ffmpeg instead."""
+
+
+class Chunk:
+    """A run of consecutive segments written as a standalone VOD playlist."""
+
+    def __init__(self, index, start, lines):
+        self.index = index
+        self.start = start
+        self.duration = 0.0
+        self.lines = lines  # state tags active at the first segment
+        self.segments = 0
+
+    def playlist(self, header):
+        return '\n'.join(header + self.lines + ['#EXT-X-ENDLIST']) + '\n'
+
+
+def _absolute_uris(line, base_url):
+    if 'URI="' not in line:
+        return line
+    _, _, attrs = line.partition(':')
+    parsed = parse_attributes(attrs)
+    if 'URI' in parsed:
+        line = line.replace(f'URI="{parsed["URI"]}"', f'URI="{urljoin(base_url, parsed["URI"])}"')
+    return line
+
+
+def _on_grid(seconds, align):
+    return abs(seconds / align - round(seconds / align)) < 1e-3
+
+
+def _group(segments, count, total, align):
+    chunks, elapsed = [], 0.0
+    for duration, state_lines, own in segments:
+        # Start a new chunk once this one has reached its share of the
+        # total, on the output segment grid if there is one
+        if not chunks or (len(chunks) < count and elapsed >= total * len(chunks) / count
+                          and (not align or _on_grid(elapsed, align))):
+            # Repeat the MAP / KEY in effect unless the segment sets it itself
+            chunks.append(Chunk(len(chunks), elapsed, [tag for tag in state_lines if tag not in own]))
+        chunk = chunks[-1]
+        chunk.lines += own
+        chunk.duration += duration
+        chunk.segments += 1
+        elapsed += duration
+    return chunks
+
+
+def split_playlist(text, url, chunks, min_seconds=MIN_CHUNK_SECONDS, align=None):
+    """``(header, [Chunk])`` splitting a VOD media playlist into about equal runs.
+
+    With ``align`` (the output segment duration) chunks start on multiples
+    of it where the source segments allow, so no short DASH segment is
+    cut at a join.  ``EXT-X-BYTERANGE`` offsets are made explicit, so a
+    chunk never depends on the segment before it.
+    """
+    if '#EXT-X-ENDLIST' not in text:
+        raise NotChunkable('not a VOD playlist (no EXT-X-ENDLIST)')
+
+    header, state, segments = [], {}, []  # segments: (duration, state in effect, own lines)
+    pending, duration = [], None
+    range_end = {}
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line or line.startswith(('#EXT-X-ENDLIST', '#EXT-X-MEDIA-SEQUENCE', '#EXT-X-PLAYLIST-TYPE',
+                                        '#EXT-X-DISCONTINUITY-SEQUENCE')):
+            continue
+        if line.startswith(_HEADER_TAGS):
+            header.append(line)
+        elif line.startswith(_STATE_TAGS):
+            line = _absolute_uris(line, url)
+            state[line.split(':', 1)[0]] = line
+            pending.append(line)
+        elif line.startswith('#EXTINF:'):
+            duration = float(line[len('#EXTINF:'):].split(',', 1)[0])
+            pending.append(line)
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            pending.append(line)
+        elif line.startswith('#'):
+            pending.append(_absolute_uris(line, url))
+        else:
+            if duration is None:
+                raise NotChunkable('segment without EXTINF')
+            segment_url = urljoin(url, line)
+            own = []
+            for tag in pending:
+                if tag.startswith('#EXT-X-BYTERANGE:'):
+                    length, _, offset = tag.split(':', 1)[1].partition('@')
+                    offset = int(offset) if offset else range_end.get(segment_url, 0)
+                    range_end[segment_url] = offset + int(length)
+                    tag = f'#EXT-X-BYTERANGE:{length}@{offset}'
+                own.append(tag)
+            segments.append((duration, list(state.values()), own + [segment_url]))
+            pending, duration = [], None
+
+    if not segments:
+        raise NotChunkable('empty playlist')
+    total = sum(d for d, _, _ in segments)
+    count = max(1, min(chunks, len(segments), int(total // min_seconds) if min_seconds else chunks))
+    if count < 2:
+        raise NotChunkable(f'{total:.0f}s in {len(segments)} segments is too short to split')
+
+    result = _group(segments, count, total, align) if align else []
+    if len(result) < 2:
+        result = _group(segments, count, total, None)
+    return header, result
+
+
+def resolve_media_playlist(url, fetch_text):
+    """``(media_url, text)``, following a master playlist to its best variant.
+
+    Raises :class:`NotChunkable` unless the master or the media playlist
+    declares ``EXT-X-INDEPENDENT-SEGMENTS``: without it a segment may
+    start mid-GOP, and a chunk cut there would not decode.
+    """
+    text = fetch_text(url)
+    independent = False
+    if is_master_playlist(text):
+        independent = '#EXT-X-INDEPENDENT-SEGMENTS' in text
+        variant = best_variant(text, url)
+        if variant is None:
+            raise NotChunkable('master playlist without variants')
+        url, text = variant, fetch_text(variant)
+    if not independent and '#EXT-X-INDEPENDENT-SEGMENTS' not in text:
+        raise NotChunkable('segments are not declared independent (no EXT-X-INDEPENDENT-SEGMENTS)')
+    return url, text
+
+
+def chunk_cmd(playlist, output, start, video_args, segment_duration):
+    """Transcode one chunk's video; key frames stay on the global segment grid."""
+    segment_duration = float(segment_duration)
+    first = int(start // segment_duration) + 1
+    return [
+        'ffmpeg', '-y',
+        '-protocol_whitelist', 'file,http,https,tcp,tls,crypto',
+        '-i', playlist,
+        '-map', '0:v:0',
+    ] + video_args + [
+        '-force_key_frames', f'expr:gte(t+{start:.6f},(n_forced+{first})*{segment_duration:g})',
+        '-sc_threshold', '0',
+        '-an', '-f', 'mp4', output,
+    ]
+
+
+def audio_cmd(url, output):
+    return ['ffmpeg', '-y', '-i', url, '-map', '0:a:0', '-vn', '-c:a', 'aac', '-b:a', '128k', '-f', 'mp4', output]
+
+
+def stitch_cmd(concat_list, audio, dash_args):
+    """Join the chunk MP4s (and the audio track) into the DASH output by stream copy."""
+    cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', concat_list]
+    if audio is not None:
+        cmd += ['-i', audio, '-map', '0:v:0', '-map', '1:a:0']
+    else:
+        cmd += ['-map', '0:v:0']
+    return cmd + ['-c', 'copy'] + dash_args
+
+
+def _no_audio(error):
+    return 'matches no streams' in error.tail or 'does not contain any stream' in error.tail
+
+
+def transcode_chunked(url, chunks, video_args, segment_duration, dash_args, workdir, scheduler,
+                      fetch_text, timeout=None, on_progress=None, min_seconds=MIN_CHUNK_SECONDS):
+    """Transcode ``url`` as ``chunks`` parallel pieces; returns a summary dict.
+
+    ``dash_args`` ends with the MPD path.  ``on_progress(dict)`` receives
+    the combined media seconds encoded and the chunks finished so far.
+    Raises :class:`NotChunkable` before any work starts if the input
+    cannot be split.
+    """
+    media_url, text = resolve_media_playlist(url, fetch_text)
+    header, pieces = split_playlist(text, media_url, chunks, min_seconds, align=float(segment_duration))
+
+    encoded = {}
+    done = []
+    usage = {'cpu_seconds': 0.0}
+    lock = threading.Lock()
+    failed = threading.Event()
+
+    def report():
+        if on_progress is not None:
+            on_progress({'chunks': len(pieces), 'chunks_done': len(done),
+                         'out_time_seconds': round(sum(encoded.values()), 3)})
+
+    def add_usage(run):
+        with lock:
+            usage['cpu_seconds'] += run['cpu_seconds']
+
+    def stop_if_failed(elapsed):
+        if failed.is_set():
+            raise FFmpegError('stopped: another chunk failed')
+
+    def run(cmd, key=None):
+        with scheduler.reserve(1, TRANSCODE):
+            if failed.is_set():
+                raise FFmpegError('stopped: another chunk failed')
+
+            def progress(block):
+                if key is not None and 'out_time_seconds' in block:
+                    with lock:
+                        encoded[key] = block['out_time_seconds']
+                    report()
+
+            try:
+                run_ffmpeg(limit_threads(cmd, 1), on_progress=progress, on_tick=stop_if_failed,
+                           timeout=timeout, nice=scheduler.nice[TRANSCODE], on_usage=add_usage)
+            except FFmpegError:
+                if key is not None:
+                    failed.set()
+                raise
+        if key is not None:
+            with lock:
+                done.append(key)
+            report()
+
+    outputs = []
+    for chunk in pieces:
+        playlist = os.path.join(workdir, f'chunk_{chunk.index:04d}.m3u8')
+        with open(playlist, 'w', encoding='utf-8') as f:
+            f.write(chunk.playlist(header))
+        outputs.append((chunk, playlist, os.path.join(workdir, f'chunk_{chunk.index:04d}.mp4')))
+    audio = os.path.join(workdir, 'audio.mp4')
+
+    with ThreadPoolExecutor(len(pieces) + 1, thread_name_prefix='chunk') as pool:
+        audio_future = pool.submit(run, audio_cmd(media_url, audio))
+        futures = [pool.submit(run, chunk_cmd(playlist, output, chunk.start, video_args, segment_duration), chunk.index)
+                   for chunk, playlist, output in outputs]
+        for future in futures:
+            future.result()
+        try:
+            audio_future.result()
+        except FFmpegError as e:
+            if not _no_audio(e):
+                raise
+            audio = None
+
+    concat_list = os.path.join(workdir, 'chunks.txt')
+    with open(concat_list, 'w', encoding='utf-8') as f:
+        f.writelines(f"file '{output}'\n" for _, _, output in outputs)
+    with scheduler.reserve(1, TRANSCODE):
+        run_ffmpeg(stitch_cmd(concat_list, audio, dash_args), timeout=timeout, on_usage=add_usage)
+
+    return {
+        'chunks': len(pieces),
+        'chunk_seconds': [round(chunk.duration, 3) for chunk in pieces],
+        'duration_seconds': round(sum(chunk.duration for chunk in pieces), 3),
+        'cpu_seconds': round(usage['cpu_seconds'], 3),
+    }
@@ -0,0 +1,165 @@
+"""Run ffmpeg while streaming its machine-readable progress.
+
+ffmpeg is started with ``-progress pipe:1 -nostats``: stdout then carries
+``key=value`` blocks, each terminated by ``progress=continue`` (or
+``progress=end``).  :func:`run_ffmpeg` parses them as they arrive and hands
+each block to ``on_progress``.  stderr is drained concurrently into a
+bounded deque, so a chatty encode never holds its whole log in memory and
+failures still report the last lines.
+
+The process is reaped with ``os.wait4``, which returns its resource usage,
+so every run can report the CPU time ffmpeg and its threads consumed.
+"""
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+
+PROGRESS_ARGS = ['-hide_banner', '-progress', 'pipe:1', '-nostats']
+
+
+class FFmpegError(RuntimeError):
+    """ffmpeg exited non-zero or ran past its timeout."""
+
+    def __init__(self, message, tail=''):
+        super().__init__(f'{message}: {tail[-500:]}' if tail else message)
+        self.tail = tail
+
+
+def _number(value, cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_progress_block(fields):
+    """Typed progress dict from one block of raw ``key=value`` fields.
+
+    Fields ffmpeg reports as ``N/A`` are left out, so merging successive
+    blocks keeps the last known value.
+    """
+    out_time_us = _number(fields.get('out_time_us') or fields.get('out_time_ms'), int)
+    bitrate = fields.get('bitrate', '')
+    speed = fields.get('speed', '')
+    parsed = {
+        'frame': _number(fields.get('frame'), int),
+        'fps': _number(fields.get('fps')),
+        'out_time_seconds': round(out_time_us / 1e6, 3) if out_time_us is not None and out_time_us >= 0 else None,
+        'total_size': _number(fields.get('total_size'), int),
+        'bitrate_kbps': _number(bitrate[:-len('kbits/s')]) if bitrate.endswith('kbits/s') else None,
+        'speed': _number(speed[:-1]) if speed.endswith('x') else None,
+        'finished': fields.get('progress') == 'end',
+    }
+    return {key: value for key, value in parsed.items() if value is not None}
+
+
+def iter_progress(stream):
+    """Yield a parsed dict per progress block read from ``stream``."""
+    fields = {}
+    for line in stream:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            continue
+        fields[key] = value.strip()
+        if key == 'progress':
+            yield parse_progress_block(fields)
+            fields = {}
+
+
+def _usage(rusage):
+    return {
+        'cpu_user_seconds': round(rusage.ru_utime, 3),
+        'cpu_system_seconds': round(rusage.ru_stime, 3),
+        'cpu_seconds': round(rusage.ru_utime + rusage.ru_stime, 3),
+        'max_rss_kb': rusage.ru_maxrss,
+    }
+
+
+def _reap(process, block):
+    """Resource usage once ``process`` has exited, else None (sets its returncode)."""
+    pid, status, rusage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+    if not pid:
+        return None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return _usage(rusage)
+
+
+def run_ffmpeg(cmd, on_progress=None, on_tick=None, timeout=None, tail_lines=40, tick=1.0,
+               nice=None, on_usage=None):
+    """Run ``cmd`` (an ``['ffmpeg', ...]`` list) to completion.
+
+    ``on_progress(dict)`` is called from a reader thread for every progress
+    block; ``on_tick(elapsed_seconds)`` from the calling thread every
+    ``tick`` seconds.  ``nice`` sets the process niceness right after it
+    starts, before ffmpeg spawns its worker threads (which inherit it).
+    ``on_usage(dict)`` receives the CPU seconds and peak RSS of the run,
+    also when it fails.  Returns the stderr tail; raises
+    :class:`FFmpegError` on failure or when ``timeout`` elapses (the
+    process is killed).
+    """
+    tail = deque(maxlen=tail_lines)
+    process = subprocess.Popen(
+        cmd[:1] + PROGRESS_ARGS + cmd[1:],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors='replace',
+    )
+    if nice:
+        try:
+            os.setpriority(os.PRIO_PROCESS, process.pid, nice)
+        except OSError:
+            pass
+
+    def read_progress():
+        for block in iter_progress(process.stdout):
+            if on_progress is not None:
+                on_progress(block)
+
+    def read_stderr():
+        for line in process.stderr:
+            tail.append(line.rstrip())
+
+    readers = [threading.Thread(target=read_progress, daemon=True),
+               threading.Thread(target=read_stderr, daemon=True)]
+    for reader in readers:
+        reader.start()
+
+    started = time.monotonic()
+    next_tick = started + tick
+    delay = 0.0005
+    usage = None
+    try:
+        while True:
+            usage = _reap(process, block=False)
+            if usage is not None:
+                break
+            now = time.monotonic()
+            if timeout is not None and now - started > timeout:
+                process.kill()
+                usage = _reap(process, block=True)
+                raise FFmpegError(f'FFmpeg timed out after {timeout} seconds', '\n'.join(tail))
+            if now >= next_tick:
+                next_tick += tick
+                if on_tick is not None:
+                    on_tick(now - started)
+            # Same back-off as Popen.wait(timeout): quick exits are noticed
+            # quickly, long runs cost at most 20 polls a second
+            delay = min(delay * 2, 0.05, max(next_tick - now, 0.0005))
+            time.sleep(delay)
+    finally:
+        if usage is None and process.returncode is None:
+            process.kill()
+            usage = _reap(process, block=True)
+        for reader in readers:
+            reader.join(timeout=5)
+        if on_usage is not None and usage is not None:
+            on_usage(usage)
+
+    log = '\n'.join(tail)
+    if process.returncode != 0:
+        raise FFmpegError(f'FFmpeg failed (exit {process.returncode})', log)
+    return log
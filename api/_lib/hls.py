@@ -0,0 +1,464 @@
+"""HLS proxy mode: shared playlist refresh, URI rewriting and a segment cache.
+
+For a channel served as HLS, each upstream playlist is fetched at most
+once per target duration and shared by every client.  Segment (and
+key / init-map) URIs are rewritten to relative proxy paths of the form
+``segment/<key><ext>``, where ``key`` is a hash of the absolute upstream
+URL.  Only URLs that appeared in a playlist can be fetched through those
+paths, so the proxy cannot be used as an open relay.
+
+A master playlist is served rewritten, not reduced to one variant: its
+variant streams and ``EXT-X-MEDIA`` renditions (separate audio,
+subtitles) become ``segment/<key>.m3u8``, themselves proxied media
+playlists whose segment URIs are relative to that directory.  A segment
+name the channel does not know yet (a worker that has not served the
+playlist, or a long VOD) refreshes the playlists once before it is
+refused.
+
+Segments are stored in a :class:`SegmentCache`: an LRU with a byte budget
+and a TTL, whose loads are single-flight so that each segment is fetched
+from the origin once no matter how many clients ask for it at the same
+time.
+
+Tunables (environment):
+
+``HLS_CACHE_BYTES``     segment cache budget (default 256 MiB)
+``HLS_SEGMENT_TTL``     seconds a cached segment stays valid (default 120)
+``HLS_KNOWN_SEGMENTS``  rewritten URIs remembered per channel, at least the
+                        channel's current playlists' (default 512)
+"""
+import hashlib
+import os
+import posixpath
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin, urlsplit
+
+PLAYLIST_CONTENT_TYPE = 'application/vnd.apple.mpegurl'
+
+_URI_ATTR = re.compile(r'URI="([^"]*)"')
+_ATTR = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+_SEGMENT_TYPES = {
+    '.ts': 'video/mp2t',
+    '.aac': 'audio/aac',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+    '.m4a': 'audio/mp4',
+    '.vtt': 'text/vtt',
+    '.key': 'application/octet-stream',
+}
+
+
+class UpstreamError(Exception):
+    """The origin answered with a non-success status."""
+
+    def __init__(self, status_code, url):
+        super().__init__(f'{status_code} from {url}')
+        self.status_code = status_code
+        self.url = url
+
+
+def parse_attributes(value):
+    """Parse an HLS attribute list (``KEY=VALUE,KEY="VALUE"``) into a dict."""
+    attrs = {}
+    for key, raw in _ATTR.findall(value):
+        attrs[key] = raw[1:-1] if raw.startswith('"') else raw
+    return attrs
+
+
+def is_master_playlist(text):
+    return '#EXT-X-STREAM-INF' in text
+
+
+def best_variant(text, base_url):
+    """Absolute URL of the highest-bandwidth variant in a master playlist."""
+    best_url, best_bw = None, -1
+    pending = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            pending = parse_attributes(line.split(':', 1)[1])
+        elif line and not line.startswith('#') and pending is not None:
+            bandwidth = int(pending.get('BANDWIDTH', 0) or 0)
+            if bandwidth > best_bw:
+                best_url, best_bw = urljoin(base_url, line), bandwidth
+            pending = None
+    return best_url
+
+
+def segment_key(url):
+    """Stable proxy key and file extension for an absolute upstream URL."""
+    ext = posixpath.splitext(urlsplit(url).path)[1].lower()
+    if ext not in _SEGMENT_TYPES:
+        ext = ''
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:20], ext
+
+
+def segment_content_type(name):
+    return _SEGMENT_TYPES.get(posixpath.splitext(name)[1].lower(), 'application/octet-stream')
+
+
+def _playlist_key(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:20]
+
+
+def rewrite_master_playlist(text, base_url):
+    """Rewrite a master playlist's variant and rendition URIs to proxy paths.
+
+    Returns ``(playlist_text, {key: media playlist url}, {key: url})``; the
+    last holds other proxied resources (session keys).
+    """
+    out = []
+    playlists = {}
+    known = {}
+
+    def playlist(uri):
+        absolute = urljoin(base_url, uri)
+        key = _playlist_key(absolute)
+        playlists[key] = absolute
+        return f'segment/{key}.m3u8'
+
+    def resource(uri):
+        absolute = urljoin(base_url, uri)
+        key, ext = segment_key(absolute)
+        known[key] = absolute
+        return f'segment/{key}{ext}'
+
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith(('#EXT-X-MEDIA:', '#EXT-X-I-FRAME-STREAM-INF:')):
+            line = _URI_ATTR.sub(lambda m: f'URI="{playlist(m.group(1))}"', line)
+        elif line.startswith('#EXT-X-SESSION-KEY:'):
+            line = _URI_ATTR.sub(lambda m: f'URI="{resource(m.group(1))}"', line)
+        elif line.startswith('#EXT-X-SESSION-DATA:'):
+            line = _URI_ATTR.sub(lambda m: f'URI="{urljoin(base_url, m.group(1))}"', line)
+        elif not line.startswith('#'):
+            line = playlist(line)
+        out.append(line)
+
+    return '\n'.join(out) + '\n', playlists, known
+
+
+def rewrite_media_playlist(text, base_url, prefix='segment/'):
+    """Rewrite every URI in a media playlist to a proxy ``segment/`` path.
+
+    ``prefix`` is what the proxied names are relative to: a media playlist
+    served from ``segment/`` itself uses ``''``.  Returns
+    ``(playlist_text, target_duration, endlist, {key: url})``.
+    """
+    out = []
+    known = {}
+    target_duration = None
+    endlist = False
+
+    def proxied(uri):
+        absolute = urljoin(base_url, uri)
+        key, ext = segment_key(absolute)
+        known[key] = absolute
+        return f'{prefix}{key}{ext}'
+
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            if line.startswith('#EXT-X-TARGETDURATION:'):
+                try:
+                    target_duration = float(line.split(':', 1)[1])
+                except ValueError:
+                    pass
+            elif line == '#EXT-X-ENDLIST':
+                endlist = True
+            elif line.startswith(('#EXT-X-KEY:', '#EXT-X-MAP:', '#EXT-X-SESSION-KEY:')):
+                line = _URI_ATTR.sub(lambda m: f'URI="{proxied(m.group(1))}"', line)
+            out.append(line)
+        else:
+            out.append(proxied(line))
+
+    return '\n'.join(out) + '\n', target_duration, endlist, known
+
+
+class SegmentCache:
+    """Thread-safe LRU of ``bytes`` with a byte budget, TTL and single-flight loads."""
+
+    def __init__(self, max_bytes=256 << 20, ttl=120.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.joins = 0
+        self._entries = OrderedDict()  # key -> (expires_at, content_type, data)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._get_locked(key)
+
+    def _get_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove_locked(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[2])
+
+    def put(self, key, content_type, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove_locked(key)
+            self._entries[key] = (time.monotonic() + self.ttl, content_type, data)
+            self.size += len(data)
+            while self.size > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove_locked(oldest)
+
+    def get_or_load(self, key, load):
+        """Return ``(content_type, data)``, calling ``load()`` at most once per key.
+
+        Callers that arrive while a load is running wait for its result
+        instead of starting their own.  A failed load is re-raised in every
+        waiting caller.
+        """
+        with self._lock:
+            entry = self._get_locked(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[1], entry[2]
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = self._inflight[key] = {'event': threading.Event()}
+                self.misses += 1
+                owner = True
+            else:
+                self.joins += 1
+                owner = False
+
+        if not owner:
+            flight['event'].wait()
+            if 'error' in flight:
+                raise flight['error']
+            return flight['result']
+
+        try:
+            content_type, data = load()
+            self.put(key, content_type, data)
+            flight['result'] = (content_type, data)
+            return content_type, data
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight['event'].set()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.joins
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'joins': self.joins,
+                'hit_ratio': round((self.hits + self.joins) / lookups, 4) if lookups else None,
+            }
+
+
+class _Playlist:
+    """One upstream playlist and its rewritten body."""
+
+    def __init__(self, url):
+        self.url = url
+        self.body = None
+        self.fetched_at = 0.0
+        self.target_duration = 6.0
+        self.endlist = False
+        self.segments = 0
+        self.lock = threading.Lock()
+
+    def stale(self):
+        if self.body is None:
+            return True
+        if self.endlist:
+            return False
+        return time.monotonic() - self.fetched_at >= self.target_duration
+
+
+class HlsChannel:
+    """Shared, periodically refreshed view of one channel's playlists."""
+
+    def __init__(self, key, source_url, fetch, cache, known_limit=512, headers=None):
+        self.key = key
+        self.source_url = source_url
+        self.headers = headers or None
+        self._fetch = fetch
+        self._cache = cache
+        self._known_limit = known_limit
+        self._known = OrderedDict()
+        self._lock = threading.Lock()
+        self._top = _Playlist(source_url)
+        self._media = {}  # key -> _Playlist, for the renditions of a master
+        self._reloaded_at = None
+        self.refreshes = 0
+
+    def playlist(self):
+        """Rewritten playlist bytes, refreshed at most once per target duration."""
+        return self._current(self._top, top=True)
+
+    def _current(self, playlist, top=False):
+        if not playlist.stale():
+            return playlist.body
+        with playlist.lock:
+            # Another client may have refreshed while we waited for the lock.
+            if playlist.stale():
+                self._refresh(playlist, top)
+            return playlist.body
+
+    def _refresh(self, playlist, top):
+        final_url, text = self._fetch_text(playlist.url)
+        if top and is_master_playlist(text):
+            body, playlists, known = rewrite_master_playlist(text, final_url)
+            with self._lock:
+                self._media = {key: self._media.get(key) or _Playlist(url) for key, url in playlists.items()}
+            target_duration, endlist = None, False
+        else:
+            body, target_duration, endlist, known = rewrite_media_playlist(
+                text, final_url, prefix='segment/' if top else '')
+        playlist.segments = len(known)
+        self._remember(known)
+
+        playlist.body = body.encode('utf-8')
+        playlist.target_duration = target_duration or 6.0
+        playlist.endlist = endlist
+        playlist.fetched_at = time.monotonic()
+        self.refreshes += 1
+
+    def _remember(self, known):
+        with self._lock:
+            for key, segment_url in known.items():
+                self._known[key] = segment_url
+                self._known.move_to_end(key)
+            # Never forget segments the current playlists still list
+            limit = max(self._known_limit,
+                        self._top.segments + sum(p.segments for p in self._media.values()))
+            while len(self._known) > limit:
+                self._known.popitem(last=False)
+
+    def _reload(self):
+        """Refresh every playlist once, unless that was done within a target duration."""
+        with self._lock:
+            now = time.monotonic()
+            if self._reloaded_at is not None and now - self._reloaded_at < self._top.target_duration:
+                return False
+            self._reloaded_at = now
+        with self._top.lock:
+            self._refresh(self._top, True)
+        with self._lock:
+            media = list(self._media.values())
+        for playlist in media:
+            with playlist.lock:
+                self._refresh(playlist, False)
+        return True
+
+    def _fetch_text(self, url):
+        response = self._fetch(url, headers=self.headers)
+        if response.status_code != 200:
+            raise UpstreamError(response.status_code, url)
+        return response.url or url, response.text
+
+    def segment(self, name):
+        """``(content_type, data)`` for a rewritten segment name, or ``None``.
+
+        Names ending in ``.m3u8`` are a master playlist's renditions and
+        come back as their rewritten media playlist.
+        """
+        key = posixpath.splitext(name)[0]
+        with self._lock:
+            media = self._media.get(key)
+            url = self._known.get(key)
+        if media is None and url is None and self._reload():
+            with self._lock:
+                media = self._media.get(key)
+                url = self._known.get(key)
+        if media is not None:
+            return PLAYLIST_CONTENT_TYPE, self._current(media)
+        if url is None:
+            return None
+
+        def load():
+            response = self._fetch(url, headers=self.headers)
+            if response.status_code != 200:
+                raise UpstreamError(response.status_code, url)
+            content_type = response.headers.get('Content-Type') or segment_content_type(name)
+            return content_type, response.content
+
+        return self._cache.get_or_load(key, load)
+
+
+class HlsHub:
+    """Registry of :class:`HlsChannel` objects sharing one segment cache."""
+
+    def __init__(self, fetch, cache_bytes=256 << 20, ttl=120.0, known_limit=512):
+        self.cache = SegmentCache(cache_bytes, ttl)
+        self._fetch = fetch
+        self._known_limit = known_limit
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, fetch):
+        return cls(
+            fetch,
+            cache_bytes=int(os.environ.get('HLS_CACHE_BYTES', 256 << 20)),
+            ttl=float(os.environ.get('HLS_SEGMENT_TTL', 120)),
+            known_limit=int(os.environ.get('HLS_KNOWN_SEGMENTS', 512)),
+        )
+
+    def channel(self, key, source_url, headers=None, fetch=None):
+        """The shared channel for ``key``; ``fetch`` overrides the hub's fetch for it."""
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is None or channel.source_url != source_url:
+                channel = self._channels[key] = HlsChannel(
+                    key, source_url, fetch or self._fetch, self.cache, self._known_limit, headers)
+            return channel
+
+    def stats(self):
+        with self._lock:
+            channels = {key: {'refreshes': c.refreshes} for key, c in self._channels.items()}
+        return {'cache': self.cache.stats(), 'channels': channels}
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hls_hub():
+    """Process-wide HLS hub fetching through the shared upstream pool."""
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                # Imported here so that the playlist helpers (used by the
+                # converter's manifest translation) do not load requests.
+                from api._lib.upstream import get_pool
+                _hub = HlsHub.from_env(get_pool().get)
+    return _hub
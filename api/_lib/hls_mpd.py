@@ -0,0 +1,381 @@
+"""Manifest-only HLS to DASH translation for fMP4/CMAF sources.
+
+When every rendition of an HLS presentation is fragmented MP4 (it has an
+``EXT-X-MAP`` init segment), a DASH player can fetch the very same
+segments.  :func:`translate` therefore only reads the playlists and
+writes an MPD whose ``SegmentList``/``SegmentTimeline`` points at the
+original segment URLs, including ``EXT-X-BYTERANGE`` ranges; no media is
+downloaded or remuxed.
+
+Codecs come from the master playlist's ``CODECS`` attribute.  Without
+one (a bare media playlist), the few-hundred-byte init segment is read
+and the codec string is taken from its ``stsd`` sample entry.
+
+Anything the MPD could not express faithfully raises
+:class:`NotTranslatable` (MPEG-TS segments, encryption, discontinuities,
+live playlists, unknown codecs) and the caller falls back to ffmpeg.
+"""
+import struct
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin
+
+from api._lib.hls import is_master_playlist, parse_attributes
+
+MPD_NAMESPACE = 'urn:mpeg:dash:schema:mpd:2011'
+TIMESCALE = 1000
+
+
+class NotTranslatable(Exception):
+    """The HLS input needs a real remux; use ffmpeg instead."""
+
+
+# -- playlists ---------------------------------------------------------------
+
+class MediaPlaylist:
+    """Segments of one fMP4 media playlist (times in seconds)."""
+
+    def __init__(self, url):
+        self.url = url
+        self.init_url = None
+        self.init_range = None
+        self.segments = []  # (duration, url, (first, last) or None)
+        self.target_duration = None
+
+    @property
+    def duration(self):
+        return sum(duration for duration, _, _ in self.segments)
+
+
+def _byterange(value, previous_end):
+    """``(first, last)`` for ``length[@offset]``; offset defaults to ``previous_end``."""
+    length, _, offset = value.partition('@')
+    first = int(offset) if offset else previous_end
+    if first is None:
+        raise NotTranslatable('EXT-X-BYTERANGE without an offset to continue from')
+    return first, first + int(length) - 1
+
+
+def parse_media_playlist(text, url):
+    playlist = MediaPlaylist(url)
+    duration = None
+    pending_range = None
+    last_end = {}
+    endlist = False
+
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith('#EXT-X-MAP:'):
+            if playlist.segments:
+                raise NotTranslatable('init segment changes mid-playlist')
+            attrs = parse_attributes(line.split(':', 1)[1])
+            playlist.init_url = urljoin(url, attrs['URI'])
+            if 'BYTERANGE' in attrs:
+                playlist.init_range = _byterange(attrs['BYTERANGE'], 0)
+        elif line.startswith('#EXT-X-KEY:'):
+            if parse_attributes(line.split(':', 1)[1]).get('METHOD', 'NONE') != 'NONE':
+                raise NotTranslatable('encrypted segments')
+        elif line.startswith('#EXT-X-DISCONTINUITY') and not line.startswith('#EXT-X-DISCONTINUITY-SEQUENCE'):
+            raise NotTranslatable('discontinuities need separate periods')
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            playlist.target_duration = float(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            duration = float(line[len('#EXTINF:'):].split(',', 1)[0])
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            pending_range = line.split(':', 1)[1]
+        elif line.startswith('#EXT-X-ENDLIST'):
+            endlist = True
+        elif not line.startswith('#'):
+            if duration is None:
+                raise NotTranslatable('segment without EXTINF')
+            segment_url = urljoin(url, line)
+            byterange = None
+            if pending_range is not None:
+                byterange = _byterange(pending_range, last_end.get(segment_url))
+                last_end[segment_url] = byterange[1] + 1
+            playlist.segments.append((duration, segment_url, byterange))
+            duration, pending_range = None, None
+
+    if playlist.init_url is None:
+        raise NotTranslatable('no EXT-X-MAP: segments are MPEG-TS or packed audio')
+    if not endlist:
+        raise NotTranslatable('live playlist (no EXT-X-ENDLIST)')
+    if not playlist.segments:
+        raise NotTranslatable('empty playlist')
+    return playlist
+
+
+def parse_master_playlist(text, url):
+    """``(variants, audio_groups)`` from a master playlist.
+
+    Each variant is a dict of its attributes plus ``url``; ``audio_groups``
+    maps a GROUP-ID to its EXT-X-MEDIA TYPE=AUDIO renditions.
+    """
+    variants = []
+    audio_groups = {}
+    pending = None
+    for raw in text.splitlines():
+        line = raw.strip()
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            pending = parse_attributes(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-MEDIA:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            if attrs.get('TYPE') == 'AUDIO' and attrs.get('URI'):
+                attrs['url'] = urljoin(url, attrs['URI'])
+                audio_groups.setdefault(attrs.get('GROUP-ID'), []).append(attrs)
+        elif line and not line.startswith('#') and pending is not None:
+            pending['url'] = urljoin(url, line)
+            variants.append(pending)
+            pending = None
+    return variants, audio_groups
+
+
+# -- init segment sniffing ----------------------------------------------------
+
+_VIDEO_ENTRIES = ('avc1', 'avc3')
+_AUDIO_ENTRIES = ('mp4a',)
+
+
+def _boxes(data, start, end):
+    while start + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, start)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, start + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header or start + size > end:
+            return
+        yield kind.decode('latin-1'), start + header, start + size
+        start += size
+
+
+def _child(data, start, end, kind):
+    for name, body, box_end in _boxes(data, start, end):
+        if name == kind:
+            return body, box_end
+    return None
+
+
+def _descriptor(data, pos):
+    """``(tag, body_start, body_end)`` of an MPEG-4 descriptor at ``pos``."""
+    tag = data[pos]
+    pos += 1
+    length = 0
+    for _ in range(4):
+        byte = data[pos]
+        pos += 1
+        length = (length << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return tag, pos, pos + length
+
+
+def _mp4a_codec(data, start, end):
+    esds = _child(data, start, end, 'esds')
+    if esds is None:
+        return 'mp4a.40.2'
+    tag, pos, _ = _descriptor(data, esds[0] + 4)
+    if tag != 0x03:
+        return 'mp4a.40.2'
+    flags = data[pos + 2]
+    pos += 3
+    if flags & 0x80:
+        pos += 2
+    if flags & 0x40:
+        pos += 1 + data[pos]
+    if flags & 0x20:
+        pos += 2
+    tag, pos, _ = _descriptor(data, pos)
+    if tag != 0x04:
+        return 'mp4a.40.2'
+    object_type = data[pos]
+    if object_type != 0x40:
+        return f'mp4a.{object_type:02x}'
+    tag, pos, _ = _descriptor(data, pos + 13)
+    audio_object_type = data[pos] >> 3 if tag == 0x05 else 2
+    return f'mp4a.40.{audio_object_type}'
+
+
+def sniff_init_segment(data):
+    """``[(kind, codec, width, height)]`` per track of an fMP4 init segment."""
+    tracks = []
+    moov = _child(data, 0, len(data), 'moov')
+    if moov is None:
+        raise NotTranslatable('init segment has no moov box')
+    for name, trak_start, trak_end in _boxes(data, *moov):
+        if name != 'trak':
+            continue
+        stsd = None
+        mdia = _child(data, trak_start, trak_end, 'mdia')
+        minf = mdia and _child(data, *mdia, 'minf')
+        stbl = minf and _child(data, *minf, 'stbl')
+        stsd = stbl and _child(data, *stbl, 'stsd')
+        if not stsd:
+            continue
+        for entry, body, entry_end in _boxes(data, stsd[0] + 8, stsd[1]):
+            if entry in _VIDEO_ENTRIES:
+                avcc = _child(data, body + 78, entry_end, 'avcC')
+                if avcc is None:
+                    raise NotTranslatable(f'{entry} sample entry without avcC')
+                profile, compatibility, level = data[avcc[0] + 1:avcc[0] + 4]
+                width, height = struct.unpack_from('>HH', data, body + 24)
+                tracks.append(('video', f'{entry}.{profile:02x}{compatibility:02x}{level:02x}', width, height))
+            elif entry in _AUDIO_ENTRIES:
+                tracks.append(('audio', _mp4a_codec(data, body + 28, entry_end), None, None))
+            else:
+                raise NotTranslatable(f'cannot derive a codec string for {entry!r} sample entries')
+            break
+    if not tracks:
+        raise NotTranslatable('no tracks in init segment')
+    return tracks
+
+
+# -- MPD -------------------------------------------------------------------------
+
+def _iso_duration(seconds):
+    return f'PT{seconds:.3f}S'
+
+
+def _split_codecs(codecs):
+    video, audio = [], []
+    for codec in (c.strip() for c in codecs.split(',') if c.strip()):
+        (audio if codec.split('.', 1)[0] in ('mp4a', 'ac-3', 'ec-3', 'opus', 'flac') else video).append(codec)
+    return ','.join(video), ','.join(audio)
+
+
+def _segment_list(parent, playlist):
+    segment_list = ET.SubElement(parent, 'SegmentList', timescale=str(TIMESCALE))
+    init = ET.SubElement(segment_list, 'Initialization', sourceURL=playlist.init_url)
+    if playlist.init_range:
+        init.set('range', '%d-%d' % playlist.init_range)
+
+    # Cumulative rounding keeps the timeline free of drift.
+    timeline = ET.SubElement(segment_list, 'SegmentTimeline')
+    elapsed, previous, run = 0.0, None, None
+    for duration, _, _ in playlist.segments:
+        start = round(elapsed * TIMESCALE)
+        elapsed += duration
+        length = round(elapsed * TIMESCALE) - start
+        if run is not None and length == previous:
+            run.set('r', str(int(run.get('r', '0')) + 1))
+            continue
+        run = ET.SubElement(timeline, 'S', d=str(length))
+        if previous is None:
+            run.set('t', '0')
+        previous = length
+
+    for _, url, byterange in playlist.segments:
+        segment = ET.SubElement(segment_list, 'SegmentURL', media=url)
+        if byterange:
+            segment.set('mediaRange', '%d-%d' % byterange)
+
+
+def _representation(adaptation_set, rep_id, bandwidth, playlist, codecs=None, width=None,
+                    height=None, frame_rate=None):
+    rep = ET.SubElement(adaptation_set, 'Representation', id=rep_id, bandwidth=str(int(bandwidth)))
+    if codecs:
+        rep.set('codecs', codecs)
+    if width and height:
+        rep.set('width', str(width))
+        rep.set('height', str(height))
+    if frame_rate:
+        rep.set('frameRate', frame_rate)
+    _segment_list(rep, playlist)
+
+
+def build_mpd(video, audio, duration, max_segment):
+    """MPD XML for ``video``/``audio`` lists of ``(attrs, MediaPlaylist)``."""
+    mpd = ET.Element('MPD', {
+        'xmlns': MPD_NAMESPACE,
+        'profiles': 'urn:mpeg:dash:profile:isoff-main:2011',
+        'type': 'static',
+        'mediaPresentationDuration': _iso_duration(duration),
+        'minBufferTime': _iso_duration(max_segment),
+    })
+    period = ET.SubElement(mpd, 'Period', id='0', start='PT0S')
+
+    if video:
+        adaptation_set = ET.SubElement(period, 'AdaptationSet', id='0', contentType='video',
+                                       mimeType='video/mp4', segmentAlignment='true')
+        for i, (attrs, playlist) in enumerate(video):
+            _representation(adaptation_set, f'v{i}', attrs['bandwidth'], playlist, attrs.get('codecs'),
+                            attrs.get('width'), attrs.get('height'), attrs.get('frame_rate'))
+
+    by_language = {}
+    for attrs, playlist in audio:
+        by_language.setdefault(attrs.get('language'), []).append((attrs, playlist))
+    for n, (language, renditions) in enumerate(by_language.items(), start=1):
+        adaptation_set = ET.SubElement(period, 'AdaptationSet', id=str(n), contentType='audio',
+                                       mimeType='audio/mp4', segmentAlignment='true')
+        if language:
+            adaptation_set.set('lang', language)
+        for i, (attrs, playlist) in enumerate(renditions):
+            _representation(adaptation_set, f'a{n}-{i}', attrs['bandwidth'], playlist, attrs.get('codecs'))
+
+    ET.indent(mpd)
+    return '<?xml version="1.0" encoding="utf-8"?>\n' + ET.tostring(mpd, encoding='unicode') + '\n'
+
+
+def translate(url, fetch, fetch_bytes=None):
+    """MPD text for the HLS presentation at ``url``.
+
+    ``fetch(url)`` returns playlist text; ``fetch_bytes(url, byterange)``
+    returns init-segment bytes and is only needed when codecs are not
+    declared in a master playlist.  Raises :class:`NotTranslatable`.
+    """
+    text = fetch(url)
+    video, audio = [], []
+
+    if is_master_playlist(text):
+        variants, audio_groups = parse_master_playlist(text, url)
+        used_groups = []
+        for variant in variants:
+            codecs = variant.get('CODECS')
+            if not codecs:
+                raise NotTranslatable('variant without CODECS')
+            video_codecs, audio_codecs = _split_codecs(codecs)
+            group = variant.get('AUDIO') if variant.get('AUDIO') in audio_groups else None
+            if group and group not in used_groups:
+                used_groups.append(group)
+            width, _, height = variant.get('RESOLUTION', '').partition('x')
+            video.append(({
+                # Muxed audio stays in the video representation.
+                'codecs': video_codecs if group else codecs,
+                'bandwidth': variant.get('BANDWIDTH', 0),
+                'width': width or None,
+                'height': height or None,
+                'frame_rate': variant.get('FRAME-RATE'),
+                'audio_codecs': audio_codecs,
+            }, parse_media_playlist(fetch(variant['url']), variant['url'])))
+        for group in used_groups:
+            codecs = next((attrs['audio_codecs'] for attrs, _ in video if attrs['audio_codecs']), 'mp4a.40.2')
+            for rendition in audio_groups[group]:
+                audio.append(({
+                    'codecs': codecs,
+                    'bandwidth': 128000,
+                    'language': rendition.get('LANGUAGE'),
+                }, parse_media_playlist(fetch(rendition['url']), rendition['url'])))
+    else:
+        playlist = parse_media_playlist(text, url)
+        if fetch_bytes is None:
+            raise NotTranslatable('codecs unknown without reading the init segment')
+        tracks = sniff_init_segment(fetch_bytes(playlist.init_url, playlist.init_range))
+        video_tracks = [t for t in tracks if t[0] == 'video']
+        codecs = ','.join(t[1] for t in tracks)
+        size = sum((r[1] - r[0] + 1) for _, _, r in playlist.segments if r)
+        bandwidth = int(size * 8 / playlist.duration) if size else 2000000
+        attrs = {'codecs': codecs, 'bandwidth': bandwidth}
+        if video_tracks:
+            attrs.update(width=video_tracks[0][2], height=video_tracks[0][3])
+            video.append((attrs, playlist))
+        else:
+            audio.append((attrs, playlist))
+
+    if not video and not audio:
+        raise NotTranslatable('no renditions')
+    first = (video or audio)[0][1]
+    max_segment = max(d for _, playlist in video + audio for d, _, _ in playlist.segments)
+    return build_mpd(video, audio, first.duration, first.target_duration or max_segment)
@@ -0,0 +1,276 @@
+"""HTTP ingest that lands ffmpeg's DASH output straight in the artifact store.
+
+With ``-method PUT`` the DASH muxer writes over HTTP: every init segment,
+media segment and manifest update arrives as a chunked PUT, each on its
+own connection.  :class:`IngestServer` listens on ``127.0.0.1``
+and streams each body into the conversion's artifact directory under a
+``*.tmp`` name, renaming it into place once complete.  The muxer cannot
+rename over HTTP itself, so this is what keeps readers from ever seeing
+a half-written file; every segment (and each MPD update) is downloadable
+the moment it lands, while the conversion is still running.
+
+Each conversion opens an :class:`IngestSession` with its own random
+token; requests are ``/<token>/<filename>`` and anything else is refused,
+so other local processes cannot write into the store.
+
+Tunables (environment):
+
+``INGEST_MAX_BYTES``  largest single file accepted (default 1 GiB)
+"""
+import os
+import secrets
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from api._lib import metrics
+
+_COPY_SIZE = 256 << 10
+
+INGESTED_FILES = metrics.counter(
+    'ingest_files_total', 'Files ffmpeg pushed into the artifact store, by kind.', ('kind',))
+INGESTED_BYTES = metrics.counter(
+    'ingest_bytes_total', 'Bytes ffmpeg pushed into the artifact store.')
+
+
+class _TooLarge(Exception):
+    pass
+
+
+def _kind(name):
+    if name.endswith('.mpd'):
+        return 'manifest'
+    return 'init' if name.startswith('init') else 'media'
+
+
+class IngestSession:
+    """Where one conversion's output goes: ``url(name)`` for ffmpeg, files on disk."""
+
+    def __init__(self, server, directory):
+        self.server = server
+        self.directory = directory
+        self.token = secrets.token_hex(8)
+        self.files = 0
+        self.bytes = 0
+        self._active = 0
+        self._touched = time.monotonic()
+        self._cond = threading.Condition()
+
+    def url(self, filename):
+        host, port = self.server.address
+        return f'http://{host}:{port}/{self.token}/{filename}'
+
+    def _path(self, filename):
+        # Plain names only: the muxer never writes into subdirectories
+        if not filename or filename.startswith('.') or os.path.basename(filename) != filename:
+            return None
+        return os.path.join(self.directory, filename)
+
+    def _begin(self):
+        with self._cond:
+            self._active += 1
+            self._touched = time.monotonic()
+
+    def _end(self, filename=None, size=0):
+        with self._cond:
+            self._active -= 1
+            self._touched = time.monotonic()
+            if filename is not None:
+                self.files += 1
+                self.bytes += size
+            self._cond.notify_all()
+        if filename is not None:
+            INGESTED_FILES.inc(kind=_kind(filename))
+            INGESTED_BYTES.inc(size)
+
+    def drain(self, timeout=5.0, quiet=0.2):
+        """Wait until no write has been in flight for ``quiet`` seconds.
+
+        ffmpeg does not wait for the reply to its last PUT, so the final
+        manifest may still be landing when the process has already exited.
+        Returns False if writes were still arriving after ``timeout``.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if not self._active and now - self._touched >= quiet:
+                    return True
+                if now >= deadline:
+                    return False
+                self._cond.wait(min(deadline - now, quiet))
+
+    def close(self):
+        """Let in-flight writes finish, then refuse further ones."""
+        self.drain()
+        self.server.close(self)
+
+
+class _IngestHandler(BaseHTTPRequestHandler):
+    """Accepts ffmpeg's PUT/DELETE requests for ``/<token>/<name>``."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _target(self):
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if len(parts) != 2:
+            return None, None
+        session = self.server.ingest.session(parts[0])
+        path = session._path(parts[1]) if session is not None else None
+        return (session, path) if path is not None else (None, None)
+
+    def _body_blocks(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';', 1)[0].strip() or b'0', 16)
+                if size == 0:
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                while size:
+                    block = self.rfile.read(min(size, _COPY_SIZE))
+                    if not block:
+                        raise ConnectionResetError('body ended early')
+                    size -= len(block)
+                    yield block
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get('Content-Length') or 0)
+            while remaining:
+                block = self.rfile.read(min(remaining, _COPY_SIZE))
+                if not block:
+                    raise ConnectionResetError('body ended early')
+                remaining -= len(block)
+                yield block
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_PUT(self):
+        session, path = self._target()
+        if session is None:
+            # The body is never read, so the connection cannot be reused
+            self.close_connection = True
+            self._reply(404)
+            return
+
+        tmp = f'{path}.{secrets.token_hex(4)}.tmp'
+        size = 0
+        session._begin()
+        try:
+            with open(tmp, 'wb') as f:
+                for block in self._body_blocks():
+                    size += len(block)
+                    if size > self.server.ingest.max_bytes:
+                        raise _TooLarge()
+                    f.write(block)
+            existed = os.path.exists(path)
+            os.replace(tmp, path)
+        except _TooLarge:
+            os.unlink(tmp)
+            session._end()
+            self.close_connection = True
+            self._reply(413)
+            return
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            session._end()
+            raise
+        session._end(os.path.basename(path), size)
+        self._reply(204 if existed else 201)
+
+    do_POST = do_PUT
+
+    def do_DELETE(self):
+        session, path = self._target()
+        if session is not None:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self._reply(204)
+
+
+class _IngestServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, ingest):
+        super().__init__(('127.0.0.1', 0), _IngestHandler)
+        self.ingest = ingest
+
+    def handle_error(self, request, client_address):
+        # ffmpeg drops its connection mid-request when it is stopped.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class IngestServer:
+    def __init__(self, max_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.opened = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_bytes=int(os.environ.get('INGEST_MAX_BYTES', 1 << 30)))
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def _ensure_started(self):
+        if self._server is None:
+            self._server = _IngestServer(self)
+            threading.Thread(target=self._server.serve_forever, name='ingest', daemon=True).start()
+
+    def open(self, directory):
+        """A new session writing into ``directory`` (which must exist)."""
+        with self._lock:
+            self._ensure_started()
+            session = IngestSession(self, directory)
+            self._sessions[session.token] = session
+            self.opened += 1
+        return session
+
+    def session(self, token):
+        with self._lock:
+            return self._sessions.get(token)
+
+    def close(self, session):
+        """Refuse further writes for ``session``."""
+        with self._lock:
+            self._sessions.pop(session.token, None)
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            'address': '%s:%d' % self.address if self._server is not None else None,
+            'open_sessions': len(sessions),
+            'opened': self.opened,
+        }
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_ingest_server():
+    """Process-wide ingest server, listening from first use."""
+    global _server
+    if _server is None:
+        with _server_lock:
+            if _server is None:
+                _server = IngestServer.from_env()
+    return _server
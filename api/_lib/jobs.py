@@ -0,0 +1,257 @@
+"""Bounded worker pool for long-running conversion jobs.
+
+``JobQueue.submit`` returns immediately with a :class:`Job` whose state
+moves through ``queued`` -> ``running`` -> ``done`` | ``failed``.  Jobs
+are submitted to a *lane*, each with its own wait queue and fixed number
+of worker threads, so cheap jobs never wait behind expensive ones; when
+``max_queue`` jobs are already waiting in a lane, further submissions to
+it are refused with :class:`QueueFull` so a burst of requests cannot
+pile up unbounded work.  A job that only learns what kind of work it is
+once running raises :class:`ChangeLane` to be queued again on another
+lane.  Finished jobs are kept for ``retention`` seconds
+so clients can poll their result.  Every state or progress change bumps
+:attr:`Job.version`, which :meth:`Job.wait_for_change` lets event
+streams block on.
+
+Tunables (environment):
+
+``CONVERT_WORKERS``      concurrent transcode jobs (default: the
+                         scheduler's core count, which also caps the
+                         cores they use); remux jobs get
+                         ``CONVERT_REMUX_WORKERS``
+``CONVERT_QUEUE_DEPTH``  jobs allowed to wait per lane (default 16)
+``CONVERT_RETENTION``    seconds finished jobs stay visible (default 3600)
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from api._lib.scheduler import REMUX, TRANSCODE, get_scheduler
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """Raised by :meth:`JobQueue.submit` when the wait queue is at capacity."""
+
+
+class ChangeLane(Exception):
+    """Raised by a running job to continue on ``lane`` instead."""
+
+    def __init__(self, lane):
+        super().__init__(lane)
+        self.lane = lane
+
+
+class Job:
+    """A unit of work and its observable state."""
+
+    def __init__(self, target, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.params = params
+        self.lane = None
+        self.state = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.version = 0
+        self._target = target
+        self._done = threading.Event()
+        self._changed = threading.Condition()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def update(self, **progress):
+        """Merge progress fields reported by the running job."""
+        self.progress = {**self.progress, **progress}
+        self._touch()
+
+    def _touch(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def wait_for_change(self, version, timeout=None):
+        """Block until :attr:`version` moves past ``version``; return it."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def add_done_callback(self, fn):
+        """Call ``fn(job)`` once the job finishes (immediately if it has)."""
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self):
+        with self._callbacks_lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        self._touch()
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                pass
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'state': self.state,
+            'lane': self.lane,
+            'created': datetime.fromtimestamp(self.created).isoformat(),
+            'started': datetime.fromtimestamp(self.started).isoformat() if self.started else None,
+            'finished': datetime.fromtimestamp(self.finished).isoformat() if self.finished else None,
+        }
+        if self.state == RUNNING or self.progress:
+            data['progress'] = self.progress
+        if self.result is not None:
+            data['result'] = self.result
+        if self.error is not None:
+            data['error'] = self.error
+        return data
+
+
+class JobQueue:
+    def __init__(self, workers=2, max_queue=16, retention=3600.0, lanes=None, default_lane=TRANSCODE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retention = retention
+        self.default_lane = default_lane
+        self.lanes = {default_lane: workers, **(lanes or {})}
+        self._queues = {lane: queue.Queue(maxsize=max_queue) for lane in self.lanes}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = dict.fromkeys(self.lanes, 0)
+
+    @classmethod
+    def from_env(cls):
+        scheduler = get_scheduler()
+        return cls(
+            workers=int(os.environ.get('CONVERT_WORKERS', scheduler.cores)),
+            max_queue=int(os.environ.get('CONVERT_QUEUE_DEPTH', 16)),
+            retention=float(os.environ.get('CONVERT_RETENTION', 3600)),
+            lanes={REMUX: scheduler.remux_workers},
+        )
+
+    def _ensure_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for lane, workers in self.lanes.items():
+                for n in range(workers):
+                    thread = threading.Thread(target=self._work, args=(lane,), name=f'job-{lane}-{n}', daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def submit(self, target, params, lane=None):
+        """Queue ``target(job)`` on ``lane`` and return the new job without waiting."""
+        lane = lane or self.default_lane
+        self._ensure_workers()
+        self._prune()
+        job = Job(target, params)
+        job.lane = lane
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queues[lane].put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFull(f'{self.max_queue} {lane} jobs already waiting')
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _work(self, lane):
+        jobs = self._queues[lane]
+        while True:
+            job = jobs.get()
+            with self._lock:
+                self._running[lane] += 1
+            job.state = RUNNING
+            job.started = time.time()
+            job._touch()
+            moved_to = None
+            try:
+                job.result = job._target(job)
+                job.state = DONE
+            except ChangeLane as e:
+                moved_to = e.lane
+            except Exception as e:
+                job.error = str(e)
+                job.state = FAILED
+            finally:
+                with self._lock:
+                    self._running[lane] -= 1
+                if moved_to is None:
+                    job.finished = time.time()
+                    job._finish()
+                jobs.task_done()
+            if moved_to is not None:
+                self._move(job, moved_to)
+
+    def _move(self, job, lane):
+        job.lane = lane
+        job.state = QUEUED
+        job.started = None
+        job._touch()
+        try:
+            self._queues[lane].put_nowait(job)
+        except queue.Full:
+            job.error = f'{self.max_queue} {lane} jobs already waiting'
+            job.state = FAILED
+            job.finished = time.time()
+            job._finish()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and job.finished < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            lanes = {lane: {'workers': workers, 'queued': self._queues[lane].qsize(), 'running': self._running[lane]}
+                     for lane, workers in self.lanes.items()}
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'queued': sum(lane['queued'] for lane in lanes.values()),
+                'running': sum(lane['running'] for lane in lanes.values()),
+                'tracked_jobs': len(self._jobs),
+                'lanes': lanes,
+            }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Process-wide conversion queue, created on first use."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue.from_env()
+    return _queue
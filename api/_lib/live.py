@@ -0,0 +1,419 @@
+"""Live HLS-to-DASH repackaging served from a rolling in-memory window.
+
+One :class:`LivePackager` per channel runs ``ffmpeg -c copy -f dash``
+against the channel's HLS feed.  Instead of writing to disk, ffmpeg PUTs
+the dynamic MPD and every init/media segment to a small HTTP sink bound
+to ``127.0.0.1`` (:class:`_SinkServer`), which stores them in the
+packager's :class:`LiveWindow`.  Viewers are answered straight from that
+window, so any number of them share one ffmpeg process per channel.
+
+:class:`LiveHub` starts a packager on the first request for a channel
+and a reaper stops it once nobody has asked for ``idle_timeout`` seconds;
+a packager whose ffmpeg exited is replaced on the next request.  One that
+exits (or is still silent after ``start_timeout``) before publishing an
+MPD is a start failure: requests for that channel get a
+:class:`LiveStartError` carrying ffmpeg's last stderr lines at once, for
+``start_cooldown`` seconds, instead of each spawning another ffmpeg.
+
+Tunables (environment):
+
+``LIVE_WINDOW``            media segments advertised in the MPD (default 5)
+``LIVE_SEGMENT_DURATION``  target segment length in seconds (default 4)
+``LIVE_IDLE_TIMEOUT``      seconds without requests before stopping (default 60)
+``LIVE_START_TIMEOUT``     seconds a first request waits for the MPD (default 20)
+``LIVE_START_COOLDOWN``    seconds a failed start is remembered (default 30)
+"""
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MPD_NAME = 'manifest.mpd'
+MPD_CONTENT_TYPE = 'application/dash+xml'
+
+
+class LiveStartError(Exception):
+    """ffmpeg could not start packaging a channel."""
+
+    def __init__(self, key, tail=''):
+        message = f'live packager for {key} failed to start'
+        super().__init__(f'{message}: {tail[-500:]}' if tail else message)
+        self.key = key
+        self.tail = tail
+
+
+def content_type(name):
+    if name.endswith('.mpd'):
+        return MPD_CONTENT_TYPE
+    if name.endswith('.m4s') or name.endswith('.mp4'):
+        return 'video/iso.segment'
+    return 'application/octet-stream'
+
+
+class LiveWindow:
+    """The latest MPD, every init segment and the newest media segments.
+
+    Media segments are bounded per representation (``chunk-stream0-*``,
+    ``chunk-stream1-*``, ...), on top of the DELETEs ffmpeg sends for
+    segments that leave its window.
+    """
+
+    def __init__(self, max_segments):
+        self.max_segments = max_segments
+        self.mpd = None
+        self.closed = False
+        self.updated = None
+        self.received = 0
+        self.bytes_in = 0
+        self._init = {}
+        self._media = {}   # name -> bytes
+        self._streams = {}  # representation prefix -> OrderedDict of names
+        self._cond = threading.Condition()
+
+    def put(self, name, data):
+        with self._cond:
+            self.received += 1
+            self.bytes_in += len(data)
+            if name == MPD_NAME:
+                self.mpd = data
+            elif name.startswith('init'):
+                self._init[name] = data
+            else:
+                self._media[name] = data
+                names = self._streams.setdefault(name.rsplit('-', 1)[0], OrderedDict())
+                names[name] = None
+                while len(names) > self.max_segments:
+                    self._media.pop(names.popitem(last=False)[0], None)
+            self.updated = time.monotonic()
+            self._cond.notify_all()
+
+    def delete(self, name):
+        with self._cond:
+            if self._media.pop(name, None) is not None:
+                self._streams.get(name.rsplit('-', 1)[0], {}).pop(name, None)
+
+    def get(self, name):
+        with self._cond:
+            if name == MPD_NAME:
+                return self.mpd
+            return self._init.get(name) or self._media.get(name)
+
+    def close(self):
+        """No more writes are coming: wake anyone waiting for the MPD."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def wait_for_mpd(self, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self.mpd is not None or self.closed, timeout)
+            return self.mpd
+
+    def stats(self):
+        with self._cond:
+            return {
+                'segments': len(self._media),
+                'window_bytes': sum(map(len, self._media.values())) + sum(map(len, self._init.values())),
+                'received': self.received,
+                'bytes_in': self.bytes_in,
+            }
+
+
+class LivePackager:
+    """One ffmpeg process repackaging ``source_url`` into a :class:`LiveWindow`."""
+
+    def __init__(self, key, source_url, sink_url, headers=None, window=5, segment_duration=4):
+        self.key = key
+        self.source_url = source_url
+        self.headers = headers or {}
+        self.window = LiveWindow(max_segments=window * 2)
+        self.started = time.time()
+        self.started_monotonic = time.monotonic()
+        self.last_access = time.monotonic()
+        self.requests = 0
+        self._sink_url = sink_url
+        self._window_size = window
+        self._segment_duration = segment_duration
+        self._process = None
+        self._stderr = deque(maxlen=20)
+
+    def command(self):
+        cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-re']
+        header_lines = ''.join(f'{k}: {v}\r\n' for k, v in self.headers.items() if k != 'User-Agent')
+        if 'User-Agent' in self.headers:
+            cmd += ['-user_agent', self.headers['User-Agent']]
+        if header_lines:
+            cmd += ['-headers', header_lines]
+        return cmd + [
+            '-i', self.source_url,
+            '-map', '0:v:0?', '-map', '0:a:0?',
+            '-c', 'copy',
+            '-f', 'dash',
+            '-use_timeline', '1',
+            '-use_template', '1',
+            '-seg_duration', str(self._segment_duration),
+            '-window_size', str(self._window_size),
+            '-extra_window_size', str(self._window_size),
+            '-remove_at_exit', '1',
+            '-method', 'PUT',
+            '-http_persistent', '1',
+            f'{self._sink_url}/{MPD_NAME}',
+        ]
+
+    def start(self):
+        self._process = subprocess.Popen(
+            self.command(), stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            text=True, errors='replace',
+        )
+        threading.Thread(target=self._drain_stderr, name=f'live-stderr-{self.key}', daemon=True).start()
+        return self
+
+    def _drain_stderr(self):
+        for line in self._process.stderr:
+            self._stderr.append(line.rstrip())
+        self._process.wait()
+        self.window.close()
+
+    @property
+    def tail(self):
+        """ffmpeg's last stderr lines."""
+        return '\n'.join(self._stderr)
+
+    def start_failed(self, timeout):
+        """True once ffmpeg exited, or ran ``timeout`` seconds, without an MPD."""
+        if self.window.mpd is not None:
+            return False
+        return not self.running or time.monotonic() - self.started_monotonic >= timeout
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.poll() is None
+
+    def touch(self):
+        self.last_access = time.monotonic()
+        self.requests += 1
+
+    def stop(self):
+        if self.running:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+
+    def stats(self):
+        return {
+            'source': self.source_url,
+            'running': self.running,
+            'requests': self.requests,
+            'idle_seconds': round(time.monotonic() - self.last_access, 1),
+            **self.window.stats(),
+        }
+
+
+class _SinkHandler(BaseHTTPRequestHandler):
+    """Accepts ffmpeg's PUT/DELETE requests for ``/<token>/<key>/<name>``."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _target(self):
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if len(parts) != 3 or parts[0] != self.server.token:
+            return None, None
+        return self.server.hub.packager(parts[1]), parts[2]
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';', 1)[0].strip() or b'0', 16)
+                if size == 0:
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_PUT(self):
+        body = self._read_body()
+        packager, name = self._target()
+        if packager is None:
+            self._reply(404)
+            return
+        packager.window.put(name, body)
+        self._reply(201)
+
+    do_POST = do_PUT
+
+    def do_DELETE(self):
+        packager, name = self._target()
+        if packager is not None:
+            packager.window.delete(name)
+        self._reply(204)
+
+
+class _SinkServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, hub):
+        super().__init__(('127.0.0.1', 0), _SinkHandler)
+        self.hub = hub
+        self.token = secrets.token_hex(8)
+
+    def handle_error(self, request, client_address):
+        # ffmpeg drops its connection mid-request when it is stopped.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class LiveHub:
+    def __init__(self, window=5, segment_duration=4, idle_timeout=60.0, start_timeout=20.0, start_cooldown=30.0):
+        self.window = window
+        self.segment_duration = segment_duration
+        self.idle_timeout = idle_timeout
+        self.start_timeout = start_timeout
+        self.start_cooldown = start_cooldown
+        self.started = 0
+        self.stopped = 0
+        self.start_failures = 0
+        self._packagers = {}
+        self._failures = {}  # key -> (retry_at, LiveStartError)
+        self._lock = threading.Lock()
+        self._sink = None
+        self._reaper = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            window=int(os.environ.get('LIVE_WINDOW', 5)),
+            segment_duration=float(os.environ.get('LIVE_SEGMENT_DURATION', 4)),
+            idle_timeout=float(os.environ.get('LIVE_IDLE_TIMEOUT', 60)),
+            start_timeout=float(os.environ.get('LIVE_START_TIMEOUT', 20)),
+            start_cooldown=float(os.environ.get('LIVE_START_COOLDOWN', 30)),
+        )
+
+    def _ensure_threads(self):
+        if self._sink is None:
+            self._sink = _SinkServer(self)
+            threading.Thread(target=self._sink.serve_forever, name='live-sink', daemon=True).start()
+            self._reaper = threading.Thread(target=self._reap, name='live-reaper', daemon=True)
+            self._reaper.start()
+
+    def packager(self, key):
+        with self._lock:
+            return self._packagers.get(key)
+
+    def _fail_locked(self, key, packager):
+        if self._packagers.get(key) is not packager and key in self._failures:
+            return self._failures[key][1]  # another request got here first
+        error = LiveStartError(key, packager.tail)
+        self._failures[key] = (time.monotonic() + self.start_cooldown, error)
+        if self._packagers.get(key) is packager:
+            del self._packagers[key]
+        self.start_failures += 1
+        return error
+
+    def acquire(self, key, source_url, headers=None):
+        """The running packager for ``key``, started if needed.
+
+        Raises :class:`LiveStartError` while the channel's last start
+        failure is within ``start_cooldown``.
+        """
+        with self._lock:
+            self._ensure_threads()
+            failure = self._failures.get(key)
+            if failure is not None:
+                if failure[0] > time.monotonic():
+                    raise failure[1]
+                del self._failures[key]
+            packager = self._packagers.get(key)
+            if packager is not None and packager.start_failed(self.start_timeout):
+                stopping = packager
+                error = self._fail_locked(key, packager)
+            else:
+                stopping = error = None
+            if error is None and (packager is None or not packager.running):
+                host, port = self._sink.server_address[:2]
+                packager = LivePackager(
+                    key, source_url, f'http://{host}:{port}/{self._sink.token}/{key}',
+                    headers=headers, window=self.window, segment_duration=self.segment_duration,
+                ).start()
+                self._packagers[key] = packager
+                self.started += 1
+        if error is not None:
+            stopping.stop()
+            raise error
+        packager.touch()
+        return packager
+
+    def read(self, key, source_url, name, headers=None):
+        """``(content_type, bytes)`` for ``name`` of channel ``key``, or ``None``.
+
+        The first request for a channel waits up to ``start_timeout`` for
+        ffmpeg to publish its MPD; if ffmpeg gives up (or that time runs
+        out) first, raises :class:`LiveStartError`.
+        """
+        packager = self.acquire(key, source_url, headers)
+        if name == MPD_NAME:
+            data = packager.window.wait_for_mpd(self.start_timeout)
+            if data is None and packager.start_failed(self.start_timeout):
+                with self._lock:
+                    error = self._fail_locked(key, packager)
+                packager.stop()
+                raise error
+        else:
+            data = packager.window.get(name)
+        return None if data is None else (content_type(name), data)
+
+    def _reap(self):
+        while True:
+            time.sleep(min(5.0, self.idle_timeout))
+            now = time.monotonic()
+            with self._lock:
+                idle = [key for key, p in self._packagers.items()
+                        if now - p.last_access > self.idle_timeout]
+                stopped = [self._packagers.pop(key) for key in idle]
+                for key in [key for key, (retry_at, _) in self._failures.items() if retry_at <= now]:
+                    del self._failures[key]
+            for packager in stopped:
+                packager.stop()
+            self.stopped += len(stopped)
+
+    def stats(self):
+        with self._lock:
+            packagers = dict(self._packagers)
+        return {
+            'packagers': {key: p.stats() for key, p in packagers.items()},
+            'started': self.started,
+            'stopped': self.stopped,
+            'start_failures': self.start_failures,
+        }
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_live_hub():
+    """Process-wide live packaging hub, created on first use."""
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = LiveHub.from_env()
+    return _hub
@@ -0,0 +1,249 @@
+"""Prometheus text-format metrics without a client library.
+
+Instruments (:class:`Counter`, :class:`Gauge`, :class:`Histogram`) are
+created once at import time and updated from request paths; they only
+take a lock and add.  Values that other modules already track (pool,
+broadcaster and cache counters) are not duplicated: a *collector* is a
+callable registered with :func:`register_collector` that reads them when
+``/metrics`` is scraped and yields ``(name, type, help, samples)``.
+
+Every process has its own registry.  On Vercel the proxy, converter,
+download and status functions run in separate processes, so each one's
+``/metrics`` shows the traffic it served; self-hosted, one process serves
+everything.
+"""
+import bisect
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers fast JSON routes up to long conversions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_labels(self.labelnames, key)} {_number(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", _number(float(bound)))])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started, **self._labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collector):
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        # Several collectors may report the same family (e.g. cache_hits_total
+        # for different caches); each family is written once.
+        families = {}
+        for collector in collectors:
+            try:
+                collected = list(collector())
+            except Exception:
+                # A broken collector must not take the whole scrape down.
+                continue
+            for name, kind, help, samples in collected:
+                families.setdefault(name, (kind, help, []))[2].extend(samples)
+        for name, (kind, help, samples) in families.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                if value is None:
+                    continue
+                names, values = zip(*sorted(labels.items())) if labels else ((), ())
+                lines.append(f'{name}{_labels(names, values)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+register_collector = REGISTRY.register_collector
+render = REGISTRY.render
+
+RELAYED_BYTES = counter(
+    'relay_bytes_total',
+    'Stream bytes read from origins (in) and written to viewers (out).',
+    ('direction', 'server'),
+)
+
+REQUEST_DURATION = histogram(
+    'http_request_duration_seconds',
+    'Time to the response headers, by route template.',
+    ('route', 'method', 'status'),
+)
+
+
+def cache_families(name, stats):
+    """Hit/miss/join counters and hit ratio for a cache's ``stats()`` dict."""
+    labels = {'cache': name}
+    families = [
+        ('cache_hits_total', 'counter', 'Cache lookups served from cache.', [(labels, stats.get('hits'))]),
+        ('cache_misses_total', 'counter', 'Cache lookups that had to load.', [(labels, stats.get('misses'))]),
+        ('cache_hit_ratio', 'gauge', 'Share of lookups not needing a load.', [(labels, stats.get('hit_ratio'))]),
+    ]
+    if 'joins' in stats:
+        families.append(('cache_joins_total', 'counter', 'Lookups that joined an in-flight load.',
+                         [(labels, stats['joins'])]))
+    return families
+
+
+def timed_handler(route):
+    """Decorator recording a serverless ``handler(request)`` in REQUEST_DURATION."""
+    def decorate(handler):
+        def wrapper(request):
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = handler(request)
+                status = response.get('statusCode', 200)
+                return response
+            finally:
+                REQUEST_DURATION.observe(time.perf_counter() - started, route=route,
+                                         method=getattr(request, 'method', ''), status=status)
+        wrapper.__name__ = handler.__name__
+        wrapper.__doc__ = handler.__doc__
+        return wrapper
+    return decorate
@@ -0,0 +1,379 @@
+"""Mirror origins with latency/error scoring, failover and hedged fetches.
+
+A *mirror set* is a list of interchangeable base URLs: a channel URL that
+starts with one base can be served from every other base with the rest of
+the path unchanged.  Sets apply to every channel unless restricted to
+some groups or channel ids.  ``ORIGIN_MIRRORS`` holds them as JSON (or the
+path of a JSON file)::
+
+    [{"bases": ["http://a.example:8000/live", "http://b.example/live"]},
+     {"bases": ["http://c.example/sport", "http://d.example/sport"], "groups": ["beiN Sport"]},
+     {"bases": ["http://e.example/ch/7340", "http://f.example/7340"], "channels": ["7340"]}]
+
+Each origin (``scheme://host:port``) keeps an EWMA of its response time
+and an EWMA error rate that decays back towards zero while unused, so a
+recovered mirror is tried again.  Candidates are ranked by
+``latency + ERROR_PENALTY * error_rate``; origins never measured rank
+first so that new mirrors get explored.
+
+:meth:`OriginRouter.fetch` (playlists, segments) sends a second, hedged
+request to the next-best origin when the first has not answered within
+the p95 of that origin's recent response times, and returns whichever
+answers first.  :meth:`OriginRouter.open_stream` (live TS) walks the
+ranking until an origin answers; the broadcaster reopens through it when
+a stream stalls or drops mid-way.  :meth:`OriginRouter.open_stream_async`
+does the same for the ASGI server's broadcaster.
+
+Tunables (environment):
+
+``ORIGIN_MIRRORS``          mirror sets, JSON or a path to a JSON file
+``ORIGIN_EWMA_ALPHA``       weight of the newest sample (default 0.3)
+``ORIGIN_ERROR_HALF_LIFE``  seconds for an error score to halve (default 60)
+``ORIGIN_HEDGE``            set to 0 to disable hedged requests
+``ORIGIN_HEDGE_MIN_MS``     lower bound for the hedge delay (default 50)
+``ORIGIN_HEDGE_MAX_MS``     hedge delay before enough samples exist, and
+                            upper bound (default 1500)
+``ORIGIN_STALL_TIMEOUT``    seconds without stream data before failing over
+                            (default 5)
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+
+# Seconds of latency an error rate of 1.0 is worth when ranking
+ERROR_PENALTY = 5.0
+
+# Samples kept per origin for the p95 hedge delay
+LATENCY_SAMPLES = 64
+
+# Responses at or above this status count as origin failures
+FAILURE_STATUS = 500
+
+
+def origin_of(url):
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+def load_mirror_sets(value):
+    """Parse ``ORIGIN_MIRRORS`` (inline JSON or a file path) into a list of sets."""
+    if not value:
+        return []
+    if not value.lstrip().startswith('['):
+        with open(value) as f:
+            value = f.read()
+    sets = []
+    for entry in json.loads(value):
+        bases = [b.rstrip('/') for b in entry.get('bases', ()) if b]
+        if len(bases) < 2:
+            continue
+        sets.append({
+            'bases': bases,
+            'groups': set(entry['groups']) if entry.get('groups') else None,
+            'channels': {str(c) for c in entry['channels']} if entry.get('channels') else None,
+        })
+    return sets
+
+
+class OriginScore:
+    """Response-time and error EWMAs for one origin."""
+
+    __slots__ = ('latency', 'error', 'error_at', 'samples', 'requests', 'errors')
+
+    def __init__(self):
+        self.latency = None
+        self.error = 0.0
+        self.error_at = time.monotonic()
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+        self.requests = 0
+        self.errors = 0
+
+    def error_rate(self, half_life, now=None):
+        now = time.monotonic() if now is None else now
+        return self.error * 0.5 ** ((now - self.error_at) / half_life)
+
+    def score(self, half_life, now=None):
+        return (self.latency or 0.0) + ERROR_PENALTY * self.error_rate(half_life, now)
+
+    def p95(self):
+        if len(self.samples) < 10:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+class OriginRouter:
+    def __init__(self, mirror_sets=(), alpha=0.3, error_half_life=60.0, hedge=True,
+                 hedge_min=0.05, hedge_max=1.5, stall_timeout=5.0, workers=64):
+        self.mirror_sets = list(mirror_sets)
+        self.alpha = alpha
+        self.error_half_life = error_half_life
+        self.hedge = hedge
+        self.hedge_min = hedge_min
+        self.hedge_max = hedge_max
+        self.stall_timeout = stall_timeout
+        self._workers = workers
+        self._executor = None
+        self._scores = defaultdict(OriginScore)
+        self._decisions = defaultdict(int)  # (origin, decision) -> count
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            mirror_sets=load_mirror_sets(os.environ.get('ORIGIN_MIRRORS')),
+            alpha=float(os.environ.get('ORIGIN_EWMA_ALPHA', 0.3)),
+            error_half_life=float(os.environ.get('ORIGIN_ERROR_HALF_LIFE', 60)),
+            hedge=os.environ.get('ORIGIN_HEDGE', '1') != '0',
+            hedge_min=float(os.environ.get('ORIGIN_HEDGE_MIN_MS', 50)) / 1000,
+            hedge_max=float(os.environ.get('ORIGIN_HEDGE_MAX_MS', 1500)) / 1000,
+            stall_timeout=float(os.environ.get('ORIGIN_STALL_TIMEOUT', 5)),
+        )
+
+    # -- candidates and scores ------------------------------------------
+
+    def candidates(self, url, channel_id=None, group=None):
+        """``url`` followed by its equivalents on every applicable mirror."""
+        urls = [url]
+        for mirror in self.mirror_sets:
+            if mirror['channels'] is not None and channel_id not in mirror['channels']:
+                continue
+            if mirror['groups'] is not None and group not in mirror['groups']:
+                continue
+            for base in mirror['bases']:
+                if url == base or url.startswith(base + '/') or url.startswith(base + '?'):
+                    rest = url[len(base):]
+                    urls.extend(other + rest for other in mirror['bases'] if other + rest not in urls)
+                    break
+        return urls
+
+    def score(self, url):
+        """Ranking key; lower is better and unmeasured origins come first."""
+        with self._lock:
+            entry = self._scores.get(origin_of(url))
+            if entry is None:
+                return 0.0
+            return entry.score(self.error_half_life)
+
+    def rank(self, urls):
+        return sorted(urls, key=self.score)
+
+    def record(self, url, latency=None, error=False):
+        """Fold one response time and/or failure into the origin's score."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._scores[origin_of(url)]
+            entry.requests += 1
+            if latency is not None:
+                entry.samples.append(latency)
+                entry.latency = latency if entry.latency is None else (
+                    self.alpha * latency + (1 - self.alpha) * entry.latency)
+            rate = entry.error_rate(self.error_half_life, now)
+            entry.error = self.alpha * (1.0 if error else 0.0) + (1 - self.alpha) * rate
+            entry.error_at = now
+            if error:
+                entry.errors += 1
+
+    def _decide(self, url, decision):
+        origin = origin_of(url)
+        with self._lock:
+            self._scores[origin]  # listed in stats even before its first answer
+            self._decisions[(origin, decision)] += 1
+
+    def hedge_delay(self, url):
+        with self._lock:
+            entry = self._scores.get(origin_of(url))
+            p95 = entry.p95() if entry is not None else None
+        if p95 is None:
+            return self.hedge_max
+        return min(self.hedge_max, max(self.hedge_min, p95))
+
+    # -- requests -------------------------------------------------------
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self._workers, thread_name_prefix='origin-fetch')
+            return self._executor
+
+    def _timed(self, get, url, kwargs):
+        started = time.monotonic()
+        try:
+            response = get(url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.record(url, error=True)
+            raise
+        self.record(url, time.monotonic() - started, error=response.status_code >= FAILURE_STATUS)
+        return response
+
+    def fetch(self, urls, get, **kwargs):
+        """GET the first good answer among ``urls`` (best first), hedging slow ones.
+
+        ``get(url, **kwargs)`` performs one request.  A response served by
+        a mirror without redirects reports the requested URL as its
+        ``url``, so relative URIs in it resolve to stable proxy keys.
+        """
+        ranked = self.rank(urls)
+        executor = self._get_executor()
+        untried = list(ranked)
+        futures = {}  # future -> (url, decision)
+
+        def submit(url, decision):
+            if url in untried:
+                untried.remove(url)
+            futures[executor.submit(self._timed, get, url, kwargs)] = (url, decision)
+            self._decide(url, decision)
+
+        submit(ranked[0], 'primary')
+        # Only another origin is worth hedging to: asking the same slow one
+        # again doubles its load and fetches the object twice
+        if self.hedge and untried:
+            done, _ = wait(futures, timeout=self.hedge_delay(ranked[0]))
+            if not done:
+                submit(untried[0], 'hedge')
+
+        last_response, last_error = None, None
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                url, decision = futures.pop(future)
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    last_error = e
+                    continue
+                if response.status_code >= FAILURE_STATUS:
+                    # Keep only the newest failure to return; release the rest
+                    if last_response is not None:
+                        last_response.close()
+                    last_response = response
+                    continue
+                if last_response is not None:
+                    last_response.close()
+                for other in futures:
+                    other.add_done_callback(_close_result)
+                if decision == 'hedge':
+                    self._decide(url, 'hedge_won')
+                if url != urls[0] and response.url == url:
+                    response.url = urls[0]
+                return response
+            if not futures and untried:
+                submit(untried[0], 'failover')
+
+        if last_response is not None:
+            return last_response
+        raise last_error
+
+    def open_stream(self, urls, opener):
+        """``(response, release)`` from the best origin that answers.
+
+        ``opener(url)`` returns ``(response, release)``.  The returned
+        ``release`` accepts the exception that ended the stream, if any,
+        and counts it against the origin.
+        """
+        ranked = self.rank(urls)
+        last_error = None
+        for n, url in enumerate(ranked):
+            self._decide(url, 'primary' if n == 0 else 'failover')
+            started = time.monotonic()
+            try:
+                response, release = opener(url)
+            except requests.exceptions.RequestException as e:
+                self.record(url, error=True)
+                last_error = e
+                continue
+            failed = response.status_code >= FAILURE_STATUS
+            self.record(url, time.monotonic() - started, error=failed)
+            if failed and n + 1 < len(ranked):
+                release()
+                continue
+            return response, self._stream_release(url, release)
+        raise last_error
+
+    async def open_stream_async(self, urls, opener, errors):
+        """``(url, response)`` from the best origin that answers, for asyncio.
+
+        ``opener(url)`` is a coroutine returning a streaming response with
+        ``aclose()``; exceptions of the ``errors`` types count against the
+        origin.  Call :meth:`record_stall` if the stream later fails.
+        """
+        ranked = self.rank(urls)
+        last_error = None
+        for n, url in enumerate(ranked):
+            self._decide(url, 'primary' if n == 0 else 'failover')
+            started = time.monotonic()
+            try:
+                response = await opener(url)
+            except errors as e:
+                self.record(url, error=True)
+                last_error = e
+                continue
+            failed = response.status_code >= FAILURE_STATUS
+            self.record(url, time.monotonic() - started, error=failed)
+            if failed and n + 1 < len(ranked):
+                await response.aclose()
+                continue
+            return url, response
+        raise last_error
+
+    def record_stall(self, url):
+        """Count a stream that stalled or dropped against its origin."""
+        self.record(url, error=True)
+        self._decide(url, 'stalled')
+
+    def _stream_release(self, url, release):
+        def release_stream(error=None):
+            if error is not None:
+                self.record_stall(url)
+            release()
+        return release_stream
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            origins = {}
+            for origin, entry in self._scores.items():
+                rate = entry.error_rate(self.error_half_life, now)
+                p95 = entry.p95()
+                origins[origin] = {
+                    'score': round(entry.score(self.error_half_life, now), 4),
+                    'latency_ms': round(entry.latency * 1000, 1) if entry.latency is not None else None,
+                    'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+                    'error_rate': round(rate, 4),
+                    'requests': entry.requests,
+                    'errors': entry.errors,
+                    'decisions': {},
+                }
+            for (origin, decision), count in self._decisions.items():
+                origins[origin]['decisions'][decision] = count
+        return {
+            'mirror_sets': len(self.mirror_sets),
+            'hedge': self.hedge,
+            'stall_timeout': self.stall_timeout,
+            'origins': origins,
+        }
+
+
+def _close_result(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_origin_router():
+    """Process-wide origin router, created on first use."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = OriginRouter.from_env()
+    return _router
@@ -0,0 +1,224 @@
+"""Ready-to-send response bodies with validators and precompressed variants.
+
+Players poll ``/playlist.m3u`` and ``/channels`` constantly, while the
+catalog behind them changes rarely.  A :class:`PrecomputedPayload` is
+built once per catalog change and holds the identity body plus gzip (and,
+when the optional ``brotli`` package is installed, brotli) variants, each
+with its own strong ETag.  :meth:`PrecomputedPayload.respond` negotiates
+``Accept-Encoding`` and answers ``If-None-Match`` / ``If-Modified-Since``
+with 304 without touching the body.
+
+Only payloads built with ``precompress=True`` (the full catalog, shared
+by every client) pay for maximum-level compression up front.  Others,
+such as one filtered ``/channels`` page, compress on first request and
+only into the encoding that request chose, at a moderate level.
+"""
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+# Bodies smaller than this are not worth a compressed variant.
+MIN_COMPRESS_SIZE = 256
+
+# (gzip level, brotli quality) for precomputed and on-demand variants
+PRECOMPRESS_LEVELS = (9, 11)
+LAZY_LEVELS = (6, 5)
+
+_ETAG_SUFFIXES = {None: '', 'gzip': '-gz', 'br': '-br'}
+
+
+def _parse_accept_encoding(value):
+    """``{coding: q}`` for an Accept-Encoding header value."""
+    codings = {}
+    for part in (value or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, params = part.partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        codings[name.strip().lower()] = q
+    return codings
+
+
+def _etag_matches(header, etag):
+    if header is None:
+        return False
+    if header.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+class PrecomputedPayload:
+    """An immutable response body with encodings and validators."""
+
+    def __init__(self, body, content_type, headers=None, last_modified=None, precompress=True):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.content_type = content_type
+        self.headers = dict(headers or {})
+        self.last_modified = last_modified if last_modified is not None else time.time()
+        self.last_modified_http = formatdate(self.last_modified, usegmt=True)
+
+        self._digest = hashlib.sha1(body).hexdigest()[:20]
+        self._lock = threading.Lock()
+        self.variants = {None: (body, self._etag(None))}
+        self.codings = ()
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.codings = ('br', 'gzip') if brotli is not None else ('gzip',)
+        if precompress:
+            for coding in self.codings:
+                self.variants[coding] = self._compress(coding, PRECOMPRESS_LEVELS)
+
+    def _compress(self, coding, levels):
+        gzip_level, brotli_quality = levels
+        if coding == 'br':
+            return brotli.compress(self.body, quality=brotli_quality), self._etag(coding)
+        return gzip.compress(self.body, compresslevel=gzip_level, mtime=0), self._etag(coding)
+
+    def _etag(self, coding):
+        return f'"{self._digest}{_ETAG_SUFFIXES[coding]}"'
+
+    def variant(self, coding):
+        """``(body, etag)`` in ``coding``, compressed now if not yet built."""
+        variant = self.variants.get(coding)
+        if variant is None:
+            with self._lock:
+                variant = self.variants.get(coding)
+                if variant is None:
+                    variant = self.variants[coding] = self._compress(coding, LAZY_LEVELS)
+        return variant
+
+    @property
+    def body(self):
+        return self.variants[None][0]
+
+    @property
+    def etag(self):
+        return self.variants[None][1]
+
+    def _choose(self, accept_encoding):
+        codings = _parse_accept_encoding(accept_encoding)
+        for coding in self.codings:
+            if codings.get(coding, codings.get('*', 0)) > 0:
+                return coding
+        return None
+
+    def respond(self, request_headers):
+        """``(status, headers, body)`` for a request with the given headers.
+
+        ``request_headers`` only needs ``.get(name)``; both Werkzeug headers
+        and plain dicts with canonical header names work.
+        """
+        coding = self._choose(request_headers.get('Accept-Encoding'))
+        etag = self._etag(coding)
+
+        headers = dict(self.headers)
+        headers['Content-Type'] = self.content_type
+        headers['ETag'] = etag
+        headers['Last-Modified'] = self.last_modified_http
+        headers['Vary'] = 'Accept-Encoding'
+        if coding is not None:
+            headers['Content-Encoding'] = coding
+
+        if self._not_modified(request_headers, etag):
+            headers.pop('Content-Type', None)
+            return 304, headers, b''
+
+        body, _ = self.variant(coding)
+        headers['Content-Length'] = str(len(body))
+        return 200, headers, body
+
+    def _not_modified(self, request_headers, etag):
+        if_none_match = request_headers.get('If-None-Match')
+        if if_none_match is not None:
+            return _etag_matches(if_none_match, etag)
+        if_modified_since = request_headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(self.last_modified) <= since
+        return False
+
+
+class PayloadCache:
+    """Small LRU of built payloads keyed by ``(name, catalog_version, ...)``.
+
+    Entries built with ``pinned=True`` (the unfiltered payloads that are
+    expensive to rebuild) live in a separate, smaller LRU, so a stream of
+    cheap filtered payloads can never evict them.  Builds are single-flight
+    per key: concurrent misses wait for the one build in progress.
+    """
+
+    def __init__(self, max_entries=64, max_pinned=8):
+        self.max_entries = max_entries
+        self.max_pinned = max_pinned
+        self._entries = OrderedDict()
+        self._pinned = OrderedDict()
+        self._building = {}  # key -> Lock held while it is built
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def _lookup_locked(self, key):
+        for entries in (self._pinned, self._entries):
+            payload = entries.get(key)
+            if payload is not None:
+                entries.move_to_end(key)
+                return payload
+        return None
+
+    def get(self, key, build, pinned=False):
+        with self._lock:
+            payload = self._lookup_locked(key)
+            if payload is not None:
+                return payload
+            building = self._building.setdefault(key, threading.Lock())
+            generation = self._generation
+        with building:
+            with self._lock:
+                payload = self._lookup_locked(key)
+            if payload is not None:
+                return payload
+            try:
+                payload = build()
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+            with self._lock:
+                self.builds += 1
+                # A payload built across an invalidation is served once, not kept
+                if generation == self._generation:
+                    entries, limit = (self._pinned, self.max_pinned) if pinned else (self._entries, self.max_entries)
+                    entries[key] = payload
+                    while len(entries) > limit:
+                        entries.popitem(last=False)
+        return payload
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+            self._generation += 1
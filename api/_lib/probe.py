@@ -0,0 +1,201 @@
+"""ffprobe-based input probing with a per-URL TTL cache.
+
+:func:`probe` runs ``ffprobe -show_format -show_streams`` once per source
+URL and caches the normalized result for ``PROBE_CACHE_TTL`` seconds;
+concurrent probes of the same URL share one ffprobe process.  A failure
+is remembered for ``PROBE_FAILURE_TTL`` seconds and raised again to
+every caller in that window, so a dead source is not probed per request.  The
+converter uses it to plan ``quality=auto`` jobs with :func:`plan_streams`:
+streams whose codec DASH (fMP4) can carry are copied, the rest are
+transcoded.
+
+Tunables (environment):
+
+``PROBE_CACHE_TTL``      seconds a probe result is reused (default 600)
+``PROBE_CACHE_ENTRIES``  probe results kept (default 512)
+``PROBE_TIMEOUT``        seconds ffprobe may take (default 20)
+``PROBE_FAILURE_TTL``    seconds a failed probe is remembered (default 30)
+"""
+import json
+import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+from api._lib.result_cache import normalize_url
+
+# Codecs the DASH muxer can put in fMP4 and browsers can play from MSE
+DASH_VIDEO_CODECS = frozenset({'h264', 'hevc', 'av1', 'vp9'})
+DASH_AUDIO_CODECS = frozenset({'aac', 'ac3', 'eac3', 'opus'})
+
+
+class ProbeError(Exception):
+    """ffprobe is missing, failed or timed out."""
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_probe(data):
+    """The fields the converter needs from ffprobe's JSON output."""
+    fmt = data.get('format') or {}
+    streams = []
+    for stream in data.get('streams') or ():
+        kind = stream.get('codec_type')
+        if kind not in ('video', 'audio'):
+            continue
+        streams.append({
+            'index': stream.get('index'),
+            'type': kind,
+            'codec': stream.get('codec_name'),
+            'profile': stream.get('profile'),
+            'width': _int(stream.get('width')),
+            'height': _int(stream.get('height')),
+            'bit_rate': _int(stream.get('bit_rate')) or _int((stream.get('tags') or {}).get('variant_bitrate')),
+            'channels': _int(stream.get('channels')),
+            'sample_rate': _int(stream.get('sample_rate')),
+        })
+    return {
+        'container': fmt.get('format_name'),
+        'duration': _float(fmt.get('duration')),
+        'bit_rate': _int(fmt.get('bit_rate')),
+        'streams': streams,
+    }
+
+
+def run_ffprobe(url, timeout=20.0):
+    try:
+        output = subprocess.run(
+            ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', url],
+            stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=timeout,
+        )
+    except FileNotFoundError:
+        raise ProbeError('ffprobe is not installed')
+    except subprocess.TimeoutExpired:
+        raise ProbeError(f'ffprobe timed out after {timeout} seconds')
+    if output.returncode != 0:
+        raise ProbeError(output.stderr.strip()[-500:] or f'ffprobe exited {output.returncode}')
+    try:
+        return normalize_probe(json.loads(output.stdout))
+    except ValueError:
+        raise ProbeError('ffprobe returned invalid JSON')
+
+
+class ProbeCache:
+    def __init__(self, ttl=600.0, max_entries=512, timeout=20.0, failure_ttl=30.0, runner=run_ffprobe):
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._runner = runner
+        self._entries = OrderedDict()  # url -> (expires_at, result or ProbeError)
+        self._inflight = {}            # url -> Event
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=float(os.environ.get('PROBE_CACHE_TTL', 600)),
+            max_entries=int(os.environ.get('PROBE_CACHE_ENTRIES', 512)),
+            timeout=float(os.environ.get('PROBE_TIMEOUT', 20)),
+            failure_ttl=float(os.environ.get('PROBE_FAILURE_TTL', 30)),
+        )
+
+    def probe(self, url):
+        """Cached probe of ``url``; raises :class:`ProbeError`."""
+        key = normalize_url(url)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    if isinstance(entry[1], ProbeError):
+                        raise entry[1]
+                    return entry[1]
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    waiter = self._inflight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Another thread is probing this URL; use its result (or retry).
+            waiter.wait(self.timeout + 1)
+
+        try:
+            try:
+                result = self._runner(url, self.timeout)
+            except ProbeError as e:
+                # Waiters pick the failure up from the cache instead of re-probing
+                self._store(key, e, self.failure_ttl)
+                raise
+            self._store(key, result, self.ttl)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            waiter.set()
+
+    def _store(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+def plan_streams(result):
+    """``{'video': 'copy'|'transcode'|None, 'audio': ...}`` for a probe result.
+
+    Only the first video and first audio stream are considered, which is
+    what the converter maps.
+    """
+    plan = {'video': None, 'audio': None}
+    for stream in result['streams']:
+        kind = stream['type']
+        if plan[kind] is not None:
+            continue
+        compatible = DASH_VIDEO_CODECS if kind == 'video' else DASH_AUDIO_CODECS
+        plan[kind] = 'copy' if stream['codec'] in compatible else 'transcode'
+    return plan
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_probe_cache():
+    """Process-wide probe cache, created on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ProbeCache.from_env()
+    return _cache
+
+
+def probe(url):
+    return get_probe_cache().probe(url)
@@ -0,0 +1,231 @@
+"""Background health prober with a cached status per channel.
+
+A scheduler thread keeps a heap of due times and hands due channels to a
+bounded thread pool, so a tick only touches the channels it starts; the
+whole catalog is walked only when ``channels()`` returns a new catalog,
+which also drops the statuses of channels that are gone.  Healthy channels are re-checked every ``interval`` seconds;
+dead ones back off exponentially up to ``max_backoff``.  Every delay is
+jittered so a large catalog does not hit the origin in lockstep.  Request
+handlers only ever read the cached :class:`ChannelStatus` records, so
+``/health`` and ``/channel/<id>/status`` answer without network I/O, and
+:meth:`HealthProber.summary` reads counters kept up to date by each check.
+
+Tunables (environment):
+
+``PROBE_INTERVAL``     seconds between checks of a healthy channel (default 60)
+``PROBE_MAX_BACKOFF``  upper bound for the dead-channel delay (default 900)
+``PROBE_JITTER``       relative jitter applied to every delay (default 0.2)
+``PROBE_WORKERS``      concurrent probes (default 16)
+``PROBE_ENABLED``      set to 0 to disable background probing
+"""
+import heapq
+import os
+import random
+import threading
+import time
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class ChannelStatus:
+    """Latest probe outcome for one channel."""
+
+    __slots__ = ('status', 'http_status', 'latency_ms', 'last_checked', 'last_seen',
+                 'failures', 'next_due', 'error', 'in_flight')
+
+    def __init__(self, next_due):
+        self.status = 'unknown'
+        self.http_status = None
+        self.latency_ms = None
+        self.last_checked = None
+        self.last_seen = None
+        self.failures = 0
+        self.next_due = next_due
+        self.error = None
+        self.in_flight = False
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'http_status': self.http_status,
+            'latency_ms': self.latency_ms,
+            'last_checked': _iso(self.last_checked),
+            'last_seen': _iso(self.last_seen),
+            'failures': self.failures,
+            'error': self.error,
+        }
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+class HealthProber:
+    """Schedule and run probes for every channel returned by ``channels()``.
+
+    ``channels`` is a callable returning an iterable of objects with ``id``;
+    it is re-read whenever it returns a different object than last time.
+    ``probe(channel)`` returns an HTTP status code or raises.
+    """
+
+    def __init__(self, channels, probe, interval=60.0, max_backoff=900.0, jitter=0.2,
+                 workers=16, tick=1.0):
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.workers = workers
+        self.tick = tick
+        self._channels = channels
+        self._probe = probe
+        self._statuses = {}
+        self._catalog = None
+        self._by_id = {}
+        self._due = []          # heap of (next_due, channel id)
+        self._counts = {'up': 0, 'down': 0, 'unknown': 0}
+        self._up_latencies = []  # sorted latency_ms of channels that are up
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.probes = 0
+
+    @classmethod
+    def from_env(cls, channels, probe):
+        return cls(
+            channels, probe,
+            interval=float(os.environ.get('PROBE_INTERVAL', 60)),
+            max_backoff=float(os.environ.get('PROBE_MAX_BACKOFF', 900)),
+            jitter=float(os.environ.get('PROBE_JITTER', 0.2)),
+            workers=int(os.environ.get('PROBE_WORKERS', 16)),
+        )
+
+    # -- scheduling ----------------------------------------------------
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='probe')
+            self._thread = threading.Thread(target=self._run, name='health-prober', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def running(self):
+        return self._thread is not None and not self._stop.is_set()
+
+    def _jittered(self, delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _sync_locked(self, catalog, now):
+        """Track a new catalog: add its channels, forget the ones it dropped."""
+        by_id = {channel.id: channel for channel in catalog}
+        for channel_id in self._statuses.keys() - by_id.keys():
+            state = self._statuses.pop(channel_id)
+            self._forget_locked(state)
+        self._due = []
+        for channel_id in by_id:
+            state = self._statuses.get(channel_id)
+            if state is None:
+                # Spread the first round over the first few seconds.
+                state = self._statuses[channel_id] = ChannelStatus(
+                    now + random.uniform(0, min(self.interval, 10.0)))
+                self._counts['unknown'] += 1
+            if not state.in_flight:
+                self._due.append((state.next_due, channel_id))
+        heapq.heapify(self._due)
+        self._by_id = by_id
+        self._catalog = catalog
+
+    def _forget_locked(self, state):
+        self._counts[state.status] -= 1
+        if state.status == 'up' and state.latency_ms is not None:
+            self._up_latencies.pop(bisect_left(self._up_latencies, state.latency_ms))
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            due = []
+            catalog = self._channels()
+            with self._lock:
+                if catalog is not self._catalog:
+                    self._sync_locked(catalog, now)
+                budget = self.workers * 2 - self._in_flight
+                while budget > 0 and self._due and self._due[0][0] <= now:
+                    next_due, channel_id = heapq.heappop(self._due)
+                    state = self._statuses.get(channel_id)
+                    # Entries of removed or rescheduled channels are stale
+                    if state is None or state.in_flight or state.next_due != next_due:
+                        continue
+                    state.in_flight = True
+                    self._in_flight += 1
+                    due.append((self._by_id[channel_id], state))
+                    budget -= 1
+            for channel, state in due:
+                self._executor.submit(self._check, channel, state)
+            self._stop.wait(self.tick)
+
+    def _check(self, channel, state):
+        started = time.monotonic()
+        try:
+            http_status = self._probe(channel)
+            error = None
+        except Exception as e:
+            http_status, error = None, str(e)
+        latency = round((time.monotonic() - started) * 1000, 1)
+        now = time.time()
+
+        with self._lock:
+            self.probes += 1
+            self._in_flight -= 1
+            state.in_flight = False
+            current = self._statuses.get(channel.id) is state
+            if current:
+                self._forget_locked(state)
+            state.last_checked = now
+            state.http_status = http_status
+            state.latency_ms = latency
+            state.error = error
+            if http_status is not None and http_status < 400:
+                state.status = 'up'
+                state.last_seen = now
+                state.failures = 0
+                delay = self.interval
+            else:
+                state.status = 'down'
+                state.failures += 1
+                delay = min(self.max_backoff, self.interval * (2 ** (state.failures - 1)))
+            state.next_due = time.monotonic() + self._jittered(delay)
+            # A channel removed while it was being probed is not rescheduled
+            if current:
+                self._counts[state.status] += 1
+                if state.status == 'up':
+                    insort(self._up_latencies, latency)
+                heapq.heappush(self._due, (state.next_due, channel.id))
+
+    # -- readers -------------------------------------------------------
+
+    def status(self, channel_id):
+        with self._lock:
+            state = self._statuses.get(channel_id)
+            return state.to_dict() if state is not None else None
+
+    def summary(self):
+        with self._lock:
+            counts = dict(self._counts)
+            latencies = self._up_latencies
+            median = latencies[len(latencies) // 2] if latencies else None
+            probes = self.probes
+        return {
+            'running': self.running,
+            'probes': probes,
+            'channels': counts,
+            'median_latency_ms': median,
+        }
@@ -0,0 +1,156 @@
+"""Content-addressed cache of conversion results with single-flight joins.
+
+A conversion is identified by a SHA-256 of its normalized parameters
+(:func:`cache_key`), so ``HTTP://Example.com:80/a.m3u8#x`` and
+``http://example.com/a.m3u8`` with the same quality and segment duration
+share one entry.  A finished result is served from the cache until it
+expires; a submission whose key is already converting joins the running
+job instead of starting another ffmpeg.
+
+Entries are evicted by TTL and by a total byte budget (the size of the
+produced files), least recently used first.  ``on_evict`` lets the owner
+release the evicted artifact.
+
+Tunables (environment):
+
+``CONVERT_CACHE_TTL``      seconds a result is reused (default 3600)
+``CONVERT_CACHE_BYTES``    byte budget over all cached outputs (default 2 GiB)
+``CONVERT_CACHE_ENTRIES``  maximum number of cached results (default 256)
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+HIT = 'hit'
+JOIN = 'join'
+MISS = 'miss'
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """Lower-case scheme and host, drop default ports and fragments."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    port = parts.port
+    netloc = host if port is None or port == _DEFAULT_PORTS.get(scheme) else f'{host}:{port}'
+    if parts.username:
+        auth = parts.username + (f':{parts.password}' if parts.password else '')
+        netloc = f'{auth}@{netloc}'
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def cache_key(params):
+    """SHA-256 over the normalized conversion parameters."""
+    normalized = {}
+    for key, value in params.items():
+        if key == 'url':
+            value = normalize_url(value)
+        elif key == 'segment_duration':
+            value = f'{float(value):g}'
+        elif isinstance(value, str):
+            value = value.strip().lower()
+        normalized[key] = value
+    blob = json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, ttl=3600.0, max_bytes=2 << 30, max_entries=256, on_evict=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.joins = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, result)
+        self._inflight = {}            # key -> job
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, on_evict=None):
+        return cls(
+            ttl=float(os.environ.get('CONVERT_CACHE_TTL', 3600)),
+            max_bytes=int(os.environ.get('CONVERT_CACHE_BYTES', 2 << 30)),
+            max_entries=int(os.environ.get('CONVERT_CACHE_ENTRIES', 256)),
+            on_evict=on_evict,
+        )
+
+    def lookup_or_submit(self, key, submit, valid=None):
+        """Return ``(outcome, value)`` for ``key``.
+
+        ``HIT`` carries the cached result, ``JOIN`` the in-flight job and
+        ``MISS`` the job returned by ``submit()``.  ``valid(result)`` may
+        reject a cached result whose artifact has disappeared.
+        """
+        evicted = []
+        try:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    expires_at, _, result = entry
+                    if expires_at > time.monotonic() and (valid is None or valid(result)):
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return HIT, result
+                    evicted.append(self._pop_locked(key))
+
+                job = self._inflight.get(key)
+                if job is not None:
+                    self.joins += 1
+                    return JOIN, job
+
+                # Submitting under the lock keeps two identical requests
+                # from both missing; submit() only enqueues, it never blocks.
+                job = submit()
+                self.misses += 1
+                self._inflight[key] = job
+            job.add_done_callback(lambda finished: self._complete(key, finished))
+            return MISS, job
+        finally:
+            self._release(evicted)
+
+    def _complete(self, key, job):
+        evicted = []
+        with self._lock:
+            self._inflight.pop(key, None)
+            if job.state != 'done' or not job.result:
+                return
+            size = int(job.result.get('size_bytes', 0))
+            self._entries[key] = (time.monotonic() + self.ttl, size, job.result)
+            self.size += size
+            while self._entries and (self.size > self.max_bytes or len(self._entries) > self.max_entries):
+                evicted.append(self._pop_locked(next(iter(self._entries))))
+        self._release(evicted)
+
+    def _pop_locked(self, key):
+        _, size, result = self._entries.pop(key)
+        self.size -= size
+        return result
+
+    def _release(self, evicted):
+        if self.on_evict is not None:
+            for result in evicted:
+                self.on_evict(result)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.joins
+            return {
+                'entries': len(self._entries),
+                'in_flight': len(self._inflight),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'joins': self.joins,
+                'hit_ratio': round((self.hits + self.joins) / lookups, 4) if lookups else None,
+            }
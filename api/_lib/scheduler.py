@@ -0,0 +1,154 @@
+"""Core-aware admission for ffmpeg conversions.
+
+Left alone, every libx264 encode starts one thread per core, so a few
+concurrent transcodes oversubscribe the host and slow each other down,
+while cheap stream-copy remuxes queue behind them.  The scheduler
+splits conversions into two lanes, served by separate job-queue workers:
+
+``remux``      ``quality=copy``: demux/mux only, one thread, not counted
+               against the core budget; ``quality=auto`` jobs also start
+               here while they probe their input
+``transcode``  everything that runs an encoder
+
+A transcode gets a thread budget from its preset (more pixels, more
+threads; an ABR ladder sums its rungs) capped at the core count, and
+waits until that many cores are free before its ffmpeg starts.  Waiters
+are admitted first come, first served, so a large job cannot be starved
+by a stream of small ones.  ``-threads`` pins ffmpeg's decoder, filter
+and encoder threads to the budget, and each lane runs at its own
+niceness so that remuxes (and the proxy sharing the host) stay
+responsive under encode load.
+
+Tunables (environment):
+
+``CONVERT_CORES``           cores shared by transcodes (default: the
+                            CPUs this process may run on)
+``CONVERT_REMUX_WORKERS``   concurrent remux jobs (default 4)
+``CONVERT_TRANSCODE_NICE``  niceness of transcoding ffmpeg (default 10)
+``CONVERT_REMUX_NICE``      niceness of remuxing ffmpeg (default 0)
+"""
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+REMUX = 'remux'
+TRANSCODE = 'transcode'
+
+# Encoder threads worth giving one rendition of each preset
+PRESET_THREADS = {
+    '1080p': 4,
+    '720p': 2,
+    '480p': 1,
+    '360p': 1,
+}
+
+
+def available_cores():
+    """CPUs this process may run on (respects affinity / cpusets)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def limit_threads(cmd, threads):
+    """``cmd`` with decoder, filter and encoder threads capped at ``threads``.
+
+    ``cmd`` is an ``['ffmpeg', ..., output]`` list with a single output.
+    """
+    count = str(threads)
+    return (cmd[:1] + ['-filter_complex_threads', count, '-threads', count] + cmd[1:-1]
+            + ['-threads', count] + cmd[-1:])
+
+
+class CoreScheduler:
+    def __init__(self, cores=None, remux_workers=4, transcode_nice=10, remux_nice=0):
+        self.cores = cores or available_cores()
+        self.remux_workers = remux_workers
+        self.nice = {TRANSCODE: transcode_nice, REMUX: remux_nice}
+        self.reserved = 0
+        self.admitted = 0
+        self._waiting = deque()
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            cores=int(os.environ.get('CONVERT_CORES', 0)) or None,
+            remux_workers=int(os.environ.get('CONVERT_REMUX_WORKERS', 4)),
+            transcode_nice=int(os.environ.get('CONVERT_TRANSCODE_NICE', 10)),
+            remux_nice=int(os.environ.get('CONVERT_REMUX_NICE', 0)),
+        )
+
+    def lane_for(self, params):
+        quality = params['quality']
+        # An unplanned auto job only probes until it knows its lane
+        if quality == 'copy' or (quality == 'auto' and 'plan' not in params):
+            return REMUX
+        return TRANSCODE
+
+    def thread_budget(self, params):
+        """Threads (and cores reserved) for a conversion's ffmpeg."""
+        quality = params['quality']
+        if quality == 'copy':
+            return 1
+        if quality == 'abr':
+            rungs = params['ladder'][1:] if params.get('copy_top') else params['ladder']
+            threads = sum(PRESET_THREADS.get(name, 1) for name in rungs)
+        elif quality == 'auto':
+            plan = params.get('plan', {})
+            threads = PRESET_THREADS.get(params.get('target'), 1) if plan.get('video') == 'transcode' else 1
+        else:
+            threads = PRESET_THREADS.get(quality, 1)
+        return max(1, min(self.cores, threads))
+
+    @contextmanager
+    def reserve(self, threads, lane=TRANSCODE):
+        """Block until ``threads`` cores are free and hold them for the block.
+
+        Remux work is not budgeted and is admitted immediately.
+        """
+        if lane != TRANSCODE:
+            yield
+            return
+        threads = min(threads, self.cores)
+        ticket = object()
+        with self._cond:
+            self._waiting.append(ticket)
+            self._cond.wait_for(lambda: self._waiting[0] is ticket and self.reserved + threads <= self.cores)
+            self._waiting.popleft()
+            self.reserved += threads
+            self.admitted += 1
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.reserved -= threads
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'cores': self.cores,
+                'reserved': self.reserved,
+                'waiting': len(self._waiting),
+                'admitted': self.admitted,
+                'remux_workers': self.remux_workers,
+                'nice': dict(self.nice),
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Process-wide conversion scheduler, created on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = CoreScheduler.from_env()
+    return _scheduler
@@ -0,0 +1,348 @@
+"""Where finished conversion outputs are published.
+
+The converter always writes into the local artifact store (see
+:mod:`api._lib.artifacts`); a storage backend decides what the client's
+``download_url`` points at.
+
+``local``  (default) the download function serves the artifact from disk:
+           ``/api/download/<id>/<name>.mpd``
+``s3``     every file is copied to an S3-compatible bucket while ffmpeg is
+           still running.  The DASH muxer writes each segment as ``*.tmp``
+           and renames it once complete, so :meth:`S3Upload.sync` (called on
+           every progress tick) uploads each newly finished segment on a
+           shared thread pool; large files go up as parallel multipart
+           uploads.  The MPD is uploaded last, after every segment it lists
+           is in the bucket, so a client never sees a manifest pointing at a
+           missing object.
+
+With ``S3_PUBLIC_BASE_URL`` (a CDN or public-read bucket) the returned
+URLs are plain.  Otherwise the MPD URL is presigned and its segment
+templates are expanded into ``SegmentList``s of presigned segment URLs,
+since a relative segment URL cannot carry its own signature; the result
+then carries ``expires_at``.
+
+boto3 is only imported when the ``s3`` backend is first used
+(``pip install -r requirements-s3.txt``).  Any S3-compatible endpoint
+works, including a local stand-in such as MinIO or ``moto_server``.
+
+Tunables (environment):
+
+``STORAGE_BACKEND``        ``local`` or ``s3`` (default ``local``)
+``S3_BUCKET``              bucket name (required for ``s3``)
+``S3_PREFIX``              key prefix (default ``conversions/``)
+``S3_ENDPOINT_URL``        non-AWS endpoint, e.g. ``http://127.0.0.1:9000``
+``S3_REGION``              region (default: boto3's configuration)
+``S3_PUBLIC_BASE_URL``     public URL of the prefix root; disables presigning
+``S3_PRESIGN_TTL``         presigned URL lifetime in seconds (default 3600)
+``S3_PART_SIZE``           multipart threshold and part size (default 8 MiB)
+``S3_UPLOAD_CONCURRENCY``  files uploaded at once (default 8)
+``S3_PART_CONCURRENCY``    parts of one file uploaded at once (default 4)
+"""
+import copy
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from api._lib.artifacts import content_type
+from api._lib.hls_mpd import MPD_NAMESPACE
+
+_NS = {'mpd': MPD_NAMESPACE}
+_TEMPLATE_VAR = re.compile(r'\$(RepresentationID|Number|Bandwidth|Time)(?:%0(\d+)d)?\$')
+
+# Results are reported as expiring this long before their presigned URLs,
+# so a cached result is never handed out with links about to lapse
+_EXPIRY_MARGIN = 60
+
+
+class StorageError(RuntimeError):
+    """An upload to the storage backend failed."""
+
+
+class LocalUpload:
+    """Nothing to copy: the download function serves the artifact store."""
+
+    def __init__(self, artifact_id):
+        self.artifact_id = artifact_id
+
+    def sync(self, directory):
+        pass
+
+    def finish(self, directory, mpd_name):
+        return {'storage': 'local', 'download_url': f'/api/download/{self.artifact_id}/{mpd_name}'}
+
+    def abort(self):
+        pass
+
+
+class LocalStorage:
+    name = 'local'
+
+    def begin(self, artifact_id):
+        return LocalUpload(artifact_id)
+
+    def stats(self):
+        return {'backend': self.name}
+
+
+def _complete(name):
+    # The muxer renames ``*.tmp`` once a file is whole; the MPD goes up last
+    return not name.endswith(('.tmp', '.mpd'))
+
+
+def _substitute(template, rep_id, bandwidth, number=None, time_=None):
+    values = {'RepresentationID': rep_id, 'Bandwidth': bandwidth, 'Number': number, 'Time': time_}
+
+    def replace(match):
+        value = values[match.group(1)]
+        return f'{int(value):0{match.group(2)}d}' if match.group(2) else str(value)
+    return _TEMPLATE_VAR.sub(replace, template)
+
+
+def _segment_times(timeline):
+    """Start time of every segment a ``SegmentTimeline`` lists."""
+    times, t = [], 0
+    for s in timeline.findall('mpd:S', _NS):
+        t = int(s.get('t', t))
+        for _ in range(int(s.get('r', 0)) + 1):
+            times.append(t)
+            t += int(s.get('d'))
+    return times
+
+
+def _expand_template(template, rep_id, bandwidth, url_for):
+    """``SegmentList`` equivalent of a timeline ``SegmentTemplate``, or None."""
+    timeline = template.find('mpd:SegmentTimeline', _NS)
+    if timeline is None:
+        return None
+    number = int(template.get('startNumber', 1))
+    segment_list = ET.Element(f'{{{MPD_NAMESPACE}}}SegmentList')
+    for attr in ('timescale', 'presentationTimeOffset'):
+        if template.get(attr) is not None:
+            segment_list.set(attr, template.get(attr))
+    if template.get('initialization'):
+        ET.SubElement(segment_list, f'{{{MPD_NAMESPACE}}}Initialization',
+                      sourceURL=url_for(_substitute(template.get('initialization'), rep_id, bandwidth)))
+    segment_list.append(timeline)
+    for n, t in enumerate(_segment_times(timeline), start=number):
+        ET.SubElement(segment_list, f'{{{MPD_NAMESPACE}}}SegmentURL',
+                      media=url_for(_substitute(template.get('media'), rep_id, bandwidth, n, t)))
+    return segment_list
+
+
+def presign_mpd(text, url_for):
+    """MPD text with every relative segment reference replaced by ``url_for(name)``.
+
+    ``SegmentTemplate``s (the DASH muxer's output) become explicit
+    ``SegmentList``s; ``SegmentList`` entries are rewritten in place.
+    Absolute URLs are left alone.
+    """
+    for prefix, uri in (('', MPD_NAMESPACE), ('xsi', 'http://www.w3.org/2001/XMLSchema-instance'),
+                        ('xlink', 'http://www.w3.org/1999/xlink')):
+        ET.register_namespace(prefix, uri)
+    root = ET.fromstring(text)
+
+    def relative(url):
+        return url and '://' not in url and not url.startswith('/')
+
+    for adaptation_set in root.iter(f'{{{MPD_NAMESPACE}}}AdaptationSet'):
+        shared = adaptation_set.find('mpd:SegmentTemplate', _NS)
+        keep_shared = shared is None or not relative(shared.get('media'))
+        for rep in adaptation_set.findall('mpd:Representation', _NS):
+            own = rep.find('mpd:SegmentTemplate', _NS)
+            template = own if own is not None else shared
+            if template is None or not relative(template.get('media')):
+                continue
+            # Each representation gets its own copy of the timeline
+            segment_list = _expand_template(copy.deepcopy(template), rep.get('id'), rep.get('bandwidth'), url_for)
+            if segment_list is None:
+                keep_shared = keep_shared or own is None
+            elif own is not None:
+                rep.insert(list(rep).index(own), segment_list)
+                rep.remove(own)
+            else:
+                rep.append(segment_list)
+        if not keep_shared:
+            adaptation_set.remove(shared)
+
+    for element in root.iter():
+        for attr in ('sourceURL', 'media'):
+            tag = element.tag.rsplit('}', 1)[-1]
+            if tag in ('Initialization', 'SegmentURL') and relative(element.get(attr)):
+                element.set(attr, url_for(element.get(attr)))
+
+    ET.indent(root)
+    return '<?xml version="1.0" encoding="utf-8"?>\n' + ET.tostring(root, encoding='unicode') + '\n'
+
+
+class S3Upload:
+    """One conversion's files on their way to the bucket."""
+
+    def __init__(self, storage, artifact_id):
+        self.storage = storage
+        self.artifact_id = artifact_id
+        self.prefix = f'{storage.prefix}{artifact_id}/'
+        self._futures = {}
+        self._uploaded = []
+        self._lock = threading.Lock()
+
+    def key(self, filename):
+        return self.prefix + filename
+
+    def _put(self, path, filename):
+        self.storage.put_file(path, self.key(filename))
+        with self._lock:
+            self._uploaded.append(filename)
+
+    def sync(self, directory):
+        """Queue uploads for segments finished since the last call."""
+        try:
+            names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name in self._futures or not _complete(name):
+                continue
+            self._futures[name] = self.storage.pool.submit(self._put, os.path.join(directory, name), name)
+
+    def finish(self, directory, mpd_name):
+        """Upload what is left, then the MPD; returns the result fields."""
+        self.sync(directory)
+        wait(self._futures.values())
+        for name, future in self._futures.items():
+            # A segment the muxer deleted again (outside its window) is
+            # not listed in the final MPD either
+            if future.exception() is not None and os.path.exists(os.path.join(directory, name)):
+                raise StorageError(f'upload of {name} failed: {future.exception()}')
+
+        with open(os.path.join(directory, mpd_name), 'r', encoding='utf-8') as f:
+            mpd_content = f.read()
+        expires_at = None
+        if self.storage.public_base_url is None:
+            expires_at = time.time() + self.storage.presign_ttl - _EXPIRY_MARGIN
+            mpd_content = presign_mpd(mpd_content, lambda name: self.storage.url(self.key(name)))
+        self.storage.put_bytes(mpd_content.encode('utf-8'), self.key(mpd_name))
+        with self._lock:
+            self._uploaded.append(mpd_name)
+        return {
+            'storage': 's3',
+            'download_url': self.storage.url(self.key(mpd_name)),
+            'expires_at': round(expires_at) if expires_at is not None else None,
+            'objects': len(self._uploaded),
+        }
+
+    def abort(self):
+        """Stop queued uploads and delete whatever already reached the bucket."""
+        for future in self._futures.values():
+            future.cancel()
+        wait(self._futures.values())
+        with self._lock:
+            keys, self._uploaded = [self.key(name) for name in self._uploaded], []
+        self.storage.delete(keys)
+
+
+class S3Storage:
+    name = 's3'
+
+    def __init__(self, bucket, prefix='conversions/', endpoint_url=None, region=None, public_base_url=None,
+                 presign_ttl=3600, part_size=8 * 1024 * 1024, concurrency=8, part_concurrency=4):
+        if not bucket:
+            raise ValueError('S3_BUCKET is required for STORAGE_BACKEND=s3')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.public_base_url = public_base_url.rstrip('/') if public_base_url else None
+        self.presign_ttl = presign_ttl
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.part_concurrency = part_concurrency
+        self.pool = ThreadPoolExecutor(concurrency, thread_name_prefix='s3-upload')
+        self._client = None
+        self._transfer_config = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            bucket=os.environ.get('S3_BUCKET'),
+            prefix=os.environ.get('S3_PREFIX', 'conversions/'),
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None,
+            region=os.environ.get('S3_REGION') or None,
+            public_base_url=os.environ.get('S3_PUBLIC_BASE_URL') or None,
+            presign_ttl=int(os.environ.get('S3_PRESIGN_TTL', 3600)),
+            part_size=int(os.environ.get('S3_PART_SIZE', 8 * 1024 * 1024)),
+            concurrency=int(os.environ.get('S3_UPLOAD_CONCURRENCY', 8)),
+            part_concurrency=int(os.environ.get('S3_PART_CONCURRENCY', 4)),
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    try:
+                        import boto3
+                        from boto3.s3.transfer import TransferConfig
+                        from botocore.config import Config
+                    except ImportError:
+                        raise RuntimeError('STORAGE_BACKEND=s3 needs boto3 (pip install -r requirements-s3.txt)')
+                    self._transfer_config = TransferConfig(
+                        multipart_threshold=self.part_size, multipart_chunksize=self.part_size,
+                        max_concurrency=self.part_concurrency, use_threads=True)
+                    # Enough pooled connections for every file and part in flight
+                    config = Config(max_pool_connections=self.concurrency * self.part_concurrency,
+                                    retries={'max_attempts': 5, 'mode': 'standard'})
+                    self._client = boto3.session.Session().client(
+                        's3', endpoint_url=self.endpoint_url, region_name=self.region, config=config)
+        return self._client
+
+    def begin(self, artifact_id):
+        return S3Upload(self, artifact_id)
+
+    def put_file(self, path, key):
+        self.client.upload_file(path, self.bucket, key, Config=self._transfer_config,
+                           ExtraArgs={'ContentType': content_type(key)})
+
+    def put_bytes(self, body, key):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body, ContentType=content_type(key),
+                               CacheControl='no-cache')
+
+    def url(self, key):
+        if self.public_base_url is not None:
+            return f'{self.public_base_url}/{key[len(self.prefix):]}'
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=self.presign_ttl)
+
+    def delete(self, keys):
+        for start in range(0, len(keys), 1000):
+            batch = keys[start:start + 1000]
+            self.client.delete_objects(Bucket=self.bucket,
+                                       Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+
+    def stats(self):
+        return {'backend': self.name, 'bucket': self.bucket, 'prefix': self.prefix,
+                'presigned': self.public_base_url is None, 'concurrency': self.concurrency,
+                'part_size': self.part_size}
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Process-wide storage backend chosen by ``STORAGE_BACKEND``."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                backend = os.environ.get('STORAGE_BACKEND', 'local')
+                if backend == 's3':
+                    _storage = S3Storage.from_env()
+                elif backend == 'local':
+                    _storage = LocalStorage()
+                else:
+                    raise ValueError(f'unknown STORAGE_BACKEND {backend!r}')
+    return _storage
@@ -0,0 +1,163 @@
+"""Shared keep-alive connection pool for every outbound HTTP fetch.
+
+All requests to the IPTV origin go through one ``requests.Session`` so
+that TCP (and DNS) work is paid once per connection instead of once per
+viewer.  Limits and timeouts come from the environment:
+
+``UPSTREAM_POOL_HOSTS``       number of per-host pools kept alive (default 16)
+``UPSTREAM_POOL_MAXSIZE``     max connections per host (default 64)
+``UPSTREAM_POOL_BLOCK``       wait for a free connection instead of opening
+                              extra throw-away ones (default 1)
+``UPSTREAM_CONNECT_TIMEOUT``  seconds to establish a connection (default 3.05)
+``UPSTREAM_READ_TIMEOUT``     seconds between bytes once connected (default 10)
+``UPSTREAM_RETRIES``          retries on connection errors (default 1)
+"""
+import os
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return float(default)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return int(default)
+
+
+class UpstreamPool:
+    """A pooled ``requests.Session`` with per-host limits and statistics."""
+
+    def __init__(self, pool_hosts=16, pool_maxsize=64, pool_block=True,
+                 connect_timeout=3.05, read_timeout=10.0, retries=1,
+                 user_agent=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_hosts = pool_hosts
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_hosts,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=Retry(total=retries, connect=retries, read=0,
+                              redirect=5, status=0, raise_on_status=False),
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        if user_agent:
+            self.session.headers['User-Agent'] = user_agent
+
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)
+        self._errors = defaultdict(int)
+        self._timeouts = defaultdict(int)
+        self._active = defaultdict(int)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            pool_hosts=_env_int('UPSTREAM_POOL_HOSTS', 16),
+            pool_maxsize=_env_int('UPSTREAM_POOL_MAXSIZE', 64),
+            pool_block=os.environ.get('UPSTREAM_POOL_BLOCK', '1') != '0',
+            connect_timeout=_env_float('UPSTREAM_CONNECT_TIMEOUT', 3.05),
+            read_timeout=_env_float('UPSTREAM_READ_TIMEOUT', 10),
+            retries=_env_int('UPSTREAM_RETRIES', 1),
+            user_agent=os.environ.get('UPSTREAM_USER_AGENT'),
+        )
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the pool, counting outcomes per host."""
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlsplit(url).netloc
+        with self._lock:
+            self._requests[host] += 1
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.exceptions.Timeout:
+            with self._lock:
+                self._timeouts[host] += 1
+            raise
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._errors[host] += 1
+            raise
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('HEAD', url, **kwargs)
+
+    def stream(self, url, **kwargs):
+        """Open a streaming GET; call :meth:`release` when done with it."""
+        response = self.get(url, stream=True, **kwargs)
+        with self._lock:
+            self._active[urlsplit(url).netloc] += 1
+        return response
+
+    def release(self, url, response):
+        """Return a streamed response's connection to the pool."""
+        response.close()
+        host = urlsplit(url).netloc
+        with self._lock:
+            self._active[host] = max(0, self._active[host] - 1)
+
+    def stats(self):
+        """Snapshot of pool configuration, per-host counters and connections."""
+        hosts = {}
+        with self._lock:
+            for host in set(self._requests) | set(self._active):
+                hosts[host] = {
+                    'requests': self._requests[host],
+                    'errors': self._errors[host],
+                    'timeouts': self._timeouts[host],
+                    'active_streams': self._active[host],
+                }
+
+        manager = self._adapter.poolmanager
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            host = pool.host if pool.port in (None, 80, 443) else f'{pool.host}:{pool.port}'
+            entry = hosts.setdefault(host, {})
+            entry['connections_opened'] = entry.get('connections_opened', 0) + pool.num_connections
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+            entry['idle_connections'] = entry.get('idle_connections', 0) + idle
+
+        return {
+            'pool_hosts': self.pool_hosts,
+            'pool_maxsize': self.pool_maxsize,
+            'pool_block': self.pool_block,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'hosts': hosts,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Process-wide pool, created on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = UpstreamPool.from_env()
+    return _pool
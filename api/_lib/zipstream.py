@@ -0,0 +1,227 @@
+"""ZIP archives of an artifact, generated on the fly.
+
+Entries are *stored* (segments are already compressed media), so every
+header, every file's offset and the total size follow from the file names
+and sizes alone: ``Content-Length``, ``ETag`` and any byte range are known
+before a single byte is read, and nothing is written to disk.
+
+The one value that needs the data is each file's CRC-32.  Local headers
+set bit 3 and leave it zero; the CRC goes into the data descriptor after
+the file and into the central directory, both of which are fixed-size.
+While a response streams a file from its first byte the CRC is computed
+from the bytes being sent.  A range request that starts past a file but
+covers its descriptor or the central directory hashes the file on its
+own, and every CRC is cached, keyed by path, size and mtime, since
+artifact files never change once registered.
+
+Archives of 4 GiB or more would need Zip64 and are refused with
+:class:`ZipTooLarge`.
+
+Tunables (environment):
+
+``ZIP_RESPONSE_MAX_BYTES``  largest slice the serverless download function
+                            returns in one response (default 3 MiB);
+                            clients fetch bigger archives by Range
+"""
+import hashlib
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from email.utils import formatdate
+
+CHUNK_SIZE = 256 << 10
+
+# The serverless function builds each response body in memory and
+# base64-encodes it, so it only ever answers slices up to this size
+RESPONSE_MAX_BYTES = int(os.environ.get('ZIP_RESPONSE_MAX_BYTES', 3 << 20))
+
+_ZIP32_LIMIT = 0xFFFFFFFF
+_FLAGS = 0x0008 | 0x0800  # data descriptor follows, UTF-8 names
+_VERSION = 20
+_LOCAL = struct.Struct('<IHHHHHIIIHH')
+_DESCRIPTOR = struct.Struct('<IIII')
+_CENTRAL = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END = struct.Struct('<IHHHHIIH')
+
+_crc_cache = OrderedDict()
+_crc_lock = threading.Lock()
+_CRC_CACHE_ENTRIES = 4096
+
+
+class ZipTooLarge(ValueError):
+    """The archive would need Zip64."""
+
+
+def _dos_time(mtime):
+    t = time.localtime(max(mtime, 315532800))  # DOS dates start in 1980
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def _cached_crc(key):
+    with _crc_lock:
+        crc = _crc_cache.get(key)
+        if crc is not None:
+            _crc_cache.move_to_end(key)
+        return crc
+
+
+def _store_crc(key, crc):
+    with _crc_lock:
+        _crc_cache[key] = crc
+        _crc_cache.move_to_end(key)
+        while len(_crc_cache) > _CRC_CACHE_ENTRIES:
+            _crc_cache.popitem(last=False)
+
+
+class _Entry:
+    __slots__ = ('name', 'path', 'size', 'mtime_ns', 'dos_time', 'dos_date', 'offset', 'data_offset')
+
+    def __init__(self, name, path, stat):
+        self.name = name.encode('utf-8')
+        self.path = path
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.dos_time, self.dos_date = _dos_time(stat.st_mtime)
+
+    @property
+    def key(self):
+        return (self.path, self.size, self.mtime_ns)
+
+    def local_header(self):
+        return _LOCAL.pack(0x04034b50, _VERSION, _FLAGS, 0, self.dos_time, self.dos_date, 0,
+                           self.size, self.size, len(self.name), 0) + self.name
+
+    def descriptor(self, crc):
+        return _DESCRIPTOR.pack(0x08074b50, crc, self.size, self.size)
+
+    def central_header(self, crc):
+        return _CENTRAL.pack(0x02014b50, _VERSION, _VERSION, _FLAGS, 0, self.dos_time, self.dos_date, crc,
+                             self.size, self.size, len(self.name), 0, 0, 0, 0, 0o100644 << 16,
+                             self.offset) + self.name
+
+
+class ZipStream:
+    """A stored ZIP of ``files`` (``(archive name, path)`` pairs), in order."""
+
+    def __init__(self, files, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.entries = []
+        offset = 0
+        for name, path in files:
+            entry = _Entry(name, path, os.stat(path))
+            entry.offset = offset
+            entry.data_offset = offset + _LOCAL.size + len(entry.name)
+            offset = entry.data_offset + entry.size + _DESCRIPTOR.size
+            self.entries.append(entry)
+        self.central_offset = offset
+        self.central_size = sum(_CENTRAL.size + len(entry.name) for entry in self.entries)
+        self.size = offset + self.central_size + _END.size
+        if self.size > _ZIP32_LIMIT or len(self.entries) > 0xFFFF:
+            raise ZipTooLarge(f'{self.size} bytes in {len(self.entries)} files needs Zip64')
+
+        self.mtime = max((entry.mtime_ns for entry in self.entries), default=0) / 1e9
+        digest = hashlib.sha1()
+        for entry in self.entries:
+            digest.update(b'%s\0%d\0%d\n' % (entry.name, entry.size, entry.mtime_ns))
+        self.etag = f'"zip-{digest.hexdigest()[:20]}"'
+
+    def headers(self, filename):
+        """Response headers shared by every answer for this archive."""
+        return {
+            'Content-Type': 'application/zip',
+            'Accept-Ranges': 'bytes',
+            'ETag': self.etag,
+            'Last-Modified': formatdate(self.mtime, usegmt=True),
+            'Cache-Control': 'no-cache',
+            'Content-Disposition': f'attachment; filename="{filename}"',
+        }
+
+    def crc(self, entry):
+        crc = _cached_crc(entry.key)
+        if crc is None:
+            crc = 0
+            with open(entry.path, 'rb') as f:
+                while True:
+                    block = f.read(self.chunk_size)
+                    if not block:
+                        break
+                    crc = zlib.crc32(block, crc)
+            _store_crc(entry.key, crc)
+        return crc
+
+    def _parts(self):
+        """``(offset, length, producer)`` for every region of the archive in order.
+
+        ``producer(skip, length)`` yields that many bytes of the region,
+        starting ``skip`` bytes in.
+        """
+        for entry in self.entries:
+            header = entry.local_header()
+            yield entry.offset, len(header), self._static(header)
+            yield entry.data_offset, entry.size, self._file(entry)
+            yield entry.data_offset + entry.size, _DESCRIPTOR.size, self._lazy(lambda e=entry: e.descriptor(self.crc(e)))
+        yield self.central_offset, self.central_size + _END.size, self._lazy(self._central_directory)
+
+    @staticmethod
+    def _static(data):
+        def produce(skip, length):
+            yield data[skip:skip + length]
+        return produce
+
+    @staticmethod
+    def _lazy(build):
+        def produce(skip, length):
+            yield build()[skip:skip + length]
+        return produce
+
+    def _file(self, entry):
+        def produce(skip, length):
+            # Hash the data on the way through when it is sent whole
+            whole = skip == 0 and length == entry.size and _cached_crc(entry.key) is None
+            crc = 0
+            with open(entry.path, 'rb') as f:
+                f.seek(skip)
+                remaining = length
+                while remaining:
+                    block = f.read(min(self.chunk_size, remaining))
+                    if not block:
+                        raise OSError(f'{entry.path} shrank while being archived')
+                    remaining -= len(block)
+                    if whole:
+                        crc = zlib.crc32(block, crc)
+                    yield block
+            if whole:
+                _store_crc(entry.key, crc)
+        return produce
+
+    def _central_directory(self):
+        parts = [entry.central_header(self.crc(entry)) for entry in self.entries]
+        parts.append(_END.pack(0x06054b50, 0, 0, len(self.entries), len(self.entries),
+                               self.central_size, self.central_offset, 0))
+        return b''.join(parts)
+
+    def iter_bytes(self, start=0, end=None):
+        """Yield bytes ``start`` to ``end`` (inclusive) of the archive."""
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        for offset, length, produce in self._parts():
+            if offset + length <= start or length == 0:
+                continue
+            if offset > end:
+                break
+            skip = max(start - offset, 0)
+            yield from produce(skip, min(length, end + 1 - offset) - skip)
+
+
+def _entry_order(name, mpd_name):
+    if name == mpd_name:
+        return (0, name)
+    return (1 if name.startswith('init') else 2, name)
+
+
+def for_artifact(artifact):
+    """ZIP of an artifact: its MPD, then init segments, then media segments."""
+    names = sorted(artifact.files(), key=lambda name: _entry_order(name, artifact.mpd_name))
+    return ZipStream([(name, os.path.join(artifact.directory, name)) for name in names])
@@ -1,17 +1,92 @@
 import os
 import json
+import glob
+import shutil
 import tempfile
-import subprocess
+import time
 from datetime import datetime
-from urllib.parse import urlparse, unquote
-import uuid
+from urllib.parse import urlparse, parse_qs
+
+from api._lib import artifacts, metrics, storage, zipstream
+from api._lib.chunked import NotChunkable, transcode_chunked
+from api._lib.ffmpeg import run_ffmpeg
+from api._lib.hls_mpd import NotTranslatable, translate
+from api._lib.jobs import ChangeLane, QueueFull, get_job_queue
+from api._lib.probe import ProbeError, get_probe_cache, plan_streams
+from api._lib.result_cache import HIT, MISS, ResultCache, cache_key
+from api._lib.scheduler import get_scheduler, limit_threads
+
+# Kill ffmpeg if a single job runs longer than this
+CONVERT_TIMEOUT = int(os.environ.get('CONVERT_TIMEOUT', 300))
+
+# How long an event-stream request waits for the next progress update
+EVENTS_WAIT = float(os.environ.get('CONVERT_EVENTS_WAIT', 20))
+
+# FFmpeg PUTs its output to the local ingest server, which lands every
+# segment in the published artifact as it is written (0: plain files)
+CONVERT_INGEST = os.environ.get('CONVERT_INGEST', '1') != '0'
+
+def release_artifact(result):
+    """Delete the files of a result evicted from the cache"""
+    artifacts.remove(result['conversion_id'])
+
+def artifact_available(result):
+    """A cached result is only reusable while its files are still stored
+    and its presigned links still work"""
+    if result.get('expires_at') is not None and result['expires_at'] <= time.time():
+        return False
+    return artifacts.lookup(result['conversion_id']) is not None
+
+# Identical conversions share one job and one set of output files
+RESULT_CACHE = ResultCache.from_env(on_evict=release_artifact)
+
+CONVERSIONS = metrics.counter(
+    'conversions_total', 'Finished conversions by mode and outcome.', ('mode', 'outcome'))
+CONVERSION_SECONDS = metrics.histogram(
+    'conversion_duration_seconds', 'Wall time of a conversion once a worker picks it up.', ('mode',))
+REALTIME_FACTOR = metrics.histogram(
+    'conversion_realtime_factor', 'Seconds of media produced per second of wall time.', ('mode',),
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128))
+CONVERSION_CPU_SECONDS = metrics.histogram(
+    'conversion_cpu_seconds', 'CPU time (user + system) ffmpeg used per conversion.', ('mode',),
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1200))
+
+def converter_metrics():
+    """Queue depth and cache counters read at scrape time"""
+    queue_stats = get_job_queue().stats()
+    yield ('conversion_queue_depth', 'gauge', 'Conversions waiting for a worker.', [({}, queue_stats['queued'])])
+    yield ('conversion_running', 'gauge', 'Conversions currently running.', [({}, queue_stats['running'])])
+    scheduler_stats = get_scheduler().stats()
+    yield ('conversion_cores', 'gauge', 'Cores the scheduler shares between transcodes.', [({}, scheduler_stats['cores'])])
+    yield ('conversion_cores_reserved', 'gauge', 'Cores held by running transcodes.', [({}, scheduler_stats['reserved'])])
+    yield ('conversion_core_waiters', 'gauge', 'Transcodes waiting for free cores.', [({}, scheduler_stats['waiting'])])
+    yield from metrics.cache_families('conversion_results', RESULT_CACHE.stats())
+    yield from metrics.cache_families('probes', get_probe_cache().stats())
+
+metrics.register_collector(converter_metrics)
 
 # Vercel requires specific handler
+@metrics.timed_handler('/api/convert')
 def handler(request):
     """Main API handler for Vercel"""
     try:
+        job_id = requested_job_id(request)
         if request.method == 'POST':
             return convert_m3u8_to_mpd(request)
+        elif request.method == 'GET' and job_id and wants_events(request):
+            return job_events(job_id, request)
+        elif request.method == 'GET' and job_id:
+            return job_status(job_id)
+        elif request.method == 'GET' and 'stats' in parse_qs(urlparse(request.path).query):
+            return converter_stats()
+        elif request.method == 'GET' and 'metrics' in parse_qs(urlparse(request.path).query):
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': metrics.CONTENT_TYPE},
+                'body': metrics.render()
+            }
+        elif request.method == 'GET' and 'probe' in parse_qs(urlparse(request.path).query):
+            return probe_source(parse_qs(urlparse(request.path).query)['probe'][0])
         elif request.method == 'GET':
             return show_form()
         else:
@@ -150,10 +225,12 @@ def show_form():
                 <div class="form-group">
                     <label for="quality">Quality:</label>
                     <select id="quality">
+                        <option value="auto" selected>Auto (copy when compatible)</option>
                         <option value="copy">Copy (No re-encode)</option>
                         <option value="720p">720p (HD)</option>
                         <option value="480p">480p (SD)</option>
                         <option value="360p">360p (Mobile)</option>
+                        <option value="abr">Adaptive (720p + 480p + 360p)</option>
                     </select>
                 </div>
                 
@@ -168,7 +245,7 @@ def show_form():
                 
                 <div class="loading" id="loading">
                     <div class="spinner"></div>
-                    <p>Converting... This may take a few minutes</p>
+                    <p id="progressText">Converting... This may take a few minutes</p>
                 </div>
                 
                 <button type="submit">Convert to MPD</button>
@@ -208,7 +285,10 @@ def show_form():
                     })
                 });
                 
-                const result = await response.json();
+                const submitted = await response.json();
+                const result = submitted.success && submitted.state !== 'done'
+                    ? await waitForJob(submitted.status_url)
+                    : submitted;
                 
                 if (result.success) {
                     showSuccess('Conversion successful!');
@@ -228,7 +308,7 @@ def show_form():
                         ">📥 Download MPD File</a></p>
                         
                         ${result.segments_url ? `
-                        <p><a href="${result.segments_url}" style="color: #007bff; text-decoration: underline;">
+                        <p><a href="${result.segments_url}" id="segmentsLink" style="color: #007bff; text-decoration: underline;">
                             Download all segments (ZIP)
                         </a></p>
                         ` : ''}
@@ -239,6 +319,14 @@ def show_form():
                         </code></p>
                     `;
                     
+                    const segmentsLink = document.getElementById('segmentsLink');
+                    if (segmentsLink) {
+                        segmentsLink.addEventListener('click', function(event) {
+                            event.preventDefault();
+                            downloadInRanges(result.segments_url, result.segments_range_bytes, segmentsLink);
+                        });
+                    }
+                    
                     document.getElementById('result').style.display = 'block';
                 } else {
                     showError(result.error || 'Conversion failed');
@@ -250,6 +338,92 @@ def show_form():
             }
         });
         
+        async function downloadInRanges(url, rangeBytes, link) {
+            // One response may only carry rangeBytes, so the ZIP is fetched
+            // piece by piece and saved from the joined blob
+            const label = link.textContent;
+            const parts = [];
+            let start = 0;
+            let size = null;
+            try {
+                while (size === null || start < size) {
+                    const response = await fetch(url, {headers: {'Range': `bytes=${start}-${start + rangeBytes - 1}`}});
+                    if (response.status !== 206 && response.status !== 200) {
+                        throw new Error(`HTTP ${response.status}`);
+                    }
+                    const blob = await response.blob();
+                    parts.push(blob);
+                    const contentRange = response.headers.get('Content-Range');
+                    size = response.status === 206 && contentRange
+                        ? parseInt(contentRange.split('/')[1], 10)
+                        : blob.size;
+                    start += blob.size;
+                    link.textContent = `Downloading... ${Math.round(100 * start / size)}%`;
+                }
+                const saved = document.createElement('a');
+                saved.href = URL.createObjectURL(new Blob(parts, {type: 'application/zip'}));
+                saved.download = url.split('/').pop();
+                document.body.appendChild(saved);
+                saved.click();
+                saved.remove();
+                setTimeout(() => URL.revokeObjectURL(saved.href), 60000);
+            } catch (error) {
+                showError('ZIP download failed: ' + error.message);
+            } finally {
+                link.textContent = label;
+            }
+        }
+        
+        function showProgress(job) {
+            const progress = job.progress || {};
+            const details = [`${progress.elapsed_seconds || 0}s elapsed`];
+            if (progress.out_time_seconds) details.push(`${progress.out_time_seconds.toFixed(1)}s of media`);
+            if (progress.speed) details.push(`${progress.speed}x`);
+            if (progress.bitrate_kbps) details.push(`${Math.round(progress.bitrate_kbps)} kbit/s`);
+            details.push(`${progress.segments_written || 0} segments written`);
+            document.getElementById('progressText').textContent = job.state === 'queued'
+                ? 'Waiting for a free converter...'
+                : `Converting... ${details.join(', ')}`;
+        }
+        
+        function waitForJob(statusUrl) {
+            // Follow the job's event stream; fall back to polling without EventSource
+            if (!window.EventSource) return pollJob(statusUrl);
+            return new Promise(resolve => {
+                const events = new EventSource(statusUrl + '/events');
+                events.addEventListener('progress', e => showProgress(JSON.parse(e.data)));
+                events.addEventListener('done', e => {
+                    events.close();
+                    resolve({ success: true, ...JSON.parse(e.data).result });
+                });
+                events.addEventListener('failed', e => {
+                    events.close();
+                    resolve({ success: false, error: JSON.parse(e.data).error });
+                });
+                events.onerror = () => {
+                    if (events.readyState === EventSource.CLOSED) resolve(pollJob(statusUrl));
+                };
+            });
+        }
+        
+        async function pollJob(statusUrl) {
+            // Poll the job until it finishes, showing progress meanwhile
+            while (true) {
+                const response = await fetch(statusUrl);
+                const job = await response.json();
+                
+                if (job.state === 'done') {
+                    return { success: true, ...job.result };
+                }
+                if (job.state === 'failed' || !response.ok) {
+                    return { success: false, error: job.error };
+                }
+                
+                showProgress(job);
+                await new Promise(resolve => setTimeout(resolve, 2000));
+            }
+        }
+        
         function showSuccess(message) {
             const notification = document.getElementById('notification');
             notification.className = 'notification success';
@@ -281,8 +455,214 @@ def show_form():
         'body': html
     }
 
+def requested_job_id(request):
+    """Job id from /api/convert/jobs/<id>[/events] or /api/convert?job=<id>"""
+    parsed = urlparse(request.path)
+    parts = [p for p in parsed.path.split('/') if p]
+    if parts and parts[-1] == 'events':
+        parts = parts[:-1]
+    if len(parts) >= 4 and parts[-2] == 'jobs':
+        return parts[-1]
+    return parse_qs(parsed.query).get('job', [None])[0]
+
+def wants_events(request):
+    """True for /api/convert/jobs/<id>/events or ?events=1"""
+    parsed = urlparse(request.path)
+    return parsed.path.rstrip('/').endswith('/events') or 'events' in parse_qs(parsed.query)
+
+# Re-encode presets: resolution and target video bitrate
+QUALITY_PRESETS = {
+    '1080p': {'resolution': '1920x1080', 'video_bitrate': '4500k'},
+    '720p': {'resolution': '1280x720', 'video_bitrate': '2000k'},
+    '480p': {'resolution': '854x480', 'video_bitrate': '1000k'},
+    '360p': {'resolution': '640x360', 'video_bitrate': '500k'},
+}
+
+# Accepted segment_duration, in seconds
+SEGMENT_DURATION_MIN = 1.0
+SEGMENT_DURATION_MAX = 60.0
+
+# Most chunks one parallel conversion may ask for
+MAX_CHUNKS = 64
+
+# Default renditions for quality=abr, highest first
+ABR_LADDER = [r.strip() for r in os.environ.get('ABR_LADDER', '720p,480p,360p').split(',') if r.strip()]
+
+def dash_output_args(segment_duration, mpd_file, window_size=5):
+    """DASH muxer options shared by every conversion mode (window_size=0 keeps every segment)
+
+    An http:// ``mpd_file`` is the ingest server, which takes every file as a PUT.
+    """
+    args = [
+        '-f', 'dash',
+        '-use_timeline', '1',
+        '-use_template', '1',
+        '-seg_duration', segment_duration,
+        '-window_size', str(window_size),
+        '-remove_at_exit', '0',
+    ]
+    if mpd_file.startswith('http://'):
+        # One connection per file: on a persistent one FFmpeg can exit with
+        # replies unread, and the reset then drops its final manifest
+        args += ['-method', 'PUT', '-http_persistent', '0']
+    return args + [mpd_file]
+
+def rate_control_args(video_bitrate, stream=''):
+    """Bitrate, maxrate and bufsize for one video stream (e.g. stream=':v:1')"""
+    kbps = int(video_bitrate[:-1])
+    return [
+        f'-b{stream or ":v"}', video_bitrate,
+        f'-maxrate{stream}', f'{kbps * 1.5}k',
+        f'-bufsize{stream}', f'{kbps * 2}k',
+    ]
+
+def build_ladder_cmd(params, mpd_file):
+    """One decode, split and scaled into several renditions of a single MPD
+
+    All video renditions land in one AdaptationSet and share one AAC audio
+    track. Key frames are forced on segment boundaries so players can
+    switch renditions at every segment. With copy_top the first rung is
+    the source video passed through untouched.
+    """
+    ladder = params['ladder']
+    copy_top = params.get('copy_top', False)
+    scaled = ladder[1:] if copy_top else ladder
+    segment_duration = params['segment_duration']
+
+    filters = []
+    if len(scaled) == 1:
+        width, height = QUALITY_PRESETS[scaled[0]]['resolution'].split('x')
+        filters.append(f'[0:v:0]scale={width}:{height}[vout0]')
+    elif scaled:
+        filters.append(f'[0:v:0]split={len(scaled)}' + ''.join(f'[vin{i}]' for i in range(len(scaled))))
+        for i, name in enumerate(scaled):
+            width, height = QUALITY_PRESETS[name]['resolution'].split('x')
+            filters.append(f'[vin{i}]scale={width}:{height}[vout{i}]')
+
+    cmd = ['ffmpeg', '-i', params['url']]
+    if filters:
+        cmd += ['-filter_complex', ';'.join(filters)]
+
+    index = 0
+    if copy_top:
+        cmd += ['-map', '0:v:0', '-c:v:0', 'copy']
+        index = 1
+    for i, name in enumerate(scaled):
+        stream = f':v:{index}'
+        cmd += ['-map', f'[vout{i}]', f'-c{stream}', 'libx264']
+        cmd += rate_control_args(QUALITY_PRESETS[name]['video_bitrate'], stream)
+        index += 1
+
+    cmd += [
+        '-preset', 'fast',
+        '-force_key_frames', f'expr:gte(t,n_forced*{segment_duration})',
+        '-sc_threshold', '0',
+        # Audio is encoded once and shared by every video rendition
+        '-map', '0:a:0?',
+        '-c:a', 'aac',
+        '-b:a', '128k',
+        '-adaptation_sets', 'id=0,streams=v id=1,streams=a',
+    ]
+    return cmd + dash_output_args(segment_duration, mpd_file)
+
+def target_preset(probe_result):
+    """Largest preset not taller than the source video (720p if unknown)"""
+    heights = [s['height'] for s in probe_result.get('streams', ()) if s['type'] == 'video' and s['height']]
+    if not heights:
+        return '720p'
+    fitting = [name for name, preset in QUALITY_PRESETS.items()
+               if int(preset['resolution'].split('x')[1]) <= heights[0]]
+    return max(fitting, key=lambda name: int(name[:-1])) if fitting else '360p'
+
+def plan_auto(params, job):
+    """Resolve quality=auto into a copy or per-stream transcode plan
+
+    Without a probe result everything is transcoded, which always works.
+    """
+    try:
+        probe_result = get_probe_cache().probe(params['url'])
+        plan = plan_streams(probe_result)
+    except ProbeError as e:
+        job.update(probe_error=str(e))
+        probe_result, plan = {}, {'video': 'transcode', 'audio': 'transcode'}
+    
+    job.update(plan=plan)
+    if 'transcode' not in plan.values():
+        return {**params, 'quality': 'copy'}
+    return {**params, 'plan': plan, 'target': target_preset(probe_result)}
+
+def check_copyable(params):
+    """Fail fast when copy mode would put an unsupported codec into DASH"""
+    try:
+        probe_result = get_probe_cache().probe(params['url'])
+    except ProbeError:
+        return
+    incompatible = [
+        f"{s['type']} codec {s['codec']}" for s in probe_result['streams']
+        if plan_streams({'streams': [s]})[s['type']] == 'transcode'
+    ]
+    if incompatible:
+        raise RuntimeError(f"Cannot copy {', '.join(incompatible)} into DASH; use quality=auto")
+
+def build_auto_cmd(params, mpd_file):
+    """Copy the DASH-compatible streams and transcode only the others"""
+    plan = params['plan']
+    cmd = ['ffmpeg', '-i', params['url'], '-map', '0:v:0?', '-map', '0:a:0?']
+    
+    if plan['video'] == 'transcode':
+        preset = QUALITY_PRESETS[params['target']]
+        cmd += ['-c:v', 'libx264'] + rate_control_args(preset['video_bitrate']) + [
+            '-preset', 'fast',
+            '-s', preset['resolution'],
+        ]
+    else:
+        cmd += ['-c:v', 'copy']
+    
+    if plan['audio'] == 'transcode':
+        cmd += ['-c:a', 'aac', '-b:a', '128k']
+    else:
+        cmd += ['-c:a', 'copy']
+    
+    return cmd + dash_output_args(params['segment_duration'], mpd_file)
+
+def build_ffmpeg_cmd(params, mpd_file):
+    """Build the FFmpeg command for one conversion"""
+    m3u8_url = params['url']
+    quality = params['quality']
+    segment_duration = params['segment_duration']
+
+    if quality == 'copy':
+        return [
+            'ffmpeg',
+            '-i', m3u8_url,
+            '-c', 'copy',
+        ] + dash_output_args(segment_duration, mpd_file)
+
+    if quality == 'abr':
+        return build_ladder_cmd(params, mpd_file)
+
+    if quality == 'auto':
+        return build_auto_cmd(params, mpd_file)
+
+    # Re-encode with specific quality
+    return [
+        'ffmpeg',
+        '-i', m3u8_url,
+    ] + preset_video_args(quality) + [
+        '-c:a', 'aac',
+        '-b:a', '128k',
+    ] + dash_output_args(segment_duration, mpd_file)
+
+def preset_video_args(quality):
+    """libx264 options for a single-rendition re-encode preset"""
+    preset = QUALITY_PRESETS.get(quality, QUALITY_PRESETS['360p'])
+    return ['-c:v', 'libx264'] + rate_control_args(preset['video_bitrate']) + [
+        '-preset', 'fast',
+        '-s', preset['resolution'],
+    ]
+
 def convert_m3u8_to_mpd(request):
-    """Convert M3U8 to MPD"""
+    """Queue an M3U8 to MPD conversion and return its job id immediately"""
     try:
         # Parse request body
         body = json.loads(request.body)
@@ -295,133 +675,124 @@ def convert_m3u8_to_mpd(request):
                 'body': json.dumps({'error': 'M3U8 URL is required'})
             }
         
-        # Generate unique ID for this conversion
-        conversion_id = str(uuid.uuid4())[:8]
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        # Create temp directory
-        temp_dir = tempfile.mkdtemp(prefix=f'mpd_{conversion_id}_')
-        
-        # Output filename
-        output_name = f'converted_{timestamp}'
-        mpd_file = os.path.join(temp_dir, f'{output_name}.mpd')
+        try:
+            segment_duration = float(body.get('segment_duration', 6))
+        except (TypeError, ValueError):
+            segment_duration = None
+        if segment_duration is None or not SEGMENT_DURATION_MIN <= segment_duration <= SEGMENT_DURATION_MAX:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({
+                    'error': f'segment_duration must be a number of seconds from {SEGMENT_DURATION_MIN:g} to {SEGMENT_DURATION_MAX:g}',
+                    'success': False
+                })
+            }
         
-        # Get conversion parameters
-        quality = body.get('quality', 'copy')
-        segment_duration = body.get('segment_duration', '6')
+        params = {
+            'url': m3u8_url,
+            'quality': body.get('quality', 'copy'),
+            'segment_duration': f'{segment_duration:g}',
+        }
         
-        # Build FFmpeg command
-        if quality == 'copy':
-            ffmpeg_cmd = [
-                'ffmpeg',
-                '-i', m3u8_url,
-                '-c', 'copy',
-                '-f', 'dash',
-                '-use_timeline', '1',
-                '-use_template', '1',
-                '-seg_duration', segment_duration,
-                '-window_size', '5',
-                '-remove_at_exit', '0',
-                mpd_file
-            ]
-        else:
-            # Re-encode with specific quality
-            if quality == '720p':
-                video_bitrate = '2000k'
-                resolution = '1280x720'
-            elif quality == '480p':
-                video_bitrate = '1000k'
-                resolution = '854x480'
-            else:  # 360p
-                video_bitrate = '500k'
-                resolution = '640x360'
-            
-            ffmpeg_cmd = [
-                'ffmpeg',
-                '-i', m3u8_url,
-                '-c:v', 'libx264',
-                '-b:v', video_bitrate,
-                '-maxrate', f'{int(video_bitrate[:-1]) * 1.5}k',
-                '-bufsize', f'{int(video_bitrate[:-1]) * 2}k',
-                '-preset', 'fast',
-                '-s', resolution,
-                '-c:a', 'aac',
-                '-b:a', '128k',
-                '-f', 'dash',
-                '-use_timeline', '1',
-                '-use_template', '1',
-                '-seg_duration', segment_duration,
-                '-window_size', '5',
-                '-remove_at_exit', '0',
-                mpd_file
-            ]
+        if params['quality'] == 'abr':
+            ladder = body.get('ladder') or ABR_LADDER
+            if not isinstance(ladder, list) or not all(isinstance(name, str) for name in ladder):
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({
+                        'error': f'ladder must be a list of rung names from {sorted(QUALITY_PRESETS)}',
+                        'success': False
+                    })
+                }
+            unknown = [name for name in ladder if name not in QUALITY_PRESETS]
+            if unknown or not ladder:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({
+                        'error': f'Unknown ladder rungs: {unknown}; choose from {sorted(QUALITY_PRESETS)}',
+                        'success': False
+                    })
+                }
+            params['ladder'] = list(ladder)
+            params['copy_top'] = bool(body.get('copy_top', False))
         
-        # Run FFmpeg
-        process = subprocess.run(
-            ffmpeg_cmd,
-            capture_output=True,
-            text=True,
-            timeout=300  # 5 minutes timeout
-        )
+        if body.get('parallel') or body.get('chunks'):
+            # Chunked mode splits one re-encode across cores (VOD inputs only)
+            if params['quality'] not in QUALITY_PRESETS:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({
+                        'error': f'Parallel mode needs one of the quality presets {sorted(QUALITY_PRESETS)}',
+                        'success': False
+                    })
+                }
+            # 0 lets the scheduler pick one chunk per core
+            chunks = body.get('chunks')
+            try:
+                chunks = 0 if chunks in (None, '', False) else int(str(chunks).strip())
+            except ValueError:
+                chunks = -1
+            if not 0 <= chunks <= MAX_CHUNKS:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({
+                        'error': f'chunks must be a whole number from 0 to {MAX_CHUNKS}',
+                        'success': False
+                    })
+                }
+            params['chunks'] = chunks
         
-        if process.returncode != 0:
+        try:
+            outcome, value = RESULT_CACHE.lookup_or_submit(
+                cache_key(params),
+                lambda: get_job_queue().submit(run_conversion, params, lane=get_scheduler().lane_for(params)),
+                valid=artifact_available
+            )
+        except QueueFull as e:
             return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json'},
+                'statusCode': 503,
+                'headers': {'Content-Type': 'application/json', 'Retry-After': '30'},
                 'body': json.dumps({
-                    'error': f'FFmpeg failed: {process.stderr[:500]}',
+                    'error': f'Conversion queue is full ({e}), try again later',
                     'success': False
                 })
             }
         
-        # Check if MPD file was created
-        if not os.path.exists(mpd_file):
+        if outcome == HIT:
+            # Served from cache: the finished result is returned directly
             return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json'},
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'X-Cache': 'HIT'},
                 'body': json.dumps({
-                    'error': 'MPD file not generated',
-                    'success': False
+                    'success': True,
+                    'state': 'done',
+                    'cached': True,
+                    **value
                 })
             }
         
-        # In Vercel, we can't serve files directly from temp directory
-        # So we return the file content in base64 (for small files)
-        # For production, use S3 or similar storage
-        
-        with open(mpd_file, 'r', encoding='utf-8') as f:
-            mpd_content = f.read()
-        
-        # Clean up temp directory
-        import shutil
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        
-        # Generate a temporary download URL
-        # In production, upload to S3 and return that URL
-        download_url = f"/api/download/{conversion_id}/{output_name}.mpd"
-        
+        job = value
         return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json'},
+            'statusCode': 202,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Location': f'/api/convert/jobs/{job.id}',
+                'X-Cache': 'MISS' if outcome == MISS else 'JOIN'
+            },
             'body': json.dumps({
                 'success': True,
-                'conversion_id': conversion_id,
-                'download_url': download_url,
-                'filename': f'{output_name}.mpd',
-                'message': 'Conversion successful',
-                'mpd_content': mpd_content[:5000] + '...' if len(mpd_content) > 5000 else mpd_content
+                'job_id': job.id,
+                'state': job.state,
+                'status_url': f'/api/convert/jobs/{job.id}',
+                'message': 'Conversion queued' if outcome == MISS else 'Joined an identical conversion in progress'
             })
         }
         
-    except subprocess.TimeoutExpired:
-        return {
-            'statusCode': 408,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({
-                'error': 'Conversion timed out (5 minutes)',
-                'success': False
-            })
-        }
     except Exception as e:
         return {
             'statusCode': 500,
@@ -431,3 +802,329 @@ def convert_m3u8_to_mpd(request):
                 'success': False
             })
         }
+
+def job_status(job_id):
+    """Report queued / running (with progress) / done / failed for a job"""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Job not found'})
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Cache-Control': 'no-cache'},
+        'body': json.dumps({'success': job.state != 'failed', **job.to_dict()})
+    }
+
+def header(request, name):
+    """Case-insensitive request header lookup"""
+    for key, value in dict(getattr(request, 'headers', None) or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+def job_events(job_id, request):
+    """Server-Sent Events for a job, one event per response
+
+    The function cannot hold a stream open, so each request waits (up to
+    EVENTS_WAIT seconds) for the version after Last-Event-ID and returns it
+    as a single event; EventSource reconnects straight away and receives the
+    next one. Events are "progress" until the final "done" or "failed".
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Job not found'})
+        }
+    
+    last_event_id = header(request, 'Last-Event-ID')
+    if last_event_id and last_event_id.isdigit() and int(last_event_id) == job.version:
+        job.wait_for_change(int(last_event_id), timeout=EVENTS_WAIT)
+    
+    version = job.version
+    event = job.state if job.state in ('done', 'failed') else 'progress'
+    body = (
+        'retry: 500\n'
+        f'id: {version}\n'
+        f'event: {event}\n'
+        f'data: {json.dumps(job.to_dict())}\n\n'
+    )
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        },
+        'body': body
+    }
+
+def probe_source(url):
+    """Codecs, resolution, bitrate and container of a source, plus the auto plan"""
+    try:
+        probe_result = get_probe_cache().probe(url)
+    except ProbeError as e:
+        return {
+            'statusCode': 502,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps({**probe_result, 'plan': plan_streams(probe_result)})
+    }
+
+def converter_stats():
+    """Queue and result cache counters"""
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Cache-Control': 'no-cache'},
+        'body': json.dumps({
+            'queue': get_job_queue().stats(),
+            'scheduler': get_scheduler().stats(),
+            'storage': storage.get_storage().stats(),
+            'result_cache': RESULT_CACHE.stats(),
+            'probe_cache': get_probe_cache().stats()
+        })
+    }
+
+def fetch_text(url):
+    # The upstream pool loads requests; only copy-mode translation needs it
+    from api._lib.upstream import get_pool
+    response = get_pool().get(url)
+    if response.status_code != 200:
+        raise NotTranslatable(f'HTTP {response.status_code} for {url}')
+    return response.text
+
+def fetch_bytes(url, byterange=None):
+    from api._lib.upstream import get_pool
+    headers = {'Range': 'bytes=%d-%d' % byterange} if byterange else None
+    response = get_pool().get(url, headers=headers)
+    if response.status_code not in (200, 206):
+        raise NotTranslatable(f'HTTP {response.status_code} for {url}')
+    return response.content
+
+def translate_manifest(params):
+    """MPD text for fMP4/CMAF sources in copy mode, or None to use FFmpeg"""
+    if params['quality'] != 'copy':
+        return None
+    try:
+        return translate(params['url'], fetch_text, fetch_bytes)
+    except Exception:
+        # NotTranslatable (e.g. MPEG-TS) or an unreachable source: FFmpeg
+        # either handles it or reports the real error
+        return None
+
+def run_conversion(job):
+    """Run one queued conversion and record its wall time and realtime factor"""
+    started = time.monotonic()
+    try:
+        result = convert(job)
+    except ChangeLane:
+        raise
+    except Exception:
+        CONVERSIONS.inc(mode=job.progress.get('mode', 'unknown'), outcome='failed')
+        raise
+    
+    elapsed = time.monotonic() - started
+    CONVERSIONS.inc(mode=result['mode'], outcome='done')
+    CONVERSION_SECONDS.observe(elapsed, mode=result['mode'])
+    if result.get('cpu_seconds') is not None:
+        CONVERSION_CPU_SECONDS.observe(result['cpu_seconds'], mode=result['mode'])
+    media_seconds = job.progress.get('out_time_seconds')
+    if media_seconds and elapsed > 0:
+        REALTIME_FACTOR.observe(media_seconds / elapsed, mode=result['mode'])
+    return result
+
+def convert(job):
+    """Run FFmpeg for a queued job and register the finished MPD for download"""
+    params = job.params
+    conversion_id = job.id
+    
+    # Auto jobs are queued as remuxes and probe first; one that turns out
+    # to need a transcode moves to that lane before doing any work
+    if params['quality'] == 'auto' and 'plan' not in params:
+        params = job.params = plan_auto(params, job)
+        lane = get_scheduler().lane_for(params)
+        if lane != job.lane:
+            raise ChangeLane(lane)
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    
+    # FFmpeg writes straight into the artifact store's staging area
+    temp_dir = artifacts.staging_dir(conversion_id)
+    
+    # Output filename
+    output_name = f'converted_{timestamp}'
+    mpd_file = os.path.join(temp_dir, f'{output_name}.mpd')
+    
+    # Copies the output to the storage backend as segments are finished
+    upload = storage.get_storage().begin(conversion_id)
+    
+    # fMP4/CMAF sources only need a new manifest pointing at their segments
+    mpd_content = translate_manifest(params)
+    if mpd_content is not None:
+        job.update(mode='manifest')
+        with open(mpd_file, 'w', encoding='utf-8') as f:
+            f.write(mpd_content)
+        return conversion_result(conversion_id, temp_dir, output_name, mpd_content, 'manifest', upload)
+    
+    if params['quality'] == 'copy':
+        check_copyable(params)
+    
+    # From here on FFmpeg writes the output
+    ingest = None
+    output = mpd_file
+    if CONVERT_INGEST:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        temp_dir, ingest = open_ingest(job, conversion_id, f'{output_name}.mpd')
+        mpd_file = os.path.join(temp_dir, f'{output_name}.mpd')
+        output = ingest.url(f'{output_name}.mpd')
+    
+    if params.get('chunks') is not None:
+        try:
+            summary = convert_chunked(job, params, output)
+            if summary is not None:
+                close_ingest(ingest)
+                with open(mpd_file, 'r', encoding='utf-8') as f:
+                    mpd_content = f.read()
+        except Exception:
+            close_ingest(ingest)
+            discard_output(conversion_id, temp_dir)
+            raise
+        if summary is not None:
+            result = conversion_result(conversion_id, temp_dir, output_name, mpd_content, 'chunked', upload)
+            return {**result, 'chunks': summary['chunks'], 'cpu_seconds': summary['cpu_seconds']}
+    
+    # Transcodes get a thread budget and wait for that many free cores;
+    # remuxes run straight away in their own lane
+    scheduler = get_scheduler()
+    lane = scheduler.lane_for(params)
+    threads = scheduler.thread_budget(params)
+    job.update(mode='ffmpeg', lane=lane, threads=threads)
+    ffmpeg_cmd = limit_threads(build_ffmpeg_cmd(params, output), threads)
+    
+    def on_tick(elapsed):
+        upload.sync(temp_dir)
+        job.update(
+            elapsed_seconds=round(elapsed, 1),
+            segments_written=len(glob.glob(os.path.join(temp_dir, '*.m4s')))
+        )
+    
+    try:
+        job.update(waiting_for_cores=True)
+        with scheduler.reserve(threads, lane):
+            job.update(waiting_for_cores=False)
+            # Progress arrives block by block on FFmpeg's stdout; only the tail
+            # of stderr is kept for the error message
+            run_ffmpeg(
+                ffmpeg_cmd,
+                on_progress=lambda block: job.update(**block),
+                on_tick=on_tick,
+                timeout=CONVERT_TIMEOUT,
+                nice=scheduler.nice[lane],
+                on_usage=lambda usage: job.update(**usage)
+            )
+        close_ingest(ingest)
+        
+        # Check if MPD file was created
+        if not os.path.exists(mpd_file):
+            raise RuntimeError('MPD file not generated')
+        
+        with open(mpd_file, 'r', encoding='utf-8') as f:
+            mpd_content = f.read()
+    except Exception:
+        close_ingest(ingest)
+        upload.abort()
+        discard_output(conversion_id, temp_dir)
+        raise
+    
+    result = conversion_result(conversion_id, temp_dir, output_name, mpd_content, 'ffmpeg', upload)
+    return {**result, 'threads': threads, 'cpu_seconds': job.progress.get('cpu_seconds')}
+
+def open_ingest(job, conversion_id, mpd_name):
+    """Publish the output directory before FFmpeg starts and route its writes there
+
+    Returns ``(directory, session)``.  Every segment is downloadable the
+    moment it lands, so a client can start playing a conversion that is
+    still running from ``live_url``.
+    """
+    # http.server is only needed once a conversion actually runs
+    from api._lib.ingest import get_ingest_server
+    directory = artifacts.reserve(conversion_id, mpd_name)
+    job.update(live_url=f'/api/download/{conversion_id}/{mpd_name}')
+    return directory, get_ingest_server().open(directory)
+
+def close_ingest(session):
+    """Wait for FFmpeg's last writes to land, then stop accepting more"""
+    if session is not None:
+        session.close()
+
+def discard_output(conversion_id, temp_dir):
+    """Delete a failed conversion's files, whether published early or not"""
+    artifacts.remove(conversion_id)
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+def convert_chunked(job, params, mpd_file):
+    """Transcode a VOD input as parallel chunks; None if it cannot be split
+
+    Live playlists, non-HLS inputs and clips too short to split fall back
+    to the single FFmpeg pipeline.
+    """
+    scheduler = get_scheduler()
+    work_dir = tempfile.mkdtemp(prefix='chunks-')
+    job.update(mode='chunked')
+    try:
+        summary = transcode_chunked(
+            params['url'],
+            params['chunks'] or scheduler.cores,
+            preset_video_args(params['quality']),
+            params['segment_duration'],
+            # A finished VOD presentation lists all of its segments
+            dash_output_args(params['segment_duration'], mpd_file, window_size=0),
+            work_dir,
+            scheduler,
+            fetch_text,
+            timeout=CONVERT_TIMEOUT,
+            on_progress=lambda progress: job.update(**progress)
+        )
+    except (NotChunkable, NotTranslatable, OSError) as e:
+        # Raised while reading and splitting the playlist, before any encode
+        job.update(mode='ffmpeg', chunked_fallback=str(e))
+        return None
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    job.update(cpu_seconds=summary['cpu_seconds'])
+    return summary
+
+def conversion_result(conversion_id, temp_dir, output_name, mpd_content, mode, upload):
+    """Publish the output: the MPD goes to the storage backend after every
+    segment it lists, then the local copy is registered for download"""
+    try:
+        published = upload.finish(temp_dir, f'{output_name}.mpd')
+    except Exception:
+        upload.abort()
+        discard_output(conversion_id, temp_dir)
+        raise
+    artifact = artifacts.register(conversion_id, temp_dir, f'{output_name}.mpd')
+    
+    return {
+        'conversion_id': conversion_id,
+        **published,
+        'segments_url': f'/api/download/{conversion_id}/{artifact.zip_name}',
+        # The download function answers the ZIP in ranges of at most this size
+        'segments_range_bytes': zipstream.RESPONSE_MAX_BYTES,
+        'filename': f'{output_name}.mpd',
+        'size_bytes': artifact.size,
+        'mode': mode,
+        'message': 'Conversion successful',
+        'mpd_content': mpd_content[:5000] + '...' if len(mpd_content) > 5000 else mpd_content
+    }
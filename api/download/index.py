@@ -1,77 +1,154 @@
 import os
 import json
+import mmap
 import base64
-from datetime import datetime, timedelta
 
-# Simple in-memory storage for demo
-# In production, use S3, Redis, or database
-conversion_store = {}
+from api._lib import artifacts, metrics, zipstream
 
+@metrics.timed_handler('/api/download')
 def handler(request):
     """Handle file download requests"""
     try:
-        # Extract filename from path
-        path = request.path
-        parts = path.split('/')
-        
-        if len(parts) < 4:
+        # Extract conversion id and filename from /api/download/<id>/<filename>
+        path = request.path.split('?', 1)[0]
+        parts = [p for p in path.split('/') if p]
+
+        if len(parts) < 3:
             return {
                 'statusCode': 404,
                 'headers': {'Content-Type': 'application/json'},
                 'body': json.dumps({'error': 'File not found'})
             }
-        
-        conversion_id = parts[2]
-        filename = parts[3]
-        
-        # Check if conversion exists in store
-        if conversion_id in conversion_store:
-            data = conversion_store[conversion_id]
-            
-            # Check if expired (1 hour)
-            if datetime.now() - data['timestamp'] > timedelta(hours=1):
-                del conversion_store[conversion_id]
-                return {
-                    'statusCode': 410,
-                    'headers': {'Content-Type': 'application/json'},
-                    'body': json.dumps({'error': 'File expired'})
-                }
-            
-            # Return file content
+
+        conversion_id = parts[-2]
+        filename = parts[-1]
+
+        artifact = artifacts.lookup(conversion_id)
+        if artifact is None:
+            # Unknown, or already past its TTL and awaiting the sweeper
             return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/dash+xml',
-                    'Content-Disposition': f'attachment; filename="{filename}"',
-                    'Cache-Control': 'no-cache'
-                },
-                'body': data['content']
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Conversion not found'})
             }
-        
-        # For this example, we'll return a sample MPD
-        # In production, you would fetch from storage
-        sample_mpd = """<?xml version="1.0" encoding="UTF-8"?>
-<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT30S">
-  <Period duration="PT30S">
-    <AdaptationSet mimeType="video/mp4" codecs="avc1.42c01e">
-      <SegmentTemplate media="video_$Number$.m4s" initialization="video_init.mp4"/>
-      <Representation bandwidth="500000" width="640" height="360"/>
-    </AdaptationSet>
-  </Period>
-</MPD>"""
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/dash+xml',
-                'Content-Disposition': f'attachment; filename="sample.mpd"'
-            },
-            'body': sample_mpd
-        }
-        
+
+        if filename == artifact.zip_name:
+            return serve_zip(artifact, request_headers(request))
+
+        file_path = artifact.path(filename)
+        if file_path is None:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'File not found'})
+            }
+
+        return serve_file(file_path, filename, artifact, request_headers(request))
+
     except Exception as e:
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json'},
             'body': json.dumps({'error': str(e)})
         }
+
+def request_headers(request):
+    """Request headers as a plain dict with canonical capitalisation"""
+    headers = getattr(request, 'headers', None) or {}
+    return {'-'.join(w.capitalize() for w in k.split('-')): v for k, v in dict(headers).items()}
+
+def serve_file(file_path, filename, artifact, headers):
+    """Answer with the whole file, one byte range, or 304 / 416"""
+    stat = os.stat(file_path)
+    etag, last_modified = artifacts.file_validators(stat)
+    response_headers = {
+        'Content-Type': artifacts.content_type(filename),
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        # Segment names are unique per conversion; only the MPD may be re-fetched
+        'Cache-Control': 'no-cache' if filename == artifact.mpd_name else 'public, max-age=3600, immutable',
+    }
+
+    if artifacts.not_modified(headers, etag, stat.st_mtime):
+        return {'statusCode': 304, 'headers': response_headers, 'body': ''}
+
+    size = stat.st_size
+    span = artifacts.byte_range(headers, size, etag)
+    if span is False:
+        response_headers['Content-Range'] = f'bytes */{size}'
+        return {'statusCode': 416, 'headers': response_headers, 'body': ''}
+    start, end = span or (0, size - 1)
+    status = 206 if span else 200
+    if span:
+        response_headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    # Map the file and copy only the requested slice into the response
+    content = b''
+    if size:
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            content = mapped[start:end + 1]
+
+    if filename == artifact.mpd_name and not span:
+        response_headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return {
+            'statusCode': status,
+            'headers': response_headers,
+            'body': content.decode('utf-8')
+        }
+
+    # Media segments (and partial MPDs) are binary
+    return {
+        'statusCode': status,
+        'headers': response_headers,
+        'body': base64.b64encode(content).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def serve_zip(artifact, headers):
+    """The MPD and every segment as one stored ZIP, with Range support
+
+    The archive is laid out from file sizes alone, so only the requested
+    slice is ever read; nothing is written to disk.  Slices larger than
+    zipstream.RESPONSE_MAX_BYTES are refused with 413; the converter's
+    form fetches the archive in ranges of that size.
+    """
+    try:
+        archive = zipstream.for_artifact(artifact)
+    except zipstream.ZipTooLarge as e:
+        return {
+            'statusCode': 413,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': str(e)})
+        }
+
+    response_headers = archive.headers(artifact.zip_name)
+    if artifacts.not_modified(headers, archive.etag, archive.mtime):
+        return {'statusCode': 304, 'headers': response_headers, 'body': ''}
+
+    span = artifacts.byte_range(headers, archive.size, archive.etag)
+    if span is False:
+        response_headers['Content-Range'] = f'bytes */{archive.size}'
+        return {'statusCode': 416, 'headers': response_headers, 'body': ''}
+    start, end = span or (0, archive.size - 1)
+    if end - start + 1 > zipstream.RESPONSE_MAX_BYTES:
+        return {
+            'statusCode': 413,
+            'headers': {'Content-Type': 'application/json', 'Accept-Ranges': 'bytes'},
+            'body': json.dumps({
+                'error': f'{end - start + 1} bytes is more than one response may carry ({zipstream.RESPONSE_MAX_BYTES})',
+                'size': archive.size,
+                'max_range_bytes': zipstream.RESPONSE_MAX_BYTES,
+                'hint': 'Fetch the archive in Range requests of at most max_range_bytes'
+            })
+        }
+    if span:
+        response_headers['Content-Range'] = f'bytes {start}-{end}/{archive.size}'
+    response_headers['Content-Length'] = str(end - start + 1)
+
+    return {
+        'statusCode': 206 if span else 200,
+        'headers': response_headers,
+        'body': base64.b64encode(b''.join(archive.iter_bytes(start, end))).decode('ascii'),
+        'isBase64Encoded': True
+    }
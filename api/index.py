@@ -1,11 +1,24 @@
-from flask import Flask, Response, request
+from flask import Flask, Response, g, request, send_file
 import requests
 import json
+import os
+import time
 from datetime import datetime
+from string import Template
+
+from api._lib import artifacts, metrics, zipstream
+from api._lib.broadcast import get_hub
+from api._lib.catalog import Catalog
+from api._lib.hls import PLAYLIST_CONTENT_TYPE, UpstreamError, get_hls_hub
+from api._lib.live import MPD_NAME, LiveStartError, get_live_hub
+from api._lib.origins import get_origin_router
+from api._lib.payload import PayloadCache, PrecomputedPayload
+from api._lib.prober import HealthProber
+from api._lib.upstream import get_pool
 
 app = Flask(__name__)
 
-# قائمة القنوات (مثال مختصر - أضف باقي القنوات)
+# قائمة القنوات الافتراضية (تُستخدم عند عدم تحديد CHANNELS_M3U)
 CHANNELS = {
     "7340": "BEIN SPORT GLOBAL",
     "7339": "BEIN SPORT NEWS",
@@ -20,25 +33,157 @@ CHANNELS = {
     "223614": "BEIN SPORTS 9 HD"
 }
 
-# المصدر الأساسي
-BASE_SOURCE = "http://arabitv5.com:8000/netiptv2005/hgftfhft1245"
+# المصدر الأساسي (يمكن تغييره عبر متغير البيئة BASE_SOURCE)
+BASE_SOURCE = os.environ.get("BASE_SOURCE", "http://arabitv5.com:8000/netiptv2005/hgftfhft1245")
+
+# ملف أو رابط M3U يُحمَّل منه الكتالوج بدلاً من القائمة الثابتة (مثل a.m3u)
+CHANNELS_M3U = os.environ.get("CHANNELS_M3U")
+
+_payloads = PayloadCache()
+
+def load_catalog(source=None):
+    """تحميل الكتالوج سطراً بسطر من ملف أو رابط M3U، أو من القائمة الثابتة"""
+    if not source:
+        return Catalog.from_mapping(CHANNELS, BASE_SOURCE, "beiN Sport")
+    
+    if source.startswith(("http://", "https://")):
+        pool = get_pool()
+        response = pool.stream(source)
+        try:
+            response.raise_for_status()
+            return Catalog.from_m3u(response.iter_lines())
+        finally:
+            pool.release(source, response)
+    
+    with open(source, "rb") as f:
+        return Catalog.from_m3u(f)
+
+CATALOG = load_catalog(CHANNELS_M3U)
+
+# نسخة الكتالوج: تزداد عند كل تغيير في القنوات لإعادة بناء الاستجابات الجاهزة
+CATALOG_VERSION = 0
+
+def set_catalog(catalog):
+    """استبدال الكتالوج وإبطال الاستجابات المحسوبة مسبقاً"""
+    global CATALOG, CATALOG_VERSION
+    CATALOG = catalog
+    CATALOG_VERSION += 1
+    _payloads.invalidate()
+
+def set_channels(channels):
+    """استبدال القنوات بقاموس {id: name} على المصدر الأساسي"""
+    set_catalog(Catalog.from_mapping(channels, BASE_SOURCE, "beiN Sport"))
+
+# لاحقة روابط HLS في المصدر (BASE_SOURCE/<id>.m3u8)
+HLS_SUFFIX = os.environ.get("HLS_SUFFIX", ".m3u8")
+
+# روابط تشير إلى ملف قائمة تشغيل أو MPD بالفعل فلا يُضاف إليها HLS_SUFFIX
+MANIFEST_EXTENSIONS = (".m3u8", ".m3u", ".mpd")
+
+def hls_url(url):
+    """رابط قائمة HLS لرابط بث في المصدر"""
+    if url.split("?", 1)[0].split("#", 1)[0].lower().endswith(MANIFEST_EXTENSIONS):
+        return url
+    return f"{url}{HLS_SUFFIX}"
+
+def hls_source(channel):
+    """رابط قائمة HLS للقناة في المصدر"""
+    return hls_url(channel.url)
+
+def channel_sources(channel, hls=False):
+    """رابط القناة ثم ما يقابله على كل مرآة مُعرّفة في ORIGIN_MIRRORS"""
+    urls = get_origin_router().candidates(channel.url, channel.id, channel.group)
+    return [hls_url(url) for url in urls] if hls else urls
 
 def generate_m3u():
-    """توليد ملف M3U كامل"""
+    """توليد ملف M3U كامل من الكتالوج مع الحفاظ على ترويسات وخصائص كل قناة"""
     lines = ["#EXTM3U"]
     
-    for channel_id, channel_name in CHANNELS.items():
-        # سطر معلومات القناة
-        lines.append(f'#EXTINF:-1 tvg-id="" tvg-name="{channel_name}" tvg-logo="" group-title="beiN Sport",{channel_name}')
-        # سطر رابط القناة
-        lines.append(f"{BASE_SOURCE}/{channel_id}")
+    for channel in CATALOG:
+        # سطر معلومات القناة ثم EXTVLCOPT/KODIPROP ثم رابط القناة
+        lines.extend(channel.m3u_lines())
     
     return "\n".join(lines)
 
-@app.route('/')
-def home():
-    """الصفحة الرئيسية"""
-    return """
+# الحد الأقصى لعدد القنوات في صفحة واحدة من /channels
+MAX_PAGE_SIZE = 1000
+
+def channel_filters(args):
+    """استخراج معاملات التصفية والبحث والتقسيم إلى صفحات من الطلب"""
+    filters = {}
+    for key in ("group", "tvg_id", "name", "q"):
+        value = args.get(key)
+        if value:
+            filters[key] = value
+    
+    offset = int(args.get("offset", 0))
+    if offset < 0:
+        raise ValueError("offset must be >= 0")
+    if offset:
+        filters["offset"] = offset
+    
+    limit = args.get("limit")
+    if limit is not None:
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError("limit must be >= 1")
+        filters["limit"] = min(limit, MAX_PAGE_SIZE)
+    
+    return filters
+
+def build_channels(host_url, **filters):
+    """قائمة القنوات بتنسيق JSON (مشتركة بين Flask ومسار ASGI)"""
+    total, selected = CATALOG.query(**filters)
+    channels_array = []
+    
+    for channel in selected:
+        channels_array.append({
+            "id": channel.id,
+            "name": channel.name,
+            "group": channel.group,
+            "tvg_id": channel.tvg_id,
+            "logo": channel.tvg_logo,
+            "url": f"{host_url.rstrip('/')}/channel/{channel.id}",
+            "source_url": channel.url
+        })
+    
+    return {
+        "channels": channels_array,
+        "count": len(channels_array),
+        "total": total,
+        "offset": filters.get("offset", 0),
+        "generated_at": datetime.now().isoformat()
+    }
+
+def playlist_payload():
+    """ملف M3U جاهز للإرسال (مضغوط مسبقاً ومع ETag) يُبنى مرة لكل نسخة من الكتالوج"""
+    return _payloads.get(("playlist", CATALOG_VERSION), lambda: PrecomputedPayload(
+        generate_m3u(),
+        'audio/x-mpegurl',
+        headers={
+            'Content-Disposition': 'attachment; filename="iptv_playlist.m3u"',
+            'Cache-Control': 'public, max-age=3600',
+            'Access-Control-Allow-Origin': '*'
+        }
+    ), pinned=True)
+
+def channels_payload(host_url, filters=None):
+    """قائمة القنوات JSON جاهزة للإرسال لكل عنوان مضيف ومجموعة معاملات"""
+    filters = filters or {}
+    key = ("channels", CATALOG_VERSION, host_url, tuple(sorted(filters.items())))
+    # القائمة الكاملة فقط تُضغط مسبقاً؛ نتائج التصفية تُضغط عند الطلب بالترميز المطلوب فقط
+    return _payloads.get(key, lambda: PrecomputedPayload(
+        json.dumps(build_channels(host_url, **filters), separators=(',', ':')),
+        'application/json',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Access-Control-Allow-Origin': '*'
+        },
+        precompress=not filters
+    ), pinned=not filters)
+
+# قالب الصفحة الرئيسية يُبنى مرة واحدة عند التحميل بدلاً من كل طلب
+HOME_TEMPLATE = Template("""
     <!DOCTYPE html>
     <html>
     <head>
@@ -105,7 +250,7 @@ def home():
             <div class="stats">
                 <div class="stat-box">
                     <h3>Total Channels</h3>
-                    <p style="font-size: 24px; margin: 10px 0;">{}</p>
+                    <p style="font-size: 24px; margin: 10px 0;">$channels</p>
                 </div>
                 <div class="stat-box">
                     <h3>Status</h3>
@@ -143,102 +288,349 @@ def home():
             
             <h2>📱 How to Use</h2>
             <ol>
-                <li>Copy the playlist URL: <code>{}/playlist.m3u</code></li>
+                <li>Copy the playlist URL: <code>$host/playlist.m3u</code></li>
                 <li>Add it to your IPTV player (VLC, IPTV Smarters, etc.)</li>
                 <li>Enjoy streaming!</li>
             </ol>
             
             <footer style="margin-top: 40px; padding-top: 20px; border-top: 1px solid #ddd; color: #666;">
-                <p>Generated on: {}</p>
-                <p>Source: {}</p>
+                <p>Generated on: $generated</p>
+                <p>Source: $source</p>
             </footer>
         </div>
     </body>
     </html>
-    """.format(len(CHANNELS), request.host_url.rstrip('/'), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), BASE_SOURCE)
+    """)
+
+@app.route('/')
+def home():
+    """الصفحة الرئيسية"""
+    return HOME_TEMPLATE.substitute(
+        channels=len(CATALOG),
+        host=request.host_url.rstrip('/'),
+        generated=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        source=BASE_SOURCE
+    )
 
 @app.route('/playlist.m3u')
 def playlist():
     """إرجاع ملف M3U كامل"""
-    m3u_content = generate_m3u()
+    status, headers, body = playlist_payload().respond(request.headers)
+    return Response(body, status=status, headers=headers)
+
+def open_upstream(url, headers=None, timeout=None):
+    """فتح اتصال بث بالمصدر عبر مجمّع الاتصالات"""
+    pool = get_pool()
+    response = pool.stream(url, headers=headers, timeout=timeout or pool.timeout)
+    return response, lambda: pool.release(url, response)
+
+def open_channel_stream(channel):
+    """فتح بث القناة من أفضل مرآة حسب زمن الاستجابة والأخطاء
+
+    مهلة القراءة هي ORIGIN_STALL_TIMEOUT، فإذا توقف البث أعاد الموزّع فتحه من مرآة أخرى.
+    """
+    router = get_origin_router()
+    timeout = (get_pool().timeout[0], router.stall_timeout)
+    return router.open_stream(
+        channel_sources(channel),
+        lambda url: open_upstream(url, channel.request_headers(), timeout))
+
+def channel_fetch(channel):
+    """جلب قوائم ومقاطع HLS من أفضل مرآة، مع طلب احتياطي إذا تأخر الرد عن p95"""
+    router = get_origin_router()
+    pool = get_pool()
     
-    return Response(
-        m3u_content,
-        mimetype='audio/x-mpegurl',
-        headers={
-            'Content-Type': 'audio/x-mpegurl',
-            'Content-Disposition': 'attachment; filename="iptv_playlist.m3u"',
-            'Cache-Control': 'public, max-age=3600',
-            'Access-Control-Allow-Origin': '*'
-        }
-    )
+    def fetch(url, **kwargs):
+        return router.fetch(router.candidates(url, channel.id, channel.group), pool.get, **kwargs)
+    return fetch
 
 @app.route('/channel/<channel_id>')
 def get_channel(channel_id):
     """الحصول على قناة محددة"""
-    if channel_id not in CHANNELS:
+    channel = CATALOG.get(channel_id)
+    if channel is None:
         return Response("Channel not found", status=404)
     
     try:
-        # جلب القناة من المصدر
-        url = f"{BASE_SOURCE}/{channel_id}"
-        response = requests.get(url, stream=True, timeout=10)
+        # جميع المشاهدين لنفس القناة يتشاركون اتصالاً واحداً بالمصدر
+        broadcaster = get_hub().acquire(channel_id, lambda: open_channel_stream(channel))
         
-        if response.status_code == 200:
+        if broadcaster.status_code == 200:
             return Response(
-                response.iter_content(chunk_size=8192),
-                content_type=response.headers.get('Content-Type', 'video/mp2t'),
+                broadcaster.subscribe(),
+                content_type=broadcaster.content_type,
                 headers={
                     'Cache-Control': 'public, max-age=300',
                     'Access-Control-Allow-Origin': '*'
                 }
             )
         else:
-            return Response(f"Error: {response.status_code}", status=response.status_code)
+            return Response(f"Error: {broadcaster.status_code}", status=broadcaster.status_code)
             
     except requests.exceptions.RequestException as e:
         return Response(f"Error: {str(e)}", status=500)
 
-@app.route('/health')
-def health():
-    """فحص حالة الخدمة"""
+@app.route('/channel/<channel_id>/index.m3u8')
+def get_channel_hls(channel_id):
+    """قائمة HLS للقناة مع إعادة كتابة روابط المقاطع لتمر عبر البروكسي"""
+    channel = CATALOG.get(channel_id)
+    if channel is None:
+        return Response("Channel not found", status=404)
+    
     try:
-        # اختبار اتصال
-        test_url = f"{BASE_SOURCE}/7340"
-        response = requests.head(test_url, timeout=5)
+        # يتم تحديث القائمة مرة واحدة لكل target-duration وتُشارك بين جميع العملاء
+        hls = get_hls_hub().channel(
+            channel_id, hls_source(channel), channel.request_headers(), fetch=channel_fetch(channel))
+        return Response(
+            hls.playlist(),
+            content_type=PLAYLIST_CONTENT_TYPE,
+            headers={
+                'Cache-Control': 'no-cache',
+                'Access-Control-Allow-Origin': '*'
+            }
+        )
+    except UpstreamError as e:
+        return Response(f"Error: {e.status_code}", status=e.status_code)
+    except requests.exceptions.RequestException as e:
+        return Response(f"Error: {str(e)}", status=502)
+
+@app.route('/channel/<channel_id>/segment/<name>')
+def get_channel_segment(channel_id, name):
+    """مقطع HLS من الذاكرة المؤقتة (يُجلب من المصدر مرة واحدة فقط)"""
+    channel = CATALOG.get(channel_id)
+    if channel is None:
+        return Response("Channel not found", status=404)
+    
+    try:
+        hls = get_hls_hub().channel(
+            channel_id, hls_source(channel), channel.request_headers(), fetch=channel_fetch(channel))
+        segment = hls.segment(name)
+        if segment is None:
+            return Response("Segment not found", status=404)
         
-        return {
-            "status": "healthy",
-            "timestamp": datetime.now().isoformat(),
-            "channels": len(CHANNELS),
-            "source": BASE_SOURCE,
-            "source_status": response.status_code if response else "unknown"
+        content_type, data = segment
+        return Response(
+            data,
+            content_type=content_type,
+            headers={
+                # قوائم الجودات والصوت المنفصل (من قائمة master) تتغير، أما المقاطع فثابتة
+                'Cache-Control': 'no-cache' if content_type == PLAYLIST_CONTENT_TYPE else 'public, max-age=60',
+                'Access-Control-Allow-Origin': '*'
+            }
+        )
+    except UpstreamError as e:
+        return Response(f"Error: {e.status_code}", status=e.status_code)
+    except requests.exceptions.RequestException as e:
+        return Response(f"Error: {str(e)}", status=502)
+
+@app.route('/live/<channel_id>/<name>')
+def get_channel_live(channel_id, name):
+    """بث DASH مباشر للقناة: عملية ffmpeg واحدة لكل قناة تحفظ آخر المقاطع في الذاكرة"""
+    channel = CATALOG.get(channel_id)
+    if channel is None:
+        return Response("Channel not found", status=404)
+    
+    # يبدأ ffmpeg من أفضل مرآة وقت التشغيل
+    source = get_origin_router().rank(channel_sources(channel, hls=True))[0]
+    try:
+        entry = get_live_hub().read(channel_id, source, name, channel.request_headers())
+    except LiveStartError as e:
+        # فشل ffmpeg في البدء: يُعاد الخطأ فورًا طوال فترة التهدئة بدل تشغيله مع كل طلب
+        return Response(f"Error: {e}", status=502, headers={'Retry-After': str(int(get_live_hub().start_cooldown))})
+    if entry is None:
+        if name == MPD_NAME:
+            return Response("Live stream is starting", status=503, headers={'Retry-After': '2'})
+        return Response("Segment not found", status=404)
+    
+    content_type, data = entry
+    return Response(
+        data,
+        content_type=content_type,
+        headers={
+            # الملف MPD يتغير مع كل مقطع جديد، أما المقاطع فثابتة
+            'Cache-Control': 'no-cache' if name == MPD_NAME else 'public, max-age=60',
+            'Access-Control-Allow-Origin': '*'
         }
-    except Exception as e:
-        return {
-            "status": "degraded",
-            "error": str(e),
-            "timestamp": datetime.now().isoformat()
-        }, 503
+    )
+
+def probe_channel(channel):
+    """فحص قناة واحدة: HEAD أولاً ثم GET إذا كان المصدر لا يدعم HEAD"""
+    pool = get_pool()
+    headers = channel.request_headers()
+    timeout = (pool.timeout[0], 5)
+    response = pool.head(channel.url, headers=headers, timeout=timeout)
+    if response.status_code in (403, 405, 501):
+        response = pool.stream(channel.url, headers=headers, timeout=timeout)
+        pool.release(channel.url, response)
+    return response.status_code
+
+# فاحص الخلفية: يفحص كل القنوات دورياً ويحفظ الحالة في الذاكرة
+PROBER = HealthProber.from_env(lambda: CATALOG, probe_channel)
+
+def ensure_prober():
+    """تشغيل الفاحص عند أول طلب (ما لم يتم تعطيله عبر PROBE_ENABLED=0)"""
+    if os.environ.get("PROBE_ENABLED", "1") != "0" and not PROBER.running:
+        PROBER.start()
+
+@app.before_request
+def start_background_tasks():
+    ensure_prober()
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    """زمن كل طلب حتى إرسال الترويسات، حسب قالب المسار"""
+    started = g.get('request_started')
+    if started is not None:
+        metrics.REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            route=request.url_rule.rule if request.url_rule is not None else 'unmatched',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+def proxy_metrics():
+    """قراءة عدادات البروكسي الحالية عند طلب /metrics"""
+    yield ('stream_viewers', 'gauge', 'Viewers attached to a shared upstream stream.',
+           [({'channel': key, 'server': 'wsgi'}, b['subscribers']) for key, b in get_hub().stats().items()])
+    
+    hosts = get_pool().stats()['hosts']
+    for field, kind, help_text in (
+        ('requests', 'counter', 'Requests sent to the origin host.'),
+        ('errors', 'counter', 'Origin requests that failed.'),
+        ('timeouts', 'counter', 'Origin requests that timed out.'),
+        ('active_streams', 'gauge', 'Streaming responses currently open to the origin host.'),
+    ):
+        name = f'upstream_{field}_total' if kind == 'counter' else f'upstream_{field}'
+        yield (name, kind, help_text, [({'host': host}, entry.get(field, 0)) for host, entry in hosts.items()])
+    
+    yield from metrics.cache_families('hls_segments', get_hls_hub().stats()['cache'])
+    
+    live = get_live_hub().stats()
+    yield ('live_packagers', 'gauge', 'Running live DASH packagers.',
+           [({}, sum(1 for p in live['packagers'].values() if p['running']))])
+    
+    origins = get_origin_router().stats()['origins']
+    yield ('origin_score', 'gauge', 'Ranking score per origin (EWMA seconds plus error penalty; lower wins).',
+           [({'origin': origin}, o.get('score')) for origin, o in origins.items()])
+    yield ('origin_error_rate', 'gauge', 'Decaying EWMA of failed requests per origin.',
+           [({'origin': origin}, o.get('error_rate')) for origin, o in origins.items()])
+    yield ('origin_decisions_total', 'counter', 'Routing decisions: primary, hedge, hedge_won, failover, stalled.',
+           [({'origin': origin, 'decision': decision}, n)
+            for origin, o in origins.items() for decision, n in o['decisions'].items()])
+    
+    counts = PROBER.summary()['channels']
+    yield ('channel_health', 'gauge', 'Channels by last probe result.',
+           [({'status': status}, n) for status, n in counts.items()])
+
+metrics.register_collector(proxy_metrics)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """المقاييس بتنسيق Prometheus"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def health_report():
+    """تقرير الحالة من ذاكرة الفاحص دون أي اتصال بالمصدر"""
+    summary = PROBER.summary()
+    counts = summary["channels"]
+    reference = next(iter(CATALOG), None)
+    reference_status = PROBER.status(reference.id) if reference is not None else None
+    
+    # الخدمة متدهورة فقط إذا فشلت كل القنوات التي تم فحصها
+    degraded = counts["up"] == 0 and counts["down"] > 0
+    report = {
+        "status": "degraded" if degraded else "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "channels": len(CATALOG),
+        "source": BASE_SOURCE,
+        "source_status": (reference_status or {}).get("http_status") or "unknown",
+        "probes": summary,
+        "upstream_pool": get_pool().stats(),
+        "origins": get_origin_router().stats(),
+        "broadcasts": get_hub().stats(),
+        "hls": get_hls_hub().stats(),
+        "live": get_live_hub().stats()
+    }
+    return report, 503 if degraded else 200
+
+@app.route('/health')
+def health():
+    """فحص حالة الخدمة"""
+    return health_report()
+
+@app.route('/channel/<channel_id>/status')
+def channel_status(channel_id):
+    """آخر حالة معروفة لقناة محددة"""
+    if channel_id not in CATALOG:
+        return {"error": "Channel not found"}, 404
+    
+    status = PROBER.status(channel_id) or {"status": "unknown"}
+    return {"id": channel_id, **status}
 
 @app.route('/channels')
 def channels_list():
-    """قائمة جميع القنوات بتنسيق JSON"""
-    channels_array = []
+    """قائمة القنوات بتنسيق JSON مع التصفية (group, tvg_id, name) والبحث (q) والصفحات (offset, limit)"""
+    try:
+        filters = channel_filters(request.args)
+    except ValueError as e:
+        return {"error": str(e)}, 400
     
-    for channel_id, channel_name in CHANNELS.items():
-        channels_array.append({
-            "id": channel_id,
-            "name": channel_name,
-            "url": f"{request.host_url.rstrip('/')}/channel/{channel_id}",
-            "source_url": f"{BASE_SOURCE}/{channel_id}"
-        })
+    status, headers, body = channels_payload(request.host_url, filters).respond(request.headers)
+    return Response(body, status=status, headers=headers)
+
+@app.route('/download/<conversion_id>/<filename>')
+@app.route('/api/download/<conversion_id>/<filename>')
+def download_artifact(conversion_id, filename):
+    """تنزيل ملفات التحويل من مخزن الملفات مع دعم Range والطلبات الشرطية
+
+    يمرّر send_file الملف عبر wsgi.file_wrapper فيستخدم الخادم sendfile دون نسخ.
+    """
+    artifact = artifacts.lookup(conversion_id)
+    if artifact is not None and filename == artifact.zip_name:
+        return download_bundle(artifact)
     
-    return {
-        "channels": channels_array,
-        "count": len(channels_array),
-        "generated_at": datetime.now().isoformat()
-    }
+    file_path = artifact.path(filename) if artifact is not None else None
+    if file_path is None:
+        return {"error": "File not found"}, 404
+    
+    etag, _ = artifacts.file_validators(os.stat(file_path))
+    response = send_file(
+        file_path,
+        mimetype='application/dash+xml' if filename.endswith('.mpd') else None,
+        as_attachment=filename == artifact.mpd_name,
+        conditional=True,
+        etag=etag.strip('"'),
+        max_age=0 if filename == artifact.mpd_name else 3600,
+    )
+    return response
+
+def download_bundle(artifact):
+    """أرشيف ZIP لملف MPD وكل المقاطع يُولَّد أثناء الإرسال دون ملف مؤقت
+
+    المدخلات مخزّنة دون ضغط فيُعرف الحجم ومواضع كل البايتات مسبقاً،
+    لذلك تعمل Content-Length وRange وتبقى الذاكرة ثابتة مهما كبر الأرشيف.
+    """
+    try:
+        archive = zipstream.for_artifact(artifact)
+    except zipstream.ZipTooLarge as e:
+        return {"error": str(e)}, 413
+    
+    headers = archive.headers(artifact.zip_name)
+    if artifacts.not_modified(request.headers, archive.etag, archive.mtime):
+        return Response(status=304, headers=headers)
+    
+    span = artifacts.byte_range(request.headers, archive.size, archive.etag)
+    if span is False:
+        headers['Content-Range'] = f'bytes */{archive.size}'
+        return Response(status=416, headers=headers)
+    start, end = span or (0, archive.size - 1)
+    if span:
+        headers['Content-Range'] = f'bytes {start}-{end}/{archive.size}'
+    headers['Content-Length'] = str(end - start + 1)
+    return Response(archive.iter_bytes(start, end), status=206 if span else 200, headers=headers,
+                    direct_passthrough=True)
 
 # هذا مهم لـ Vercel
 if __name__ == '__main__':
@@ -1,37 +1,92 @@
 import json
+import os
 import platform
 import subprocess
+import threading
 from datetime import datetime
+from urllib.parse import urlparse, parse_qs
 
+from api._lib import metrics, zipstream
+
+_ffmpeg_version = "Not available"
+
+def _read_ffmpeg_version():
+    """First line of `ffmpeg -version`"""
+    global _ffmpeg_version
+    try:
+        _ffmpeg_version = subprocess.check_output(
+            ['ffmpeg', '-version'], 
+            stderr=subprocess.STDOUT, 
+            text=True
+        ).split('\n')[0]
+    except:
+        pass
+
+# Started at import so the first status request does not wait for the
+# ffmpeg subprocess, and the import itself does not either
+_version_warmup = threading.Thread(target=_read_ffmpeg_version, name='ffmpeg-version', daemon=True)
+_version_warmup.start()
+
+def ffmpeg_version():
+    """The ffmpeg build, once the import-time warm-up has read it"""
+    _version_warmup.join()
+    return _ffmpeg_version
+
+def _function_max_durations():
+    """``maxDuration`` per function from vercel.json, when it is deployed alongside"""
+    path = os.path.join(os.path.dirname(__file__), '..', '..', 'vercel.json')
+    try:
+        with open(path) as f:
+            functions = json.load(f).get('functions') or {}
+    except (OSError, ValueError):
+        return {}
+    return {
+        source.split('/')[1]: config['maxDuration']
+        for source, config in functions.items()
+        if source.count('/') >= 2 and 'maxDuration' in config
+    }
+
+_max_durations = _function_max_durations()
+
+def status_metrics():
+    yield ('ffmpeg_info', 'gauge', 'FFmpeg build available to this function.', [({'version': ffmpeg_version()}, 1)])
+
+metrics.register_collector(status_metrics)
+
+@metrics.timed_handler('/api/status')
 def handler(request):
     """Service status endpoint"""
     try:
-        # Get FFmpeg version
-        try:
-            ffmpeg_version = subprocess.check_output(
-                ['ffmpeg', '-version'], 
-                stderr=subprocess.STDOUT, 
-                text=True
-            ).split('\n')[0]
-        except:
-            ffmpeg_version = "Not available"
+        if parse_qs(urlparse(request.path).query).get('format') == ['prometheus']:
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': metrics.CONTENT_TYPE},
+                'body': metrics.render()
+            }
         
+        # A synchronous conversion cannot outlive the convert function itself
+        conversion_timeout = int(os.environ.get('CONVERT_TIMEOUT', 300))
+        if 'convert' in _max_durations:
+            conversion_timeout = min(conversion_timeout, _max_durations['convert'])
+
         status = {
             'status': 'online',
             'service': 'M3U8 to MPD Converter',
             'version': '1.0.0',
             'timestamp': datetime.now().isoformat(),
             'platform': platform.platform(),
-            'ffmpeg': ffmpeg_version,
+            'ffmpeg': ffmpeg_version(),
             'endpoints': {
                 'convert': '/api/convert',
                 'status': '/api/status',
-                'download': '/api/download/{id}/{filename}'
+                'download': '/api/download/{id}/{filename}',
+                'metrics': '/api/convert?metrics'
             },
+            # Only limits this deployment actually enforces
             'limits': {
-                'max_duration': '5 minutes',
-                'max_file_size': '100MB',
-                'conversion_timeout': '300 seconds'
+                'max_response_bytes': zipstream.RESPONSE_MAX_BYTES,
+                'conversion_timeout': f"{conversion_timeout} seconds",
+                'max_duration_seconds': _max_durations,
             }
         }
         
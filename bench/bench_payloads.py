@@ -0,0 +1,90 @@
+"""Requests/sec for /playlist.m3u and /channels on a large catalog.
+
+Compares rebuilding the payload on every hit (the previous behaviour)
+against the precomputed payloads, for full 200 responses, gzip responses
+and 304 revalidations.  Runs in-process through the Flask test client,
+so it measures handler cost rather than network cost.
+
+    python -m bench.bench_payloads --channels 20000 --seconds 3 --output payloads.json
+"""
+import argparse
+import json
+import sys
+import time
+
+from flask import Response
+
+from api import index
+
+
+def legacy_playlist():
+    return Response(index.generate_m3u(), mimetype='audio/x-mpegurl', headers={
+        'Content-Disposition': 'attachment; filename="iptv_playlist.m3u"',
+        'Cache-Control': 'public, max-age=3600',
+        'Access-Control-Allow-Origin': '*',
+    })
+
+
+def legacy_channels():
+    from flask import request
+    return index.build_channels(request.host_url)
+
+
+def measure(client, path, seconds, headers=None):
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        response = client.get(path, headers=headers or {})
+        response.get_data()
+        count += 1
+    elapsed = time.perf_counter() - started
+    return {'requests': count, 'seconds': round(elapsed, 3), 'rps': round(count / elapsed, 1),
+            'status': response.status_code, 'bytes': len(response.get_data())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int, default=20000)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    index.set_channels({str(100000 + i): f'BENCH CHANNEL {i} HD' for i in range(args.channels)})
+    index.app.add_url_rule('/legacy/playlist.m3u', 'legacy_playlist', legacy_playlist)
+    index.app.add_url_rule('/legacy/channels', 'legacy_channels', legacy_channels)
+    client = index.app.test_client()
+
+    etag = {}
+    for path in ('/playlist.m3u', '/channels'):
+        etag[path] = client.get(path).headers['ETag']
+
+    results = {
+        'channels': args.channels,
+        'playlist': {
+            'before': measure(client, '/legacy/playlist.m3u', args.seconds),
+            'after': measure(client, '/playlist.m3u', args.seconds),
+            'after_gzip': measure(client, '/playlist.m3u', args.seconds, {'Accept-Encoding': 'gzip'}),
+            'after_304': measure(client, '/playlist.m3u', args.seconds, {'If-None-Match': etag['/playlist.m3u']}),
+        },
+        'channels_list': {
+            'before': measure(client, '/legacy/channels', args.seconds),
+            'after': measure(client, '/channels', args.seconds),
+            'after_gzip': measure(client, '/channels', args.seconds, {'Accept-Encoding': 'gzip'}),
+            'after_304': measure(client, '/channels', args.seconds, {'If-None-Match': etag['/channels']}),
+        },
+    }
+    for name in ('playlist', 'channels_list'):
+        section = results[name]
+        section['speedup'] = round(section['after']['rps'] / section['before']['rps'], 1)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
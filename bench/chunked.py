@@ -0,0 +1,97 @@
+"""Wall-clock speedup of chunked parallel transcoding against core count.
+
+Renders a VOD HLS clip into the fake origin's ``/vod/``, then re-encodes
+it to one preset:
+
+``single``   one ffmpeg over the whole input (the normal conversion path,
+             default threading)
+``chunks``   :func:`api._lib.chunked.transcode_chunked` with N chunks on a
+             scheduler of N cores, for each N in ``--chunks``
+
+Every run reports wall seconds, CPU seconds and speedup over ``single``.
+Speedups above 1 need as many free cores as chunks.
+
+    python -m bench.chunked --clip-seconds 120 --preset 720p --chunks 2,4,8 --output chunked.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from api._lib.chunked import transcode_chunked
+from api._lib.ffmpeg import run_ffmpeg
+from api._lib.scheduler import CoreScheduler, available_cores
+from api.convert.index import build_ffmpeg_cmd, dash_output_args, fetch_text, preset_video_args
+from bench.origin import FakeOrigin
+from bench.run import git_commit, render_clip
+
+
+def run_single(url, preset, segment_duration, workdir):
+    output = tempfile.mkdtemp(dir=workdir)
+    params = {'url': url, 'quality': preset, 'segment_duration': segment_duration}
+    usage = {}
+    started = time.perf_counter()
+    run_ffmpeg(build_ffmpeg_cmd(params, os.path.join(output, 'out.mpd')), on_usage=usage.update)
+    elapsed = time.perf_counter() - started
+    shutil.rmtree(output, ignore_errors=True)
+    return {'seconds': round(elapsed, 3), 'cpu_seconds': usage['cpu_seconds']}
+
+
+def run_chunked(url, preset, segment_duration, chunks, workdir):
+    output = tempfile.mkdtemp(dir=workdir)
+    scratch = tempfile.mkdtemp(dir=workdir)
+    started = time.perf_counter()
+    summary = transcode_chunked(url, chunks, preset_video_args(preset), segment_duration,
+                                dash_output_args(segment_duration, os.path.join(output, 'out.mpd'), window_size=0),
+                                scratch, CoreScheduler(chunks), fetch_text, min_seconds=1)
+    elapsed = time.perf_counter() - started
+    shutil.rmtree(output, ignore_errors=True)
+    shutil.rmtree(scratch, ignore_errors=True)
+    return {'chunks': summary['chunks'], 'seconds': round(elapsed, 3), 'cpu_seconds': summary['cpu_seconds']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clip-seconds', type=float, default=120.0)
+    parser.add_argument('--preset', default='720p')
+    parser.add_argument('--segment-duration', default='4')
+    parser.add_argument('--chunks', default='2,4', help='comma-separated chunk (and core) counts, each at least 2')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='bench-chunked-')
+    vod_dir = os.path.join(workdir, 'vod')
+    os.makedirs(vod_dir)
+    origin = FakeOrigin(vod_dir=vod_dir, seed=0).start()
+    try:
+        clip = render_clip(vod_dir, args.clip_seconds, 'fmp4')
+        url = f'{origin.url}/vod/{clip}'
+        single = run_single(url, args.preset, args.segment_duration, workdir)
+        runs = []
+        for chunks in (int(n) for n in args.chunks.split(',') if n):
+            run = run_chunked(url, args.preset, args.segment_duration, chunks, workdir)
+            run['speedup'] = round(single['seconds'] / run['seconds'], 2) if run['seconds'] else None
+            runs.append(run)
+    finally:
+        origin.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        'meta': {'commit': git_commit(), 'host_cores': available_cores(), 'clip_seconds': args.clip_seconds,
+                 'preset': args.preset, 'segment_duration': args.segment_duration},
+        'single': single,
+        'chunked': runs,
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
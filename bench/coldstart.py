@@ -0,0 +1,143 @@
+"""Cold-start import time of each serverless function, with a budget check.
+
+Every run imports one function module in a fresh interpreter, the way a
+cold Vercel instance does, and times the import (module-level work such
+as loading the catalog included).  ``-X importtime`` breaks the time down
+so the report names the modules that cost the most.  The median of
+``--runs`` samples is compared against the function's budget and the
+script exits with status 1 if any function is over it, so it can gate CI:
+
+    python -m bench.coldstart --runs 7 --output coldstart.json
+    python -m bench.coldstart --budget api.index=250 --budget api.status.index=20
+
+Background work that a function only starts on its first request (the
+health prober) is disabled, and no network catalog is configured.  Work
+a function starts in a thread at import (the status function's ffmpeg
+version lookup) runs, but is not waited for.
+
+This is a benchmark with a pass/fail exit status, not part of a test
+suite: the repository has none.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from bench.run import git_commit
+
+# Median import milliseconds allowed per function module
+BUDGETS_MS = {
+    'api.index': 350,
+    'api.convert.index': 60,
+    'api.download.index': 40,
+    'api.status.index': 30,
+}
+
+_MARKER = '-- coldstart --'
+
+_SNIPPET = f'''
+import sys, time
+sys.stderr.write({_MARKER!r} + '\\n')
+sys.stderr.flush()
+started = time.perf_counter()
+import {{module}}
+print(time.perf_counter() - started)
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(stderr):
+    """``[(depth, self_us, cumulative_us, name)]`` for imports after the marker."""
+    lines = stderr.split(_MARKER, 1)[-1].splitlines()
+    entries = []
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((depth, int(self_us), int(cumulative_us), name.strip()))
+    return entries
+
+
+def sample(module):
+    env = dict(os.environ, PROBE_ENABLED='0', PYTHONDONTWRITEBYTECODE='1')
+    env.pop('CHANNELS_M3U', None)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', _SNIPPET.format(module=module)],
+                             cwd=ROOT, env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f'importing {module} failed:\n{process.stderr[-2000:]}')
+    return float(process.stdout.strip().splitlines()[-1]) * 1000, parse_importtime(process.stderr)
+
+
+def heaviest(module, entries, top):
+    """Modules the function imports directly, by cumulative time."""
+    direct = [e for e in entries if e[0] <= 1 and e[3] != module]
+    direct.sort(key=lambda e: e[2], reverse=True)
+    return [{'module': name, 'cumulative_ms': round(cumulative / 1000, 1), 'self_ms': round(own / 1000, 1)}
+            for _, own, cumulative, name in direct[:top]]
+
+
+def measure(module, runs, top):
+    samples = []
+    breakdown = None
+    for _ in range(runs):
+        elapsed, entries = sample(module)
+        samples.append(elapsed)
+        if breakdown is None or elapsed <= min(samples):
+            breakdown = entries
+    return {
+        'median_ms': round(statistics.median(samples), 1),
+        'min_ms': round(min(samples), 1),
+        'max_ms': round(max(samples), 1),
+        'modules_imported': len(breakdown),
+        'heaviest': heaviest(module, breakdown, top),
+    }
+
+
+def parse_budgets(values):
+    budgets = dict(BUDGETS_MS)
+    for value in values or ():
+        module, _, ms = value.partition('=')
+        budgets[module] = float(ms)
+    return budgets
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='heaviest imports listed per function')
+    parser.add_argument('--budget', action='append', metavar='MODULE=MS',
+                        help='override or add a function budget (repeatable)')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    budgets = parse_budgets(args.budget)
+    functions = {}
+    over = []
+    for module, budget in budgets.items():
+        result = measure(module, args.runs, args.top)
+        result['budget_ms'] = budget
+        result['within_budget'] = result['median_ms'] <= budget
+        if not result['within_budget']:
+            over.append(module)
+        functions[module] = result
+
+    results = {'meta': {'commit': git_commit(), 'python': sys.version.split()[0], 'runs': args.runs},
+               'functions': functions, 'over_budget': over}
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+    for module in over:
+        print(f'{module}: {functions[module]["median_ms"]} ms is over its {budgets[module]} ms budget',
+              file=sys.stderr)
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""Threaded HTTP load generator used by the benchmark runner.
+
+:func:`viewers` holds N concurrent streaming GETs open for a fixed time
+and reports per-viewer TTFB and aggregate throughput; :func:`hammer`
+repeats short GETs from N threads and reports requests/sec and latency
+percentiles.  Both use ``http.client`` directly so the client side stays
+cheap next to the server under test.
+"""
+import http.client
+import math
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(values, q):
+    """Nearest-rank percentile (``q`` in 0..100) of ``values``, or None."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def latency_summary(seconds):
+    """p50/p90/p99/max in milliseconds."""
+    return {
+        f'{name}_ms': round(value * 1000, 2) if value is not None else None
+        for name, value in (('p50', percentile(seconds, 50)), ('p90', percentile(seconds, 90)),
+                            ('p99', percentile(seconds, 99)), ('max', max(seconds, default=None)))
+    }
+
+
+def _connect(url, timeout):
+    parts = urlsplit(url)
+    conn_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return conn_class(parts.hostname, parts.port, timeout=timeout), path
+
+
+def _view(url, seconds, chunk_size, timeout, result):
+    started = time.perf_counter()
+    conn, path = _connect(url, timeout)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        result['status'] = response.status
+        first = response.read1(chunk_size) if response.status == 200 else b''
+        if first:
+            result['ttfb'] = time.perf_counter() - started
+            result['bytes'] += len(first)
+        deadline = started + seconds
+        while first and time.perf_counter() < deadline:
+            data = response.read1(chunk_size)
+            if not data:
+                break
+            result['bytes'] += len(data)
+    except (OSError, http.client.HTTPException) as e:
+        result['error'] = type(e).__name__
+    finally:
+        result['seconds'] = time.perf_counter() - started
+        conn.close()
+
+
+def viewers(url, count, seconds, chunk_size=65536, timeout=30.0, ramp=0.0):
+    """Open ``count`` streams of ``url`` at once (spread over ``ramp`` seconds)."""
+    results = [{'bytes': 0, 'ttfb': None, 'status': None, 'error': None} for _ in range(count)]
+    threads = []
+    for n, result in enumerate(results):
+        thread = threading.Thread(target=_view, args=(url, seconds, chunk_size, timeout, result), daemon=True)
+        thread.start()
+        threads.append(thread)
+        if ramp and n + 1 < count:
+            time.sleep(ramp / count)
+    for thread in threads:
+        thread.join(seconds + timeout)
+
+    ttfb = [r['ttfb'] for r in results if r['ttfb'] is not None]
+    total_bytes = sum(r['bytes'] for r in results)
+    elapsed = max((r.get('seconds', 0) for r in results), default=0)
+    per_viewer = [r['bytes'] * 8 / r['seconds'] / 1e6 for r in results if r['ttfb'] is not None and r['seconds']]
+    return {
+        'viewers': count,
+        'seconds': round(elapsed, 3),
+        'ok': len(ttfb),
+        'errors': count - len(ttfb),
+        'bytes': total_bytes,
+        'throughput_mbps': round(total_bytes * 8 / elapsed / 1e6, 2) if elapsed else 0,
+        'viewer_mbps_min': round(min(per_viewer), 3) if per_viewer else None,
+        'viewer_mbps_p50': round(percentile(per_viewer, 50), 3) if per_viewer else None,
+        'ttfb': latency_summary(ttfb),
+    }
+
+
+def _hammer(url, deadline, timeout, latencies, statuses, lock):
+    conn, path = _connect(url, timeout)
+    local, codes = [], {}
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                if response.will_close:
+                    conn.close()
+                code = response.status
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                code = type(e).__name__
+            local.append(time.perf_counter() - started)
+            codes[code] = codes.get(code, 0) + 1
+    finally:
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            for code, n in codes.items():
+                statuses[code] = statuses.get(code, 0) + n
+
+
+def hammer(url, concurrency, seconds, timeout=30.0):
+    """Keep-alive GETs of ``url`` from ``concurrency`` threads for ``seconds``."""
+    latencies, statuses, lock = [], {}, threading.Lock()
+    started = time.perf_counter()
+    deadline = started + seconds
+    threads = [threading.Thread(target=_hammer, args=(url, deadline, timeout, latencies, statuses, lock),
+                                daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(seconds + timeout)
+    elapsed = time.perf_counter() - started
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+        'status': {str(code): n for code, n in sorted(statuses.items(), key=str)},
+        'latency': latency_summary(latencies),
+    }
@@ -0,0 +1,213 @@
+"""Fake IPTV/HLS origin serving synthetic streams for the benchmarks.
+
+Routes (``<id>`` is any channel id):
+
+``/live/<id>``               endless MPEG-TS at ``bitrate_kbps``
+``/live/<id>.m3u8``          live HLS playlist over a sliding segment window
+``/live/<id>/<seq>.ts``      one synthetic TS segment of that playlist
+``/vod/<path>``              files from ``vod_dir`` (real media for conversions)
+
+Live payloads are valid 188-byte TS packets carrying filler, which is all
+the proxy needs; they do not decode.  Every request first waits
+``latency`` seconds and fails with 503 with probability ``failure_rate``.
+``bitrate_kbps=0`` sends as fast as the socket accepts.
+
+    python -m bench.origin --port 9000 --bitrate 4000 --latency 0.05 --failure-rate 0.01
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TS_PACKET = 188
+TS_CONTENT_TYPE = 'video/mp2t'
+PLAYLIST_CONTENT_TYPE = 'application/vnd.apple.mpegurl'
+
+
+def ts_packets(count, pid=0x100):
+    """``count`` TS packets with a running continuity counter."""
+    packets = bytearray()
+    for n in range(count):
+        header = bytes([0x47, (0x40 if n == 0 else 0) | (pid >> 8 & 0x1F), pid & 0xFF, 0x10 | (n & 0x0F)])
+        packets += header + b'\xff' * (TS_PACKET - len(header))
+    return bytes(packets)
+
+
+class OriginStats:
+    def __init__(self):
+        self.requests = 0
+        self.streams_opened = 0
+        self.failures = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                setattr(self, key, getattr(self, key) + value)
+
+    def to_dict(self):
+        with self._lock:
+            return {'requests': self.requests, 'streams_opened': self.streams_opened,
+                    'failures': self.failures, 'bytes_sent': self.bytes_sent}
+
+
+class _OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, delayed
+    # ACKs add ~40 ms to every keep-alive response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        origin = self.server.origin
+        origin.stats.add(requests=1)
+        if origin.latency:
+            time.sleep(origin.latency)
+        if origin.failure_rate and origin.random.random() < origin.failure_rate:
+            origin.stats.add(failures=1)
+            self._reply(503, b'synthetic failure', 'text/plain')
+            return
+
+        path = self.path.split('?', 1)[0]
+        parts = path.strip('/').split('/')
+        try:
+            if parts[0] == 'live' and len(parts) == 2 and parts[1].endswith('.m3u8'):
+                self._reply(200, origin.live_playlist(parts[1][:-len('.m3u8')]), PLAYLIST_CONTENT_TYPE)
+            elif parts[0] == 'live' and len(parts) == 2:
+                self._stream()
+            elif parts[0] == 'live' and len(parts) == 3 and parts[2].endswith('.ts'):
+                self._reply(200, origin.segment, TS_CONTENT_TYPE)
+            elif parts[0] == 'vod' and origin.vod_dir:
+                self._vod('/'.join(parts[1:]))
+            else:
+                self._reply(404, b'not found', 'text/plain')
+        except ConnectionError:
+            pass
+
+    def _reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.origin.stats.add(bytes_sent=len(body))
+
+    def _vod(self, relative):
+        root = os.path.realpath(self.server.origin.vod_dir)
+        path = os.path.realpath(os.path.join(root, relative))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path):
+            self._reply(404, b'not found', 'text/plain')
+            return
+        with open(path, 'rb') as f:
+            body = f.read()
+        content_type = PLAYLIST_CONTENT_TYPE if path.endswith('.m3u8') else (
+            TS_CONTENT_TYPE if path.endswith('.ts') else 'video/mp4')
+        self._reply(200, body, content_type)
+
+    def _stream(self):
+        origin = self.server.origin
+        origin.stats.add(streams_opened=1)
+        self.send_response(200)
+        self.send_header('Content-Type', TS_CONTENT_TYPE)
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        chunk = origin.chunk
+        interval = len(chunk) * 8 / (origin.bitrate_kbps * 1000) if origin.bitrate_kbps else 0
+        started = time.monotonic()
+        sent = 0
+        while not origin.stopped:
+            self.wfile.write(chunk)
+            sent += 1
+            origin.stats.add(bytes_sent=len(chunk))
+            if interval:
+                delay = started + sent * interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+
+class FakeOrigin:
+    """Threaded HTTP origin; use as a context manager or call start/stop."""
+
+    def __init__(self, host='127.0.0.1', port=0, bitrate_kbps=4000, latency=0.0, failure_rate=0.0,
+                 segment_duration=4.0, window=6, vod_dir=None, seed=None):
+        self.bitrate_kbps = bitrate_kbps
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.segment_duration = segment_duration
+        self.window = window
+        self.vod_dir = vod_dir
+        self.random = random.Random(seed)
+        self.stats = OriginStats()
+        self.stopped = False
+        # ~100 ms of stream per write (64 KiB when unpaced)
+        chunk_bytes = bitrate_kbps * 1000 // 8 // 10 if bitrate_kbps else 65536
+        self.chunk = ts_packets(max(1, chunk_bytes // TS_PACKET))
+        segment_bytes = int((bitrate_kbps or 4000) * 1000 / 8 * segment_duration)
+        self.segment = ts_packets(max(1, segment_bytes // TS_PACKET))
+        self._started = time.time()
+        self._server = ThreadingHTTPServer((host, port), _OriginHandler)
+        self._server.daemon_threads = True
+        self._server.origin = self
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def live_playlist(self, channel_id):
+        newest = int((time.time() - self._started) / self.segment_duration)
+        first = max(0, newest - self.window + 1)
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3',
+                 f'#EXT-X-TARGETDURATION:{int(self.segment_duration + 0.999)}',
+                 f'#EXT-X-MEDIA-SEQUENCE:{first}']
+        for seq in range(first, newest + 1):
+            lines += [f'#EXTINF:{self.segment_duration:.3f},', f'{channel_id}/{seq}.ts']
+        return ('\n'.join(lines) + '\n').encode()
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='fake-origin', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped = True
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--bitrate', type=int, default=4000, help='kbit/s per live stream, 0 = unpaced')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each response')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of requests answered 503')
+    parser.add_argument('--vod-dir', help='directory served under /vod/')
+    args = parser.parse_args(argv)
+
+    origin = FakeOrigin(args.host, args.port, args.bitrate, args.latency, args.failure_rate,
+                        vod_dir=args.vod_dir).start()
+    print(f'fake origin on {origin.url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        origin.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
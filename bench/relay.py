@@ -0,0 +1,149 @@
+"""CPU cost per Gbit relayed: iter_content loops versus the ChunkReader.
+
+The fake origin runs unpaced in a child process, so this process's CPU
+time is the relay alone.  Two measurements:
+
+``readers``  one upstream read as fast as possible by each read loop,
+             CPU seconds (of the reading thread) per Gbit read
+``fanout``   a :class:`Broadcaster` feeding N in-process viewers, with the
+             legacy ``iter_content(8192)`` loop and with the ChunkReader,
+             process CPU seconds per Gbit delivered to viewers
+
+    python -m bench.relay --seconds 5 --viewers 1,10,50 --output relay.json
+"""
+import argparse
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from api._lib.broadcast import Broadcaster
+from api._lib.relay import ChunkReader
+
+
+class LegacyBroadcaster(Broadcaster):
+    """The relay loop before ChunkReader: fixed 8 KiB ``iter_content`` reads."""
+
+    def _chunks(self):
+        return self._upstream.iter_content(chunk_size=8192)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_origin():
+    port = free_port()
+    process = subprocess.Popen([sys.executable, '-m', 'bench.origin', '--port', str(port), '--bitrate', '0'],
+                               stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('fake origin did not start')
+
+
+def per_gbit(cpu_seconds, nbytes):
+    return round(cpu_seconds / (nbytes * 8 / 1e9), 4) if nbytes else None
+
+
+def bench_reader(url, make_iter, seconds):
+    response = requests.get(url, stream=True)
+    total = 0
+    cpu_started, started = time.thread_time(), time.perf_counter()
+    deadline = started + seconds
+    for chunk in make_iter(response):
+        total += len(chunk)
+        if time.perf_counter() >= deadline:
+            break
+    cpu = time.thread_time() - cpu_started
+    elapsed = time.perf_counter() - started
+    response.close()
+    return {'bytes': total, 'seconds': round(elapsed, 3), 'gbps': round(total * 8 / elapsed / 1e9, 3),
+            'cpu_seconds': round(cpu, 3), 'cpu_seconds_per_gbit': per_gbit(cpu, total)}
+
+
+def bench_fanout(url, broadcaster_class, viewers, seconds):
+    def open_upstream():
+        response = requests.get(url, stream=True)
+        return response, lambda error=None: response.close()
+
+    broadcaster = broadcaster_class('bench', open_upstream).start()
+    delivered = [0] * viewers
+    stop = threading.Event()
+
+    def view(n):
+        for chunk in broadcaster.subscribe():
+            delivered[n] += len(chunk)
+            if stop.is_set():
+                break
+
+    threads = [threading.Thread(target=view, args=(n,), daemon=True) for n in range(viewers)]
+    cpu_started, started = time.process_time(), time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    cpu = time.process_time() - cpu_started
+    elapsed = time.perf_counter() - started
+    broadcaster.close()
+    for thread in threads:
+        thread.join(5)
+    stats = broadcaster.stats()
+    total = sum(delivered)
+    return {'viewers': viewers, 'bytes_in': stats['bytes_in'], 'bytes_out': total,
+            'gbps_out': round(total * 8 / elapsed / 1e9, 3), 'cpu_seconds': round(cpu, 3),
+            'cpu_seconds_per_gbit': per_gbit(cpu, total), 'skips': stats['skips'], 'drops': stats['drops']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--viewers', default='1,10,50')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    process, origin = start_origin()
+    url = f'{origin}/live/bench'
+    try:
+        readers = {
+            'iter_content_8k': bench_reader(url, lambda r: r.iter_content(8192), args.seconds),
+            'iter_content_64k': bench_reader(url, lambda r: r.iter_content(65536), args.seconds),
+            'chunk_reader': bench_reader(url, ChunkReader, args.seconds),
+        }
+        fanout = []
+        for viewers in (int(n) for n in args.viewers.split(',') if n):
+            legacy = bench_fanout(url, LegacyBroadcaster, viewers, args.seconds)
+            buffered = bench_fanout(url, Broadcaster, viewers, args.seconds)
+            fanout.append({
+                'viewers': viewers,
+                'legacy': legacy,
+                'chunk_reader': buffered,
+                'cpu_per_gbit_ratio': (round(legacy['cpu_seconds_per_gbit'] / buffered['cpu_seconds_per_gbit'], 2)
+                                       if legacy['cpu_seconds_per_gbit'] and buffered['cpu_seconds_per_gbit'] else None),
+            })
+    finally:
+        process.terminate()
+        process.wait()
+
+    results = {'readers': readers, 'fanout': fanout}
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
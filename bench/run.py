@@ -0,0 +1,213 @@
+"""End-to-end benchmarks against a local fake origin, written as JSON.
+
+Starts :class:`bench.origin.FakeOrigin`, points the catalog at it, serves
+the Flask app on a loopback port and measures:
+
+``channel``   ``/channel/<id>`` throughput, TTFB p50/p99 and upstream
+              connections for each viewer count in ``--viewers``
+``playlist``  ``/playlist.m3u`` requests/sec and latency
+``convert``   ``/api/convert`` jobs/hour per quality preset, on a short
+              clip ffmpeg renders into the origin's ``/vod/`` first
+
+Every run records the git commit, so two result files from different
+commits can be diffed directly.
+
+    python -m bench.run --viewers 1,10,50 --seconds 10 --output bench.json
+    python -m bench.run --scenarios convert --presets copy,auto,360p --jobs 4
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from bench import load
+from bench.origin import FakeOrigin
+
+SCENARIOS = ('channel', 'playlist', 'convert')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def serve(app):
+    """Run ``app`` on a threaded loopback server; returns ``(base_url, server)``."""
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server
+
+
+def bench_channel(base_url, origin, channel_ids, viewer_counts, seconds):
+    rounds = []
+    for channel_id, count in zip(channel_ids, viewer_counts):
+        before = origin.stats.to_dict()['streams_opened']
+        result = load.viewers(f'{base_url}/channel/{channel_id}', count, seconds)
+        result['upstream_connections'] = origin.stats.to_dict()['streams_opened'] - before
+        rounds.append(result)
+    return {'origin_bitrate_kbps': origin.bitrate_kbps, 'rounds': rounds}
+
+
+def bench_playlist(base_url, concurrency, seconds):
+    return load.hammer(f'{base_url}/playlist.m3u', concurrency, seconds)
+
+
+def render_clip(directory, seconds, segment_type):
+    """A 720p H.264/AAC VOD HLS clip in ``directory``; returns the playlist name."""
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=25',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-t', str(seconds),
+        '-c:v', 'libx264', '-preset', 'veryfast', '-g', '50', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k',
+        '-f', 'hls', '-hls_time', '2', '-hls_playlist_type', 'vod',
+        '-hls_segment_type', segment_type,
+        os.path.join(directory, 'clip.m3u8'),
+    ]
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL, capture_output=True, timeout=300)
+    return 'clip.m3u8'
+
+
+class _Request:
+    """The attributes the Vercel handlers read from a request."""
+
+    def __init__(self, method, path, body='', headers=None):
+        self.method = method
+        self.path = path
+        self.body = body
+        self.headers = headers or {}
+
+
+def bench_convert(source_url, presets, jobs, timeout):
+    from api.convert import index as convert
+    from api._lib.jobs import get_job_queue
+
+    results = {}
+    for preset in presets:
+        submitted = []
+        started = time.perf_counter()
+        for n in range(jobs):
+            # A unique query string per job keeps the result cache out of the measurement.
+            body = json.dumps({'url': f'{source_url}?bench={preset}-{n}-{time.time_ns()}', 'quality': preset})
+            response = convert.handler(_Request('POST', '/api/convert', body))
+            payload = json.loads(response['body'])
+            if response['statusCode'] != 202:
+                submitted.append((None, payload.get('error')))
+                continue
+            submitted.append((get_job_queue().get(payload['job_id']), None))
+
+        durations, modes, errors = [], {}, []
+        for job, error in submitted:
+            if job is not None and not job.wait(timeout):
+                error = 'timed out'
+            elif job is not None and job.state != 'done':
+                error = job.error
+            if error:
+                errors.append(error)
+                continue
+            durations.append(job.finished - job.started)
+            modes[job.result['mode']] = modes.get(job.result['mode'], 0) + 1
+        elapsed = time.perf_counter() - started
+        results[preset] = {
+            'jobs': jobs,
+            'done': len(durations),
+            'failed': len(errors),
+            'seconds': round(elapsed, 3),
+            'jobs_per_hour': round(len(durations) / elapsed * 3600, 1) if elapsed else 0,
+            'job_seconds': load.latency_summary(durations),
+            'modes': modes,
+            'errors': errors[:3],
+        }
+    return {'workers': get_job_queue().workers, 'presets': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset of %(default)s')
+    parser.add_argument('--viewers', default='1,10,50', help='viewer counts for the channel scenario')
+    parser.add_argument('--seconds', type=float, default=10.0, help='duration of each channel/playlist round')
+    parser.add_argument('--bitrate', type=int, default=4000, help='origin kbit/s per stream, 0 = unpaced')
+    parser.add_argument('--latency', type=float, default=0.0, help='origin seconds before each response')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of origin requests answered 503')
+    parser.add_argument('--channels', type=int, default=5000, help='catalog size for the playlist scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='playlist client threads')
+    parser.add_argument('--presets', default='copy,auto,720p,480p,360p', help='qualities for the convert scenario')
+    parser.add_argument('--jobs', type=int, default=4, help='conversions per preset')
+    parser.add_argument('--clip-seconds', type=int, default=20, help='length of the clip to convert')
+    parser.add_argument('--segment-type', default='mpegts', choices=('mpegts', 'fmp4'))
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {sorted(unknown)}')
+
+    workdir = tempfile.mkdtemp(prefix='ds-bench-')
+    # Keep background probing and conversion outputs out of the way of the run.
+    os.environ.setdefault('PROBE_ENABLED', '0')
+    os.environ.setdefault('ARTIFACT_ROOT', os.path.join(workdir, 'artifacts'))
+    vod_dir = os.path.join(workdir, 'vod')
+    os.makedirs(vod_dir)
+
+    origin = FakeOrigin(bitrate_kbps=args.bitrate, latency=args.latency, failure_rate=args.failure_rate,
+                        vod_dir=vod_dir, seed=0).start()
+    from api import index
+    index.BASE_SOURCE = f'{origin.url}/live'
+    index.set_channels({str(100000 + i): f'BENCH CHANNEL {i} HD' for i in range(args.channels)})
+    base_url, server = serve(index.app)
+
+    viewer_counts = [int(n) for n in args.viewers.split(',') if n]
+    results = {}
+    try:
+        if 'channel' in scenarios:
+            # A fresh channel per round, so each starts with a cold upstream.
+            channel_ids = [str(100000 + i) for i in range(len(viewer_counts))]
+            results['channel'] = bench_channel(base_url, origin, channel_ids, viewer_counts, args.seconds)
+        if 'playlist' in scenarios:
+            results['playlist'] = bench_playlist(base_url, args.concurrency, args.seconds)
+        if 'convert' in scenarios:
+            try:
+                clip = render_clip(vod_dir, args.clip_seconds, args.segment_type)
+            except (OSError, subprocess.SubprocessError) as e:
+                results['convert'] = {'error': f'could not render the source clip: {e}'}
+            else:
+                results['convert'] = bench_convert(f'{origin.url}/vod/{clip}', args.presets.split(','),
+                                                   args.jobs, timeout=600)
+    finally:
+        server.shutdown()
+        origin.stop()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': vars(args),
+        },
+        'origin': origin.stats.to_dict(),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
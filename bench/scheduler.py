@@ -0,0 +1,149 @@
+"""Conversion throughput with and without the core scheduler.
+
+A mixed batch of conversions (``--mix``, e.g. two 720p, two 360p and four
+stream copies) is submitted at once to a :class:`JobQueue` and run on a
+clip ffmpeg renders locally first, in two configurations:
+
+``naive``      one lane of ``--naive-workers`` workers (the old default of
+               2), every ffmpeg with default threading and niceness
+``scheduled``  a transcode lane limited by :class:`CoreScheduler` thread
+               budgets plus a separate remux lane, with lane niceness
+
+Reported per configuration: makespan, jobs/hour, per-lane job latency
+(submit to finish) and the CPU seconds ffmpeg consumed, from ``wait4``.
+
+    python -m bench.scheduler --cores 4 --mix 720p:2,480p:2,360p:2,copy:4 --output scheduler.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from api._lib.ffmpeg import run_ffmpeg
+from api._lib.jobs import JobQueue
+from api._lib.scheduler import REMUX, TRANSCODE, CoreScheduler, available_cores, limit_threads
+from api.convert.index import build_ffmpeg_cmd
+from bench import load
+from bench.run import git_commit
+
+
+def render_source(directory, seconds):
+    """A 720p H.264/AAC MP4 clip; returns its path."""
+    path = os.path.join(directory, 'source.mp4')
+    subprocess.run([
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=25',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-t', str(seconds),
+        '-c:v', 'libx264', '-preset', 'veryfast', '-g', '50', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k', path,
+    ], check=True, stdin=subprocess.DEVNULL, capture_output=True, timeout=300)
+    return path
+
+
+def parse_mix(value):
+    qualities = []
+    for item in value.split(','):
+        quality, _, count = item.partition(':')
+        qualities += [quality.strip()] * int(count or 1)
+    return qualities
+
+
+def run_batch(source, qualities, workdir, scheduler=None, naive_workers=2, timeout=600):
+    """Submit every conversion at once and wait for all of them."""
+    if scheduler is None:
+        jobs = JobQueue(workers=naive_workers, max_queue=len(qualities))
+    else:
+        jobs = JobQueue(workers=scheduler.cores, max_queue=len(qualities),
+                        lanes={REMUX: scheduler.remux_workers})
+
+    def convert(job):
+        params = job.params
+        output = os.path.join(workdir, job.id)
+        os.makedirs(output)
+        cmd = build_ffmpeg_cmd(params, os.path.join(output, 'out.mpd'))
+        usage = {}
+        if scheduler is None:
+            run_ffmpeg(cmd, on_usage=usage.update, timeout=timeout)
+        else:
+            lane = scheduler.lane_for(params)
+            threads = scheduler.thread_budget(params)
+            with scheduler.reserve(threads, lane):
+                run_ffmpeg(limit_threads(cmd, threads), nice=scheduler.nice[lane],
+                           on_usage=usage.update, timeout=timeout)
+        shutil.rmtree(output, ignore_errors=True)
+        return usage
+
+    started = time.perf_counter()
+    submitted = []
+    for quality in qualities:
+        params = {'url': source, 'quality': quality, 'segment_duration': '4'}
+        if quality == 'abr':
+            params['ladder'] = ['720p', '480p', '360p']
+        lane = scheduler.lane_for(params) if scheduler is not None else None
+        submitted.append((quality, jobs.submit(convert, params, lane=lane)))
+
+    latencies = {REMUX: [], TRANSCODE: []}
+    cpu_seconds, errors = 0.0, []
+    for quality, job in submitted:
+        job.wait(timeout)
+        if job.state != 'done':
+            errors.append(job.error or 'timed out')
+            continue
+        latencies[REMUX if quality == 'copy' else TRANSCODE].append(job.finished - job.created)
+        cpu_seconds += job.result.get('cpu_seconds', 0.0)
+    elapsed = time.perf_counter() - started
+    done = sum(len(values) for values in latencies.values())
+    return {
+        'jobs': len(qualities),
+        'done': done,
+        'failed': len(errors),
+        'makespan_seconds': round(elapsed, 3),
+        'jobs_per_hour': round(done / elapsed * 3600, 1) if elapsed else 0,
+        'latency': {lane: load.latency_summary(values) for lane, values in latencies.items() if values},
+        'cpu_seconds': round(cpu_seconds, 3),
+        'errors': errors[:3],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cores', type=int, default=available_cores(),
+                        help='cores the scheduler may use (default: this host)')
+    parser.add_argument('--mix', default='720p:2,480p:2,360p:2,copy:4',
+                        help='quality:count pairs submitted together')
+    parser.add_argument('--clip-seconds', type=float, default=20.0)
+    parser.add_argument('--naive-workers', type=int, default=2)
+    parser.add_argument('--remux-workers', type=int, default=4)
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    qualities = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory(prefix='bench-scheduler-') as workdir:
+        source = render_source(workdir, args.clip_seconds)
+        naive = run_batch(source, qualities, workdir, naive_workers=args.naive_workers)
+        scheduled = run_batch(source, qualities, workdir,
+                              scheduler=CoreScheduler(args.cores, remux_workers=args.remux_workers))
+
+    results = {
+        'meta': {'commit': git_commit(), 'cores': args.cores, 'host_cores': available_cores(),
+                 'mix': args.mix, 'clip_seconds': args.clip_seconds},
+        'naive': naive,
+        'scheduled': scheduled,
+        'throughput_ratio': (round(scheduled['jobs_per_hour'] / naive['jobs_per_hour'], 2)
+                             if naive['jobs_per_hour'] else None),
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())